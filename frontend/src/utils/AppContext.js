@@ -1,4 +1,4 @@
-import React, { createContext, useState, useEffect, useContext } from 'react';
+import React, { createContext, useState, useEffect, useContext, useRef } from 'react';
 import axios from 'axios';
 
 // Default persona settings
@@ -49,6 +49,9 @@ export const AppContextProvider = ({ children, showNotification }) => {
   const [chatState, setChatState] = useState(DEFAULT_CHAT_STATE);
   
   const [history, setHistory] = useState([]);
+  // Cursor and ETag of the history we already have, so polls only fetch changes
+  const historyCursor = useRef(null);
+  const historyEtag = useRef(null);
   const [availableModels, setAvailableModels] = useState([]);
   const [loading, setLoading] = useState(false);
   
@@ -105,12 +108,34 @@ export const AppContextProvider = ({ children, showNotification }) => {
     localStorage.setItem('chatState', JSON.stringify(chatState));
   }, [chatState]);
   
-  // Fetch history on component mount and periodically
+  // Fetch history on component mount and follow changes pushed by the server
   useEffect(() => {
     fetchHistory();
-    const interval = setInterval(fetchHistory, 5000); // Poll every 5 seconds
     
-    return () => clearInterval(interval);
+    // Fall back to polling every 5 seconds where Server-Sent Events are unavailable
+    if (typeof EventSource === 'undefined') {
+      const interval = setInterval(fetchHistory, 5000);
+      return () => clearInterval(interval);
+    }
+    
+    const source = new EventSource('/api/history/stream');
+    
+    // Sent on every (re)connect: catch up on anything missed while disconnected
+    source.addEventListener('ready', () => fetchHistory());
+    
+    source.addEventListener('append', (event) => {
+      const { entry, version } = JSON.parse(event.data);
+      setHistory(prev => (
+        prev.some(existing => existing.message_id === entry.message_id) ? prev : [...prev, entry]
+      ));
+      historyCursor.current = entry.message_id;
+      historyEtag.current = `"${version}"`;
+    });
+    
+    // History was imported or cleared; the next fetch sees the reset
+    source.addEventListener('reset', () => fetchHistory());
+    
+    return () => source.close();
   }, []);
   
   // Fetch available models on component mount
@@ -129,8 +154,30 @@ export const AppContextProvider = ({ children, showNotification }) => {
   // API functions
   const fetchHistory = async () => {
     try {
-      const response = await axios.get('/api/history');
-      setHistory(response.data.history);
+      const params = historyCursor.current ? { after: historyCursor.current } : {};
+      const headers = historyEtag.current ? { 'If-None-Match': historyEtag.current } : {};
+      const response = await axios.get('/api/history', {
+        params,
+        headers,
+        validateStatus: (status) => status === 200 || status === 304
+      });
+      
+      // Nothing changed since the last poll
+      if (response.status === 304) return;
+      
+      const { history: entries, next_cursor, reset } = response.data;
+      if (reset || !historyCursor.current) {
+        setHistory(entries);
+      } else if (entries.length > 0) {
+        // Entries the event stream already appended are skipped
+        setHistory(prev => {
+          const known = new Set(prev.map(existing => existing.message_id));
+          const added = entries.filter(entry => !known.has(entry.message_id));
+          return added.length > 0 ? [...prev, ...added] : prev;
+        });
+      }
+      historyCursor.current = next_cursor;
+      historyEtag.current = response.headers.etag || null;
     } catch (error) {
       console.error('Error fetching history:', error);
     }
@@ -0,0 +1,134 @@
+from fastapi import APIRouter, HTTPException
+from datetime import datetime
+import logging
+
+from app.models.schemas import (
+    AutoRespondJobRequest,
+    AutoRespondJobInfo,
+    AutoRespondJobResponse,
+    AutoRespondJobListResponse
+)
+from app.services import conversation_runner
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+def _job_response(job: conversation_runner.ConversationJob) -> AutoRespondJobResponse:
+    return AutoRespondJobResponse(
+        job=AutoRespondJobInfo(**job.to_dict()),
+        status="success",
+        timestamp=datetime.utcnow().isoformat() + "Z"
+    )
+
+@router.post("/auto-respond/jobs", response_model=AutoRespondJobResponse)
+async def start_job(request: AutoRespondJobRequest):
+    """
+    Start a server-side auto-response conversation
+    
+    Args:
+        request: The persona settings, seed message and turn counts per persona
+        
+    Returns:
+        The started job
+    """
+    try:
+        logger.info(f"Starting auto-response job from {request.message.sender} to {request.message.recipients}")
+        
+        job = conversation_runner.start_job(
+            persona_settings=request.persona_settings,
+            message=request.message,
+            turns=request.turns,
+            conversation_id=request.conversation_id
+        )
+        
+        return _job_response(job)
+    
+    except ValueError as e:
+        logger.error(f"Invalid auto-response job: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Invalid auto-response job: {str(e)}")
+    
+    except conversation_runner.JobLimitError as e:
+        logger.warning(f"Rejected auto-response job: {str(e)}")
+        raise HTTPException(status_code=429, detail=str(e))
+    
+    except Exception as e:
+        logger.error(f"Error starting auto-response job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error starting auto-response job: {str(e)}")
+
+@router.get("/auto-respond/jobs", response_model=AutoRespondJobListResponse)
+async def list_jobs():
+    """
+    List auto-response jobs
+    
+    Returns:
+        All active jobs and the most recent finished ones
+    """
+    return AutoRespondJobListResponse(
+        jobs=[AutoRespondJobInfo(**job.to_dict()) for job in conversation_runner.list_jobs()],
+        status="success",
+        timestamp=datetime.utcnow().isoformat() + "Z"
+    )
+
+@router.get("/auto-respond/jobs/{job_id}", response_model=AutoRespondJobResponse)
+async def get_job(job_id: str):
+    """
+    Get the state of an auto-response job
+    
+    Args:
+        job_id: The job ID
+        
+    Returns:
+        The job
+    """
+    job = conversation_runner.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return _job_response(job)
+
+@router.post("/auto-respond/jobs/{job_id}/cancel", response_model=AutoRespondJobResponse)
+async def cancel_job(job_id: str):
+    """
+    Cancel an auto-response job
+    
+    Args:
+        job_id: The job ID
+        
+    Returns:
+        The job
+    """
+    job = conversation_runner.cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return _job_response(job)
+
+@router.post("/auto-respond/jobs/{job_id}/pause", response_model=AutoRespondJobResponse)
+async def pause_job(job_id: str):
+    """
+    Pause an auto-response job after its current turn
+    
+    Args:
+        job_id: The job ID
+        
+    Returns:
+        The job
+    """
+    job = conversation_runner.pause_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return _job_response(job)
+
+@router.post("/auto-respond/jobs/{job_id}/resume", response_model=AutoRespondJobResponse)
+async def resume_job(job_id: str):
+    """
+    Resume a paused auto-response job
+    
+    Args:
+        job_id: The job ID
+        
+    Returns:
+        The job
+    """
+    job = conversation_runner.resume_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return _job_response(job)
@@ -0,0 +1,85 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from typing import AsyncIterator, Set
+import json
+import logging
+import os
+import re
+
+from app.services import batch_runner
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Run IDs name files in BATCH_OUTPUT_DIR, so they may not contain path separators
+RUN_ID_PATTERN = r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$"
+
+# Runs streaming right now, which may not be started a second time until they finish
+_active_runs: Set[str] = set()
+
+@router.post("/batch")
+async def run_batch(
+    request: Request,
+    run_id: str = Query(..., pattern=RUN_ID_PATTERN, max_length=128),
+    resume: bool = True
+):
+    """
+    Run a batch of persona-pair experiments from a JSONL spec
+    
+    The request body is the spec, one experiment per line with an experiment_id,
+    persona_settings, a seed message and turns per persona. Results are streamed
+    back as NDJSON in the order experiments finish and written to the run's
+    results file. If the client disconnects, the experiments still running are
+    cancelled; posting the same spec with the same run_id resumes the run,
+    skipping the experiments that already completed.
+    
+    Args:
+        request: The request, whose body is the JSONL spec
+        run_id: Names the run and its results file
+        resume: False to discard earlier results of the run and start over
+        
+    Returns:
+        An application/x-ndjson response with one result per experiment
+    """
+    try:
+        body = (await request.body()).decode("utf-8")
+        experiments = batch_runner.parse_spec(body.splitlines())
+    except (ValueError, UnicodeDecodeError) as e:
+        logger.error(f"Invalid batch spec: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Invalid batch spec: {str(e)}")
+    
+    if run_id in _active_runs:
+        raise HTTPException(status_code=409, detail=f"Batch run {run_id} is already running")
+    
+    async def results() -> AsyncIterator[str]:
+        # Claimed only once streaming starts, so a response that is never sent cannot leave the run locked
+        if run_id in _active_runs:
+            yield json.dumps({"run_id": run_id, "error": f"Batch run {run_id} is already running"}) + "\n"
+            return
+        _active_runs.add(run_id)
+        try:
+            async for record in batch_runner.run_batch(experiments, batch_runner.output_path(run_id), run_id, resume):
+                yield json.dumps(record) + "\n"
+        finally:
+            _active_runs.discard(run_id)
+    
+    logger.info(f"Running batch {run_id} with {len(experiments)} experiments")
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@router.get("/batch/{run_id}")
+async def get_batch_results(run_id: str):
+    """
+    Download the results file of a batch run
+    
+    Args:
+        run_id: The run ID
+        
+    Returns:
+        The run's JSONL results so far
+    """
+    if not re.fullmatch(RUN_ID_PATTERN, run_id):
+        raise HTTPException(status_code=400, detail=f"Invalid run ID: {run_id}")
+    path = batch_runner.output_path(run_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"Batch run {run_id} not found")
+    return FileResponse(path, media_type="application/x-ndjson")
@@ -1,30 +1,119 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from typing import Dict, List, Any, Optional
 from datetime import datetime
+import asyncio
+import json
 import logging
+import os
+import tempfile
 import httpx
 
-from app.models.schemas import HistoryResponse, HistoryImportRequest, HistoryImportResponse
-from app.services import history_service, ollama_service
+from app.models.schemas import (
+    HistoryResponse,
+    HistoryImportRequest,
+    HistoryImportResponse,
+    ConversationInfo,
+    ConversationsResponse
+)
+from app.services import history_events, history_ndjson, history_service, ollama_service
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Seconds between keep-alive comments on an idle history stream
+HISTORY_STREAM_KEEPALIVE = float(os.getenv("HISTORY_STREAM_KEEPALIVE", "15"))
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+@router.get("/conversations", response_model=ConversationsResponse)
+async def list_conversations():
+    """
+    List the conversations that have history
+    
+    Returns:
+        The conversation IDs with their message counts
+    """
+    conversations = await history_service.list_conversations()
+    
+    return ConversationsResponse(
+        conversations=[
+            ConversationInfo(conversation_id=conversation_id, message_count=count)
+            for conversation_id, count in conversations.items()
+        ],
+        status="success",
+        timestamp=datetime.utcnow().isoformat() + "Z"
+    )
+
 @router.get("/history", response_model=HistoryResponse)
-async def get_history():
+async def get_history(
+    response: Response,
+    conversation_id: str = history_service.DEFAULT_CONVERSATION_ID,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    if_none_match: Optional[str] = Header(None)
+):
     """
-    Get the complete conversation history
+    Get the conversation history
+    
+    The response carries an ETag that changes whenever the conversation changes.
+    A request with a matching If-None-Match header gets an empty 304 response.
+    With a cursor, the If-None-Match value also tells whether the conversation was
+    replaced since the client's copy, in which case the response has reset set.
     
+    Args:
+        conversation_id: The conversation to read
+        since: Only include messages with a timestamp at or after this one
+        until: Only include messages with a timestamp at or before this one
+        after: Only include messages after the message with this ID (a cursor from next_cursor)
+        limit: The maximum number of messages to return
+        if_none_match: The ETag of the version the client already has
+        
     Returns:
-        The complete conversation history
+        The conversation history, limited to the requested range or page
     """
     try:
-        logger.info("Getting conversation history")
+        etag = f'"{await history_service.get_history_version(conversation_id)}"'
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        logger.info(f"Getting conversation history for {conversation_id}")
         
-        history = history_service.get_history()
+        has_more = False
+        reset = False
+        if since is not None or until is not None:
+            history = await history_service.get_history_between(conversation_id, start=since, end=until)
+            if limit is not None:
+                has_more = len(history) > limit
+                history = history[:limit]
+        else:
+            known_version = if_none_match.split(",")[0].strip().removeprefix("W/").strip('"') if if_none_match else None
+            history, has_more, reset = await history_service.get_history_page(
+                conversation_id,
+                after=after,
+                limit=limit,
+                known_version=known_version
+            )
         
+        if history:
+            next_cursor = history[-1]["message_id"]
+        else:
+            next_cursor = None if reset else after
+        
+        response.headers["ETag"] = etag
         return HistoryResponse(
             history=history,
+            conversation_id=conversation_id,
+            version=etag.strip('"'),
+            next_cursor=next_cursor,
+            has_more=has_more,
+            reset=reset,
             status="success",
             timestamp=datetime.utcnow().isoformat() + "Z"
         )
@@ -33,58 +122,184 @@ async def get_history():
         logger.error(f"Error getting history: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting history: {str(e)}")
 
+@router.get("/history/stream")
+async def stream_history(conversation_id: Optional[str] = history_service.DEFAULT_CONVERSATION_ID):
+    """
+    Push history changes to the client as Server-Sent Events
+    
+    The stream opens with a "ready" event carrying the current version; clients
+    should fetch any history they are missing after receiving it. After that,
+    "append" events carry each new entry and "reset" events announce an import
+    or clear, after which the client should fetch the history again. A client
+    that falls too far behind receives "evicted" and the stream ends.
+    
+    Args:
+        conversation_id: The conversation to follow, or an empty value for all
+        
+    Returns:
+        A text/event-stream response
+    """
+    subscription = history_events.subscribe(conversation_id or None)
+    
+    async def event_stream():
+        try:
+            ready = {
+                "type": "ready",
+                "conversation_id": conversation_id,
+                "version": await history_service.get_history_version(conversation_id) if conversation_id else None
+            }
+            yield f"event: ready\ndata: {json.dumps(ready)}\n\n"
+            
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=HISTORY_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                if event["type"] == "evicted":
+                    return
+        finally:
+            history_events.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Stop nginx from buffering the stream
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 @router.post("/history", response_model=HistoryImportResponse)
-async def import_history(request: HistoryImportRequest):
+async def import_history(
+    request: HistoryImportRequest,
+    conversation_id: str = history_service.DEFAULT_CONVERSATION_ID,
+    background_unload: bool = False
+):
     """
-    Import conversation history
+    Import conversation history, replacing the history of one conversation
+    
+    Importing an empty history clears the conversation and unloads all models.
     
     Args:
         request: The history import request containing the history to import
+        conversation_id: The conversation to replace
+        background_unload: When clearing, return without waiting for the models to unload
         
     Returns:
         A success or error message
     """
     try:
-        logger.info("Importing history")
+        logger.info(f"Importing history into {conversation_id}")
         
         # Check if this is a clear history request (empty history)
         is_clearing_history = len(request.history) == 0
         
         # Import the history (or clear it if empty)
-        count = history_service.import_history(request.history)
+        count = await history_service.import_history(
+            [entry.model_dump() for entry in request.history],
+            conversation_id=conversation_id
+        )
         
         # If clearing history, also unload all models
-        if is_clearing_history:
+        unload_note = ""
+        if is_clearing_history and background_unload:
+            logger.info("Clearing history detected, unloading all models in the background")
+            ollama_service.unload_all_models_in_background()
+            unload_note = " and started unloading models from memory"
+        elif is_clearing_history:
             logger.info("Clearing history detected, unloading all models")
             try:
-                # Get all running models
-                running_models = await ollama_service.get_running_models()
-                
-                # Track successful unloads
-                successful_unloads = 0
-                failed_unloads = 0
-                
-                # Unload each model
-                for model in running_models:
-                    model_name = model.get("model")
-                    if model_name:
-                        success = await ollama_service.unload_model(model_name)
-                        if success:
-                            successful_unloads += 1
-                        else:
-                            failed_unloads += 1
-                
-                logger.info(f"Unloaded {successful_unloads} models, {failed_unloads} failed")
+                await ollama_service.unload_all_models()
             except Exception as e:
                 logger.error(f"Error unloading models during history clear: {str(e)}")
                 # Continue even if model unloading fails
+            unload_note = " and unloaded models from memory"
         
         return HistoryImportResponse(
             status="success",
-            message=f"Imported {count} history entries" + 
-                    (f" and unloaded models from memory" if is_clearing_history else ""),
+            message=f"Imported {count} history entries{unload_note}",
             timestamp=datetime.utcnow().isoformat() + "Z"
         )
     except Exception as e:
         logger.error(f"Error importing history: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to import history: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to import history: {str(e)}")
+
+@router.get("/history/export")
+async def export_history(
+    conversation_id: str = history_service.DEFAULT_CONVERSATION_ID,
+    gzip: bool = False
+):
+    """
+    Export a conversation's history as NDJSON, one entry per line
+    
+    The entries are written straight from the store in batches, so memory use
+    does not grow with the size of the conversation. The export holds the
+    messages present when it starts.
+    
+    Args:
+        conversation_id: The conversation to export
+        gzip: Whether to gzip the export
+        
+    Returns:
+        An application/x-ndjson response, or application/gzip with gzip set
+    """
+    logger.info(f"Exporting conversation history for {conversation_id}")
+    filename = f"{conversation_id}.ndjson" + (".gz" if gzip else "")
+    batches = await history_service.iter_history(conversation_id, history_ndjson.HISTORY_NDJSON_BATCH)
+    return StreamingResponse(
+        history_ndjson.encode(batches, compress=gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={
+            "ETag": f'"{await history_service.get_history_version(conversation_id)}"',
+            "Content-Disposition": f'attachment; filename="{filename}"'
+        }
+    )
+
+@router.post("/history/import", response_model=HistoryImportResponse)
+async def import_history_ndjson(
+    request: Request,
+    conversation_id: str = history_service.DEFAULT_CONVERSATION_ID
+):
+    """
+    Import conversation history from an NDJSON body, replacing one conversation
+    
+    The body holds one history entry per line, as written by /history/export,
+    and may be gzipped. It is parsed and validated in batches as it arrives
+    instead of as one JSON document, and the validated entries are staged in a
+    temporary file rather than in memory. The conversation is replaced, in one
+    transaction, only once the whole body is valid. Unlike POST /history, an
+    empty body clears the conversation without unloading models.
+    
+    Args:
+        request: The request, whose body is read as a stream
+        conversation_id: The conversation to replace
+        
+    Returns:
+        A success or error message
+    """
+    logger.info(f"Importing NDJSON history into {conversation_id}")
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as staged:
+        try:
+            count = await history_ndjson.stage(history_ndjson.decode(request.stream()), staged)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid history: {str(e)}")
+        
+        try:
+            count = await history_service.import_history(
+                history_ndjson.read_staged(staged),
+                conversation_id=conversation_id,
+                count=count
+            )
+        except Exception as e:
+            logger.error(f"Error importing history: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Failed to import history: {str(e)}")
+    
+    return HistoryImportResponse(
+        status="success",
+        message=f"Imported {count} history entries",
+        timestamp=datetime.utcnow().isoformat() + "Z"
+    )
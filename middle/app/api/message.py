@@ -1,44 +1,89 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import Dict, List, Any, Optional
+from fastapi import APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from typing import AsyncIterator, Dict, List, Any, Optional
 from datetime import datetime
+import asyncio
+import json
 import logging
 
-from app.models.schemas import MessageRequest, MessageResponse, LatestPayloadResponse
-from app.services import history_service, prompt_template_service, ollama_service
+from app.models.schemas import Message, MessageRequest, MessageResponse, LatestPayloadResponse
+from app.services import candidate_service, prompt_template_service, ollama_service, speculation_service, turn_service
+from app.services.resilience import GenerationError
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Timing and count fields copied from Ollama's final chunk into the "done" frame
+STREAM_STATS_FIELDS = (
+    "total_duration",
+    "load_duration",
+    "prompt_eval_count",
+    "prompt_eval_duration",
+    "eval_count",
+    "eval_duration",
+)
+
 @router.get("/latest-payload", response_model=LatestPayloadResponse)
-async def get_latest_payload():
+async def get_latest_payload(message_id: Optional[str] = None):
     """
-    Get the latest payload sent to the model
+    Get the latest payload sent to the model, or the payload of a recent turn
     
+    Args:
+        message_id: The message whose reply the payload was built for, or None for the latest payload
+        
     Returns:
-        The latest payload with prompt, model, temperature, and timestamp
+        The payload with prompt, model, temperature, and timestamp
     """
+    logger.info(f"Getting payload for {message_id}" if message_id else "Getting latest payload")
     try:
-        logger.info("Getting latest payload")
-        
-        payload = prompt_template_service.get_latest_payload()
-        
-        return LatestPayloadResponse(
-            prompt=payload["prompt"],
-            model=payload["model"],
-            temperature=payload["temperature"],
-            timestamp=payload["timestamp"],
-            status="success"
-        )
-    
+        payload = await prompt_template_service.get_payload(message_id)
     except Exception as e:
         logger.error(f"Error getting latest payload: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting latest payload: {str(e)}")
+    
+    if payload is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No payload for message {message_id}; only the last "
+                   f"{prompt_template_service.RECENT_PAYLOADS_MAX_ENTRIES} are kept"
+        )
+    
+    return LatestPayloadResponse(
+        message_id=payload["message_id"],
+        conversation_id=payload["conversation_id"],
+        prompt=payload["prompt"],
+        model=payload["model"],
+        temperature=payload["temperature"],
+        timestamp=payload["timestamp"],
+        status="success"
+    )
+
+def _generation_error(e: GenerationError) -> HTTPException:
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after is not None else None
+    return HTTPException(status_code=e.status_code, detail=str(e), headers=headers)
 
 @router.post("/message", response_model=MessageResponse)
 async def process_message(request: MessageRequest):
     """
     Process a message from one persona to another and generate a model response
     
+    When the generation queue is full the request is rejected at once with 429,
+    and when no generation slot frees up in time with 503, both with a
+    Retry-After header. A generation that fails after its retries answers 503
+    if no backend could be reached or every backend is failing (with
+    Retry-After when known), 504 if the backend timed out, 422 if the model is
+    not available, and 502 for any other backend error.
+    
+    With n_candidates above 1, that many replies are generated concurrently,
+    each with the temperature and seed of its candidate_variations entry where
+    given, and returned under "candidates" with their timings once all have
+    finished. A candidate that failed carries the error and its status instead;
+    the request fails only if every candidate failed.
+    
+    With SPECULATION_ENABLED, the answer to a single returned reply is generated
+    in the background, and served by the next call if it sends the reply unedited.
+    
     Args:
         request: The message request
         
@@ -48,56 +93,288 @@ async def process_message(request: MessageRequest):
     try:
         logger.info(f"Processing message from {request.message.sender} to {request.message.recipients}")
         
-        # Add the message to history
-        message_id = history_service.add_message(
+        candidates = _candidate_settings(request)
+        turn = await turn_service.prepare_turn(
             timestamp=request.timestamp,
             persona_settings=request.persona_settings,
-            message=request.message
+            message=request.message,
+            conversation_id=request.conversation_id
         )
         
-        # Get conversation context
-        conversation_context = history_service.get_conversation_context(
-            current_message=request.message.model_dump(),
-            num_previous_messages=2
-        )
-        
-        # Determine sender and recipient personas
-        sender_id = request.message.sender
-        recipient_id = request.message.recipients
+        if len(candidates) > 1:
+            return await _generate_candidates(turn, candidates)
         
-        sender_persona = request.persona_settings[sender_id].model_dump()
-        recipient_persona = request.persona_settings[recipient_id].model_dump()
+        # Serve the reply generated while the operator reviewed the last one, or generate it now
+        temperature, seed = candidates[0]["temperature"], candidates[0]["seed"]
+        raw_response = await speculation_service.claim(request.conversation_id, turn, temperature, seed)
+        if raw_response is None:
+            raw_response = await ollama_service.generate_response(
+                model=turn.recipient_persona["model"],
+                prompt=turn.prompt,
+                temperature=temperature,
+                messages=turn.messages,
+                next_model=turn.next_model,
+                seed=seed
+            )
         
-        # If this is an edited AI response, log it but continue processing
-        if request.message.raw_text is not None:
-            logger.info(f"Message {message_id} is an edited AI response, continuing conversation")
-        
-        # Construct prompt
-        prompt = prompt_template_service.construct_prompt(
-            sender_persona=sender_persona,
-            recipient_persona=recipient_persona,
-            message_text=request.message.text,
-            conversation_context=conversation_context
-        )
-        
-        # Update timestamp in latest payload
-        prompt_template_service.latest_payload["timestamp"] = datetime.utcnow().isoformat() + "Z"
-        
-        # Generate response from Ollama
-        raw_response = await ollama_service.generate_response(
-            model=recipient_persona["model"],
-            prompt=prompt,
-            temperature=recipient_persona["temperature"]
+        await speculation_service.speculate(
+            request.persona_settings,
+            Message(sender=request.message.recipients, recipients=request.message.sender, text=raw_response),
+            request.conversation_id
         )
         
         # Return the response
         return MessageResponse(
-            message_id=message_id,
+            message_id=turn.message_id,
             status="success",
             timestamp=datetime.utcnow().isoformat() + "Z",
             response={"raw_text": raw_response}
         )
     
+    except GenerationError as e:
+        raise _generation_error(e)
+    
+    except HTTPException:
+        raise
+    
     except Exception as e:
         logger.error(f"Error processing message: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
+
+def _candidate_settings(request: MessageRequest) -> List[Dict[str, Any]]:
+    # Checked before the message is recorded, so an invalid request leaves no trace in history
+    if request.message.sender not in request.persona_settings:
+        raise HTTPException(status_code=400, detail=f"No persona settings for sender {request.message.sender}")
+    recipient = request.persona_settings.get(request.message.recipients)
+    if recipient is None:
+        raise HTTPException(status_code=400, detail=f"No persona settings for recipient {request.message.recipients}")
+    try:
+        return candidate_service.candidate_settings(
+            recipient.model_dump(),
+            request.n_candidates,
+            request.candidate_variations
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _generate_candidates(turn: turn_service.PreparedTurn, candidates: List[Dict[str, Any]]) -> MessageResponse:
+    # Candidates are listed in the order they finished; raw_text is the first one that succeeded
+    results = [candidate async for candidate in candidate_service.generate_candidates(turn, candidates)]
+    generated = [candidate for candidate in results if candidate["raw_text"] is not None]
+    if not generated:
+        failed = results[0]
+        raise HTTPException(
+            status_code=failed["status_code"],
+            detail=failed["error"],
+            headers={"Retry-After": str(failed["retry_after"])} if failed["retry_after"] is not None else None
+        )
+    return MessageResponse(
+        message_id=turn.message_id,
+        status="success",
+        timestamp=datetime.utcnow().isoformat() + "Z",
+        response={"raw_text": generated[0]["raw_text"], "candidates": results}
+    )
+
+async def stream_frames(
+    turn: turn_service.PreparedTurn,
+    candidates: List[Dict[str, Any]]
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Turn Ollama's NDJSON chunks into transport-neutral frames
+    
+    Frames are pulled from Ollama only as fast as the caller consumes them, so a
+    slow client slows the upstream read instead of growing a buffer here. With
+    several candidates, they are generated concurrently and each is sent whole
+    in a candidate frame as soon as it finishes, followed by a done frame.
+    
+    Args:
+        turn: The prepared turn to generate a reply for
+        candidates: The candidates' settings, from candidate_service.candidate_settings
+        
+    Yields:
+        Frames with a "type" of start, token, candidate, done or error
+    """
+    message_id = turn.message_id
+    recipient_persona = turn.recipient_persona
+    yield {"type": "start", "message_id": message_id}
+    
+    if len(candidates) > 1:
+        async for candidate in candidate_service.generate_candidates(turn, candidates):
+            yield {"type": "candidate", "message_id": message_id, **candidate}
+        yield {
+            "type": "done",
+            "message_id": message_id,
+            "model": recipient_persona["model"],
+            "timestamp": datetime.utcnow().isoformat() + "Z"
+        }
+        return
+    
+    async for chunk in ollama_service.stream_response(
+        model=recipient_persona["model"],
+        prompt=turn.prompt,
+        temperature=candidates[0]["temperature"],
+        messages=turn.messages,
+        next_model=turn.next_model,
+        seed=candidates[0]["seed"]
+    ):
+        if "error" in chunk:
+            frame = {"type": "error", "message_id": message_id, "detail": chunk["error"]}
+            # Scheduler rejections say when to retry
+            for field in ("status_code", "retry_after"):
+                if field in chunk:
+                    frame[field] = chunk[field]
+            yield frame
+            return
+        
+        if chunk.get("response"):
+            yield {"type": "token", "text": chunk["response"]}
+        
+        if chunk.get("done"):
+            stats = {field: chunk[field] for field in STREAM_STATS_FIELDS if field in chunk}
+            yield {
+                "type": "done",
+                "message_id": message_id,
+                "model": chunk.get("model", recipient_persona["model"]),
+                "timestamp": datetime.utcnow().isoformat() + "Z",
+                **stats
+            }
+            return
+
+@router.post("/message/stream")
+async def stream_message(request: MessageRequest):
+    """
+    Process a message and stream the model response as Server-Sent Events
+    
+    Each event is named after the frame type (start, token, candidate, done, error)
+    and carries the frame as JSON. If the client disconnects, the upstream Ollama request is
+    closed, which stops generation.
+    
+    Args:
+        request: The message request
+        
+    Returns:
+        A text/event-stream response
+    """
+    try:
+        logger.info(f"Streaming message from {request.message.sender} to {request.message.recipients}")
+        
+        candidates = _candidate_settings(request)
+        turn = await turn_service.prepare_turn(
+            timestamp=request.timestamp,
+            persona_settings=request.persona_settings,
+            message=request.message,
+            conversation_id=request.conversation_id
+        )
+        
+        # Reject now while the status can still be 429 or 503; later failures arrive as an error event
+        ollama_service.scheduler.check()
+        ollama_service.router.check_available()
+    
+    except GenerationError as e:
+        raise _generation_error(e)
+    
+    except HTTPException:
+        raise
+    
+    except Exception as e:
+        logger.error(f"Error processing message: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
+    
+    async def event_stream() -> AsyncIterator[str]:
+        completed = False
+        try:
+            async for frame in stream_frames(turn, candidates):
+                completed = frame["type"] in ("done", "error")
+                yield f"event: {frame['type']}\ndata: {json.dumps(frame)}\n\n"
+        finally:
+            if not completed:
+                logger.info(f"Client disconnected from stream for message {turn.message_id}, generation stopped")
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Stop nginx from buffering the stream
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+async def _send_frames(
+    websocket: WebSocket,
+    turn: turn_service.PreparedTurn,
+    candidates: List[Dict[str, Any]]
+) -> None:
+    async for frame in stream_frames(turn, candidates):
+        await websocket.send_json(frame)
+
+@router.websocket("/message/ws")
+async def message_websocket(websocket: WebSocket):
+    """
+    Stream model responses over a WebSocket
+    
+    The client sends a MessageRequest as JSON and receives the same frames as the
+    SSE endpoint. Sending {"type": "cancel"} while a response is streaming stops the
+    generation upstream and is acknowledged with a "cancelled" frame. The socket can
+    be reused for further messages.
+    
+    Args:
+        websocket: The WebSocket connection
+    """
+    await websocket.accept()
+    try:
+        while True:
+            data = await websocket.receive_json()
+            
+            try:
+                request = MessageRequest.model_validate(data)
+                candidates = _candidate_settings(request)
+                turn = await turn_service.prepare_turn(
+                    timestamp=request.timestamp,
+                    persona_settings=request.persona_settings,
+                    message=request.message,
+                    conversation_id=request.conversation_id
+                )
+            except ValidationError as e:
+                await websocket.send_json({"type": "error", "detail": f"Invalid message request: {str(e)}"})
+                continue
+            except HTTPException as e:
+                await websocket.send_json({"type": "error", "detail": f"Invalid message request: {e.detail}"})
+                continue
+            except Exception as e:
+                logger.error(f"Error processing message: {str(e)}")
+                await websocket.send_json({"type": "error", "detail": f"Error processing message: {str(e)}"})
+                continue
+            
+            message_id = turn.message_id
+            generation = asyncio.create_task(_send_frames(websocket, turn, candidates))
+            try:
+                while not generation.done():
+                    receiver = asyncio.create_task(websocket.receive_json())
+                    await asyncio.wait({generation, receiver}, return_when=asyncio.FIRST_COMPLETED)
+                    
+                    if not receiver.done():
+                        receiver.cancel()
+                        break
+                    
+                    # Raises WebSocketDisconnect if the client went away mid-stream
+                    control = receiver.result()
+                    if isinstance(control, dict) and control.get("type") == "cancel":
+                        generation.cancel()
+                        await asyncio.gather(generation, return_exceptions=True)
+                        logger.info(f"Generation for message {message_id} cancelled by client")
+                        await websocket.send_json({"type": "cancelled", "message_id": message_id})
+                        break
+                    
+                    await websocket.send_json({"type": "error", "detail": "A response is already streaming"})
+                
+                # Surface errors from the generation task, ignoring cancellation
+                if generation.done() and not generation.cancelled() and generation.exception():
+                    raise generation.exception()
+            finally:
+                if not generation.done():
+                    generation.cancel()
+                    await asyncio.gather(generation, return_exceptions=True)
+    
+    except WebSocketDisconnect:
+        logger.info("Message WebSocket disconnected")
@@ -0,0 +1,89 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from typing import List
+import logging
+
+from app.services import history_service, metrics, ollama_service, speculation_service
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Content type of the Prometheus text exposition format; the charset is added by the response
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+async def _state_metrics() -> List[metrics.Metric]:
+    # Gauges and counters read from the services' own state at scrape time
+    # History size is reported in total, since a label per conversation would grow without bound
+    conversations = await history_service.list_conversations()
+    history_messages = metrics.Gauge("history_messages", "Messages stored across all conversations")
+    history_messages.set(sum(conversations.values()))
+    history_conversations = metrics.Gauge("history_conversations", "Conversations with history")
+    history_conversations.set(len(conversations))
+    
+    in_flight = metrics.Gauge("ollama_in_flight_requests", "Requests in flight per Ollama backend", ("backend",))
+    healthy = metrics.Gauge("ollama_backend_healthy", "1 if the backend is in rotation, 0 if ejected", ("backend",))
+    circuit_opens = metrics.Counter("ollama_circuit_opens_total", "Times a backend's circuit breaker opened", ("backend",))
+    for backend in ollama_service.router.backends:
+        in_flight.set(backend.in_flight, backend=backend.url)
+        healthy.set(1 if backend.healthy else 0, backend=backend.url)
+        circuit_opens.inc(backend.breaker.opens, backend=backend.url)
+    
+    scheduler = ollama_service.scheduler.stats()
+    slots_in_use = metrics.Gauge("generation_slots_in_use", "Generation slots held")
+    slots_in_use.set(scheduler["in_use"])
+    slots = metrics.Gauge("generation_slots", "Generation slots across healthy backends")
+    slots.set(scheduler["capacity"])
+    queued = metrics.Gauge("generation_queue_length", "Generations waiting for a slot", ("priority",))
+    for priority, count in scheduler["queued"].items():
+        queued.set(count, priority=priority)
+    rejected = metrics.Counter("generation_rejected_total", "Generations turned away by the scheduler", ("reason",))
+    rejected.inc(scheduler["rejected_queue_full"], reason="queue_full")
+    rejected.inc(scheduler["rejected_timeout"], reason="timeout")
+    rejected.inc(scheduler["evicted"], reason="displaced")
+    
+    cache_lookups = metrics.Counter("cache_lookups_total", "Cache lookups by result", ("cache", "result"))
+    for cache_name, cache in (("models", ollama_service.models_cache), ("running_models", ollama_service.running_models_cache)):
+        stats = cache.stats()
+        cache_lookups.inc(stats["hits"], cache=cache_name, result="hit")
+        cache_lookups.inc(stats["stale_hits"], cache=cache_name, result="stale_hit")
+        cache_lookups.inc(stats["misses"], cache=cache_name, result="miss")
+        cache_lookups.inc(stats["coalesced"], cache=cache_name, result="coalesced")
+    stats = ollama_service.responses.stats()
+    cache_lookups.inc(stats["memory_hits"] + stats["disk_hits"], cache="responses", result="hit")
+    cache_lookups.inc(stats["misses"], cache="responses", result="miss")
+    
+    residency = ollama_service.residency.stats()
+    swaps = metrics.Counter("model_swaps_total", "Cold model loads seen in generation replies")
+    swaps.inc(residency["swaps"])
+    load_seconds = metrics.Counter("model_load_seconds_total", "Time spent loading models")
+    load_seconds.inc(residency["load_seconds"])
+    
+    speculation = speculation_service.stats()
+    speculations = metrics.Counter("speculations_total", "Speculative generations by outcome", ("outcome",))
+    for outcome, count in speculation["outcomes"].items():
+        speculations.inc(count, outcome=outcome)
+    speculation_wasted = metrics.Counter(
+        "speculation_wasted_seconds_total",
+        "Generation slot time spent on speculations that were not served"
+    )
+    speculation_wasted.inc(speculation["wasted_seconds"])
+    speculation_saved = metrics.Counter(
+        "speculation_saved_seconds_total",
+        "Generation time of served speculations that overlapped the operator's review"
+    )
+    speculation_saved.inc(speculation["saved_seconds"])
+    
+    return [
+        history_messages, history_conversations, in_flight, healthy, circuit_opens, slots_in_use, slots,
+        queued, rejected, cache_lookups, swaps, load_seconds, speculations, speculation_wasted, speculation_saved
+    ]
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Expose request latencies, turn phase timings and service state for Prometheus
+    
+    Returns:
+        The metrics in the Prometheus text exposition format
+    """
+    return PlainTextResponse(metrics.REGISTRY.render(await _state_metrics()), media_type=METRICS_CONTENT_TYPE)
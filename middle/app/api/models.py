@@ -4,7 +4,7 @@ from datetime import datetime
 import logging
 
 from app.models.schemas import ModelsResponse, ModelInfo
-from app.services import ollama_service
+from app.services import ollama_service, speculation_service
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -82,6 +82,30 @@ async def get_running_models():
         logger.error(f"Error getting running models: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get running models: {str(e)}")
 
+@router.get("/backends")
+async def get_backends():
+    """
+    Get the state of every Ollama backend in the pool and of model residency
+    
+    Returns:
+        A list of backends with their health, in-flight requests and loaded models,
+        the generation queue, the model swap counts and load times, the cache counters,
+        and the speculation hit rate and wasted generation time
+    """
+    return {
+        "backends": ollama_service.router.status(),
+        "scheduler": ollama_service.scheduler.stats(),
+        "residency": ollama_service.residency.stats(),
+        "caches": {
+            "models": ollama_service.models_cache.stats(),
+            "running_models": ollama_service.running_models_cache.stats(),
+            "responses": ollama_service.responses.stats()
+        },
+        "speculation": speculation_service.stats(),
+        "status": "success",
+        "timestamp": datetime.utcnow().isoformat() + "Z"
+    }
+
 @router.post("/unload-model/{model_name}")
 async def unload_model(model_name: str):
     """
@@ -121,22 +145,7 @@ async def unload_all_models():
     try:
         logger.info("Unloading all models")
         
-        # Get all running models
-        running_models = await ollama_service.get_running_models()
-        
-        # Track successful unloads
-        successful_unloads = 0
-        failed_unloads = 0
-        
-        # Unload each model
-        for model in running_models:
-            model_name = model.get("model")
-            if model_name:
-                success = await ollama_service.unload_model(model_name)
-                if success:
-                    successful_unloads += 1
-                else:
-                    failed_unloads += 1
+        successful_unloads, failed_unloads = await ollama_service.unload_all_models()
         
         return {
             "status": "success",
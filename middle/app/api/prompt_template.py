@@ -28,7 +28,7 @@ async def update_prompt_template(request: PromptTemplateRequest):
             raise ValueError("Template cannot be empty")
         
         # Update the template
-        prompt_template_service.update_template(request.template)
+        await prompt_template_service.update_template(request.template)
         
         return PromptTemplateResponse(
             status="success",
@@ -0,0 +1,77 @@
+"""
+Run a batch of persona-pair experiments from a JSONL spec without the API server.
+
+Each spec line is one experiment:
+    {"experiment_id": "...", "persona_settings": {...}, "message": {...}, "turns": {...}}
+
+Results are appended to the output file as each experiment finishes. Running
+the same command again after a crash or Ctrl-C resumes the run, skipping the
+experiments that already completed.
+
+Usage (from the middle/ directory):
+    python -m app.batch experiments.jsonl --output results.jsonl --concurrency 8
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("spec", help="JSONL spec, one experiment per line")
+    parser.add_argument("--output", help="JSONL results file, defaults to the spec name with .results.jsonl")
+    parser.add_argument("--run-id", help="Names the run's conversations, defaults to the output file name")
+    parser.add_argument("--concurrency", type=int, help="Experiments run at once, overriding BATCH_MAX_CONCURRENT")
+    parser.add_argument("--no-resume", action="store_true", help="Discard earlier results and run every experiment")
+    return parser.parse_args()
+
+async def run(args: argparse.Namespace) -> int:
+    # Imported after the environment is loaded, since services read it at import time
+    from app.services import batch_runner, history_service, ollama_service
+    
+    if args.concurrency:
+        batch_runner.BATCH_MAX_CONCURRENT = args.concurrency
+    
+    with open(args.spec, "r", encoding="utf-8") as spec_file:
+        experiments = batch_runner.parse_spec(spec_file)
+    output = args.output or f"{os.path.splitext(args.spec)[0]}.results.jsonl"
+    run_id = args.run_id or os.path.splitext(os.path.basename(output))[0]
+    
+    history_service.start_persistence()
+    await ollama_service.start_client()
+    failed = 0
+    try:
+        async for record in batch_runner.run_batch(experiments, output, run_id, resume=not args.no_resume):
+            if record["status"] != batch_runner.COMPLETED:
+                failed += 1
+            print(
+                f"{record['experiment_id']}: {record['status']} "
+                f"({len(record['turns'])} turns in {record['seconds']:.1f}s)",
+                flush=True
+            )
+    finally:
+        await ollama_service.close_client()
+        history_service.stop_persistence()
+    
+    print(f"Results written to {output}")
+    return 1 if failed else 0
+
+def main() -> None:
+    load_dotenv()
+    logging.basicConfig(
+        level=getattr(logging, os.getenv("LOG_LEVEL", "WARNING").upper()),
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    args = parse_args()
+    try:
+        sys.exit(asyncio.run(run(args)))
+    except ValueError as e:
+        sys.exit(f"Invalid batch spec: {str(e)}")
+    except KeyboardInterrupt:
+        sys.exit("Interrupted; run the same command again to resume")
+
+if __name__ == "__main__":
+    main()
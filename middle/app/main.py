@@ -1,9 +1,11 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 import uvicorn
 import logging
 import os
 from datetime import datetime
+import time
 import uuid
 import json
 from typing import List, Dict, Any, Optional
@@ -17,6 +19,10 @@ from app.api.message import router as message_router
 from app.api.history import router as history_router
 from app.api.prompt_template import router as prompt_template_router
 from app.api.models import router as models_router
+from app.api.auto_respond import router as auto_respond_router
+from app.api.batch import router as batch_router
+from app.api.metrics import router as metrics_router
+from app.services import ollama_service, conversation_runner, history_service, metrics, speculation_service, summary_service
 
 # Setup logging
 log_level = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -26,11 +32,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Manage resources that live for the whole application, such as the shared Ollama client
+    """
+    history_service.start_persistence()
+    history_service.start_sync()
+    await ollama_service.start_client()
+    yield
+    await conversation_runner.shutdown()
+    await speculation_service.shutdown()
+    await summary_service.shutdown()
+    await ollama_service.close_client()
+    await history_service.stop_sync()
+    history_service.stop_persistence()
+
 # Create FastAPI app
 app = FastAPI(
     title="Multi-Agentic API",
     description="API for the multi-agentic human-in-the-loop conversation system",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # Add CORS middleware
@@ -42,11 +65,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """
+    Observe each request's latency per route, up to the start of the response body
+    """
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # The route template keeps one series per endpoint rather than per conversation or model
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status
+        )
+
 # Include routers
 app.include_router(message_router, prefix="/api", tags=["messages"])
 app.include_router(history_router, prefix="/api", tags=["history"])
 app.include_router(prompt_template_router, prefix="/api", tags=["prompt_template"])
 app.include_router(models_router, prefix="/api", tags=["models"])
+app.include_router(auto_respond_router, prefix="/api", tags=["auto_respond"])
+app.include_router(batch_router, prefix="/api", tags=["batch"])
+app.include_router(metrics_router, tags=["metrics"])
 
 @app.get("/")
 async def root():
@@ -7,6 +7,7 @@ class PersonaSettings(BaseModel):
     system_prompt: str
     model: str
     temperature: float = Field(ge=0.0, le=1.0)
+    seed: Optional[int] = None
 
 class Message(BaseModel):
     sender: str
@@ -14,10 +15,17 @@ class Message(BaseModel):
     text: str
     raw_text: Optional[str] = None
 
+class CandidateVariation(BaseModel):
+    temperature: Optional[float] = Field(None, ge=0.0, le=1.0)
+    seed: Optional[int] = None
+
 class MessageRequest(BaseModel):
     timestamp: str
     persona_settings: Dict[str, PersonaSettings]
     message: Message
+    conversation_id: str = "default"
+    n_candidates: int = Field(1, ge=1)
+    candidate_variations: Optional[List[CandidateVariation]] = None
 
 class MessageResponse(BaseModel):
     message_id: str
@@ -33,6 +41,11 @@ class HistoryEntry(BaseModel):
 
 class HistoryResponse(BaseModel):
     history: List[HistoryEntry]
+    conversation_id: str = "default"
+    version: Optional[str] = None
+    next_cursor: Optional[str] = None
+    has_more: bool = False
+    reset: bool = False
     status: str
     timestamp: str
 
@@ -44,6 +57,15 @@ class HistoryImportResponse(BaseModel):
     message: str
     timestamp: str
 
+class ConversationInfo(BaseModel):
+    conversation_id: str
+    message_count: int
+
+class ConversationsResponse(BaseModel):
+    conversations: List[ConversationInfo]
+    status: str
+    timestamp: str
+
 class PromptTemplateRequest(BaseModel):
     template: str
 
@@ -63,6 +85,8 @@ class ModelsResponse(BaseModel):
     timestamp: str
 
 class LatestPayloadResponse(BaseModel):
+    message_id: Optional[str] = None
+    conversation_id: Optional[str] = None
     prompt: Optional[str] = None
     model: Optional[str] = None
     temperature: Optional[float] = None
@@ -74,9 +98,55 @@ class OllamaRequest(BaseModel):
     prompt: str
     temperature: float = 0.7
     stream: bool = False
+    keep_alive: Optional[str] = None
+    options: Optional[Dict[str, Any]] = None
+
+class OllamaChatRequest(BaseModel):
+    model: str
+    messages: List[Dict[str, str]]
+    temperature: float = 0.7
+    stream: bool = False
+    keep_alive: Optional[str] = None
+    options: Optional[Dict[str, Any]] = None
 
 class OllamaResponse(BaseModel):
     model: str
     created_at: str
     response: str
-    done: bool 
\ No newline at end of file
+    done: bool
+
+class AutoRespondJobRequest(BaseModel):
+    persona_settings: Dict[str, PersonaSettings]
+    message: Message
+    turns: Dict[str, int]
+    conversation_id: Optional[str] = None
+
+class AutoRespondJobInfo(BaseModel):
+    job_id: str
+    conversation_id: str
+    status: str
+    sender: str
+    recipient: str
+    turns_remaining: Dict[str, int]
+    turns_completed: int
+    last_message_id: Optional[str] = None
+    error: Optional[str] = None
+    created_at: str
+    updated_at: str
+
+class AutoRespondJobResponse(BaseModel):
+    job: AutoRespondJobInfo
+    status: str
+    timestamp: str
+
+class AutoRespondJobListResponse(BaseModel):
+    jobs: List[AutoRespondJobInfo]
+    status: str
+    timestamp: str
+
+class BatchExperiment(BaseModel):
+    experiment_id: str
+    persona_settings: Dict[str, PersonaSettings]
+    message: Message
+    turns: Dict[str, int]
+    conversation_id: Optional[str] = None
@@ -0,0 +1,268 @@
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Any, Optional, Set
+from app.services.resilience import BackendUnavailable, CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+# Consecutive failed requests or probes after which a backend is ejected
+OLLAMA_EJECT_AFTER_FAILURES = int(os.getenv("OLLAMA_EJECT_AFTER_FAILURES", "3"))
+
+# In-flight requests a backend with the model loaded may have before requests spill to another backend
+OLLAMA_AFFINITY_MAX_IN_FLIGHT = int(os.getenv("OLLAMA_AFFINITY_MAX_IN_FLIGHT", "4"))
+
+class Backend:
+    """
+    One Ollama server and what the router knows about it
+    """
+    def __init__(self, url: str):
+        self.url = url
+        self.in_flight = 0
+        self.loaded_models: Set[str] = set()
+        self.model_sizes: Dict[str, int] = {}
+        # The models pulled on the backend, None until its tags are first read, and
+        # the ones it has answered 404 for since
+        self.pulled_models: Optional[Set[str]] = None
+        self.missing_models: Set[str] = set()
+        self.breaker = CircuitBreaker(OLLAMA_EJECT_AFTER_FAILURES)
+        self.requests = 0
+        self.failures = 0
+        self.last_probe: Optional[float] = None
+    
+    @property
+    def healthy(self) -> bool:
+        # In rotation unless its circuit is open; a half-open backend takes one trial request
+        return self.breaker.available
+    
+    def may_have(self, model: str) -> bool:
+        """
+        Check whether the backend may have a model pulled, as far as the router knows
+        
+        Args:
+            model: The model name, with or without its tag
+            
+        Returns:
+            False if the backend's tags leave the model out or it answered 404 for it
+        """
+        names = {model, model if ":" in model else f"{model}:latest"}
+        if names & self.missing_models:
+            return False
+        return self.pulled_models is None or bool(names & (self.pulled_models | self.loaded_models))
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit": self.breaker.state,
+            "circuit_opens": self.breaker.opens,
+            "in_flight": self.in_flight,
+            "loaded_models": sorted(self.loaded_models),
+            "pulled_models": None if self.pulled_models is None else sorted(self.pulled_models),
+            "requests": self.requests,
+            "failures": self.failures
+        }
+
+class BackendRouter:
+    """
+    Pick an Ollama backend for each request
+    
+    A request only goes to a backend that has its model pulled, going by the
+    tags last read from it and the 404s it answered, unless none is known to.
+    Among those it goes to a healthy backend that already has its model loaded, so
+    the model does not have to be loaded again elsewhere, unless all of those
+    are busy past OLLAMA_AFFINITY_MAX_IN_FLIGHT. Otherwise it goes to the
+    healthy backend with the fewest requests in flight. Each backend has a
+    circuit breaker: after OLLAMA_EJECT_AFTER_FAILURES failed requests in a row
+    it is ejected, until a health probe succeeds or, after
+    OLLAMA_CIRCUIT_RESET_SECONDS, one trial request tries it again. Generations check
+    check_available first, so they fail fast while every backend is ejected.
+    Callbacks in capacity_listeners run whenever backends are added or readmitted.
+    """
+    def __init__(self, urls: List[str]):
+        self.backends: List[Backend] = []
+        self.capacity_listeners: List[Callable[[], None]] = []
+        self.configure(urls)
+    
+    def configure(self, urls: List[str]) -> None:
+        """
+        Replace the backend pool
+        
+        Args:
+            urls: The API URLs of the backends, such as http://ollama:11434/api
+        """
+        backends = [Backend(url.rstrip("/")) for url in urls if url.strip()]
+        if not backends:
+            raise ValueError("At least one Ollama backend is required")
+        self.backends = backends
+        self._capacity_changed()
+    
+    def choose(self, model: str, candidates: Optional[List[Backend]] = None) -> Backend:
+        """
+        Choose the backend for a request without reserving it
+        
+        Args:
+            model: The model the request uses
+            candidates: The backends to choose from, defaulting to the healthy ones
+            
+        Returns:
+            The chosen backend
+        """
+        candidates = self.serving(model, candidates or self.healthy_backends())
+        resident = [
+            backend for backend in candidates
+            if model in backend.loaded_models and backend.in_flight < OLLAMA_AFFINITY_MAX_IN_FLIGHT
+        ]
+        # min() keeps the first of equally loaded backends, so ties go to the configured order
+        return min(resident or candidates, key=lambda backend: backend.in_flight)
+    
+    def serving(self, model: str, candidates: List[Backend]) -> List[Backend]:
+        """
+        Narrow candidate backends to those that may have a model pulled
+        
+        Args:
+            model: The model a request uses
+            candidates: The backends to choose from
+            
+        Returns:
+            The candidates that may have the model, or all of them if none is known to
+        """
+        return [backend for backend in candidates if backend.may_have(model)] or candidates
+    
+    @asynccontextmanager
+    async def route(self, model: str, backend: Optional[Backend] = None) -> AsyncIterator[Backend]:
+        """
+        Reserve a backend for the duration of a request
+        
+        Args:
+            model: The model the request uses
+            backend: A backend chosen beforehand, instead of choosing one now
+            
+        Yields:
+            The chosen backend
+        """
+        backend = backend or self.choose(model)
+        backend.in_flight += 1
+        backend.requests += 1
+        try:
+            yield backend
+        finally:
+            backend.in_flight -= 1
+    
+    def record_success(self, backend: Backend) -> None:
+        """
+        Record a successful request, which also readmits an ejected backend
+        
+        Args:
+            backend: The backend that answered
+        """
+        if backend.breaker.record_success():
+            logger.info(f"Ollama backend {backend.url} is healthy again")
+            self._capacity_changed()
+    
+    def record_failure(self, backend: Backend) -> None:
+        """
+        Record a failed request or probe, ejecting the backend after too many in a row
+        
+        Args:
+            backend: The backend that failed
+        """
+        backend.failures += 1
+        if backend.breaker.record_failure():
+            logger.warning(
+                f"Ejected Ollama backend {backend.url} after {backend.breaker.consecutive_failures} consecutive "
+                f"failures, retrying it in {backend.breaker.reset_seconds:g}s"
+            )
+    
+    def record_probe(self, backend: Backend, loaded_models: Optional[Dict[str, int]]) -> None:
+        """
+        Record the result of a health probe
+        
+        Args:
+            backend: The probed backend
+            loaded_models: The sizes of the models the backend reported as loaded, or None if the probe failed
+        """
+        backend.last_probe = time.time()
+        if loaded_models is None:
+            self.record_failure(backend)
+            return
+        backend.loaded_models = set(loaded_models)
+        backend.model_sizes = dict(loaded_models)
+        # A loaded model is also a pulled one
+        backend.missing_models -= backend.loaded_models
+        if backend.pulled_models is not None:
+            backend.pulled_models |= backend.loaded_models
+        self.record_success(backend)
+    
+    def record_pulled(self, backend: Backend, models: Iterable[str]) -> None:
+        """
+        Record the models a backend listed in its tags
+        
+        Args:
+            backend: The backend that listed them
+            models: The names of the models pulled on it
+        """
+        backend.pulled_models = set(models)
+        backend.missing_models.clear()
+    
+    def record_missing(self, backend: Backend, model: str) -> None:
+        """
+        Record that a backend answered 404 for a model, so requests for it go elsewhere until its tags list it again
+        
+        Args:
+            backend: The backend that does not have the model
+            model: The model name the request used
+        """
+        backend.missing_models.add(model)
+        if backend.pulled_models is not None:
+            backend.pulled_models.discard(model)
+    
+    def _capacity_changed(self) -> None:
+        for listener in self.capacity_listeners:
+            listener()
+    
+    def resident_models(self) -> Set[str]:
+        """
+        Get the models loaded on any healthy backend
+        
+        Returns:
+            The set of loaded model names
+        """
+        resident: Set[str] = set()
+        for backend in self.healthy_backends():
+            resident |= backend.loaded_models
+        return resident
+    
+    def healthy_backends(self) -> List[Backend]:
+        """
+        Get the backends that are not ejected, or all of them if every one is
+        
+        Returns:
+            The backends to send pool-wide requests, such as unloads, to
+        """
+        return [backend for backend in self.backends if backend.healthy] or self.backends
+    
+    def check_available(self) -> None:
+        """
+        Fail fast if every backend is ejected
+        
+        Raises:
+            BackendUnavailable: If every backend's circuit is open, with the seconds until one is tried again
+        """
+        if any(backend.healthy for backend in self.backends):
+            return
+        retry_after = min(backend.breaker.retry_after() for backend in self.backends)
+        raise BackendUnavailable(
+            f"Every Ollama backend is failing, retry in {retry_after}s",
+            retry_after=retry_after
+        )
+    
+    def status(self) -> List[Dict[str, Any]]:
+        """
+        Get the state of every backend
+        
+        Returns:
+            A list of backend information dictionaries
+        """
+        return [backend.to_dict() for backend in self.backends]
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Any, Optional, Set
+from pydantic import ValidationError
+from app.models.schemas import BatchExperiment, Message
+from app.services import conversation_runner, history_service, turn_service
+
+logger = logging.getLogger(__name__)
+
+# Experiments running at once across every batch, whether started from the CLI or /api/batch
+BATCH_MAX_CONCURRENT = int(os.getenv("BATCH_MAX_CONCURRENT", "8"))
+
+# Directory /api/batch writes results to, one <run_id>.jsonl per run
+BATCH_OUTPUT_DIR = os.getenv("BATCH_OUTPUT_DIR", "data/batch")
+
+# Experiment result states
+COMPLETED = "completed"
+FAILED = "failed"
+
+# Shared by every batch, created lazily inside the event loop
+_experiment_slots: Optional[asyncio.Semaphore] = None
+
+def _slots() -> asyncio.Semaphore:
+    global _experiment_slots
+    if _experiment_slots is None:
+        _experiment_slots = asyncio.Semaphore(BATCH_MAX_CONCURRENT)
+    return _experiment_slots
+
+def parse_spec(lines: Iterable[str]) -> List[BatchExperiment]:
+    """
+    Parse a JSONL batch spec, one experiment per line
+    
+    Blank lines are ignored.
+    
+    Args:
+        lines: The lines of the spec
+        
+    Returns:
+        The experiments in spec order
+        
+    Raises:
+        ValueError: If a line is not a valid experiment, or an experiment ID is repeated
+    """
+    experiments: List[BatchExperiment] = []
+    seen: Set[str] = set()
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            experiment = BatchExperiment.model_validate_json(line)
+            conversation_runner.validate_job(experiment.persona_settings, experiment.message, experiment.turns)
+        except (ValidationError, ValueError) as e:
+            raise ValueError(f"Line {number}: {str(e)}")
+        if experiment.experiment_id in seen:
+            raise ValueError(f"Line {number}: experiment ID {experiment.experiment_id} is repeated")
+        seen.add(experiment.experiment_id)
+        experiments.append(experiment)
+    return experiments
+
+def output_path(run_id: str) -> str:
+    """
+    Get the results file of a batch run started through the API
+    
+    Args:
+        run_id: The run ID
+        
+    Returns:
+        The path of the run's JSONL results file
+    """
+    return os.path.join(BATCH_OUTPUT_DIR, f"{run_id}.jsonl")
+
+def read_results(path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Read the results already written to a batch output file
+    
+    A torn final line, left by a crash in the middle of a write, is cut off so
+    that results written after a resume start on a clean line.
+    
+    Args:
+        path: The JSONL results file
+        
+    Returns:
+        The last result of each experiment, keyed by experiment ID
+    """
+    if not os.path.exists(path):
+        return {}
+    
+    results: Dict[str, Dict[str, Any]] = {}
+    good_offset = 0
+    with open(path, "rb") as results_file:
+        for line in results_file:
+            if not line.endswith(b"\n"):
+                logger.warning(f"Discarding torn result at the end of {path}")
+                break
+            good_offset += len(line)
+            try:
+                record = json.loads(line)
+                results[record["experiment_id"]] = record
+            except (ValueError, KeyError, TypeError):
+                logger.warning(f"Skipping unreadable result in {path}")
+    
+    if good_offset < os.path.getsize(path):
+        with open(path, "r+b") as results_file:
+            results_file.truncate(good_offset)
+    return results
+
+def _append(path: str, record: Dict[str, Any]) -> None:
+    # Each result is on disk before the next one is reported, so a crash loses at most the experiments in flight
+    with open(path, "a", encoding="utf-8") as results_file:
+        results_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        results_file.flush()
+        os.fsync(results_file.fileno())
+
+async def run_batch(
+    experiments: List[BatchExperiment],
+    path: str,
+    run_id: str,
+    resume: bool = True
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run batch experiments concurrently and stream their results
+    
+    At most BATCH_MAX_CONCURRENT experiments run at once across all batches, and
+    their turns share the auto-response jobs' generation gate at background
+    priority. Each finished experiment is appended to the output file as one
+    JSONL line and then yielded, in the order they finish. With resume,
+    experiments that already completed in the output file are skipped, so a
+    crashed or interrupted run picks up where it stopped. Closing the generator
+    early cancels the experiments still running.
+    
+    Args:
+        experiments: The experiments to run
+        path: The JSONL results file
+        run_id: Names the run; experiments without a conversation_id write to batch-<run_id>-<experiment_id>
+        resume: False to discard earlier results and run every experiment again
+        
+    Yields:
+        One result per experiment with its transcript and per-turn timings
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if resume:
+        finished = {
+            experiment_id for experiment_id, record in (await asyncio.to_thread(read_results, path)).items()
+            if record.get("status") == COMPLETED
+        }
+    else:
+        finished = set()
+        with open(path, "w"):
+            pass
+    
+    pending = [experiment for experiment in experiments if experiment.experiment_id not in finished]
+    logger.info(
+        f"Starting batch {run_id}: {len(pending)} experiments to run, "
+        f"{len(experiments) - len(pending)} already completed"
+    )
+    
+    tasks = [asyncio.create_task(_run_slotted(experiment, run_id)) for experiment in pending]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            record = await next_result
+            await asyncio.to_thread(_append, path, record)
+            yield record
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def _run_slotted(experiment: BatchExperiment, run_id: str) -> Dict[str, Any]:
+    async with _slots():
+        return await run_experiment(experiment, run_id)
+
+async def run_experiment(experiment: BatchExperiment, run_id: str) -> Dict[str, Any]:
+    """
+    Run one experiment's conversation to the end
+    
+    The conversation is cleared first, so an experiment that was cut off by a
+    crash starts again from its seed message.
+    
+    Args:
+        experiment: The experiment
+        run_id: The run the experiment belongs to
+        
+    Returns:
+        The experiment's result, with status "completed" or "failed"
+    """
+    conversation_id = experiment.conversation_id or f"batch-{run_id}-{experiment.experiment_id}"
+    if await history_service.get_conversation_length(conversation_id):
+        await history_service.import_history([], conversation_id)
+    
+    started_at = datetime.utcnow().isoformat() + "Z"
+    start = time.perf_counter()
+    sender, recipient = experiment.message.sender, experiment.message.recipients
+    text = experiment.message.text
+    turns_remaining = dict(experiment.turns)
+    transcript: List[Dict[str, Any]] = []
+    error = None
+    
+    try:
+        while turns_remaining.get(recipient, 0) > 0:
+            prepare_start = time.perf_counter()
+            turn = await turn_service.prepare_turn(
+                timestamp=datetime.utcnow().isoformat() + "Z",
+                persona_settings=experiment.persona_settings,
+                message=Message(sender=sender, recipients=recipient, text=text),
+                conversation_id=conversation_id
+            )
+            generate_start = time.perf_counter()
+            answered = turns_remaining.get(sender, 0) > 0
+            reply = await conversation_runner.generate_turn(turn, next_model=turn.next_model if answered else None)
+            generate_end = time.perf_counter()
+            
+            transcript.append({
+                "sender": recipient,
+                "recipient": sender,
+                "model": turn.recipient_persona["model"],
+                "in_reply_to": turn.message_id,
+                "text": reply,
+                "prepare_seconds": round(generate_start - prepare_start, 4),
+                "generate_seconds": round(generate_end - generate_start, 4)
+            })
+            turns_remaining[recipient] -= 1
+            sender, recipient = recipient, sender
+            text = reply
+        
+        # Record the final reply, which no persona answers
+        if transcript:
+            await history_service.add_message(
+                timestamp=datetime.utcnow().isoformat() + "Z",
+                persona_settings=experiment.persona_settings,
+                message=Message(sender=sender, recipients=recipient, text=text),
+                conversation_id=conversation_id
+            )
+    
+    except Exception as e:
+        logger.error(f"Batch experiment {experiment.experiment_id} failed: {str(e)}")
+        error = str(e)
+    
+    return {
+        "experiment_id": experiment.experiment_id,
+        "run_id": run_id,
+        "conversation_id": conversation_id,
+        "status": FAILED if error else COMPLETED,
+        "error": error,
+        "seed_message": experiment.message.model_dump(),
+        "turns": transcript,
+        "started_at": started_at,
+        "finished_at": datetime.utcnow().isoformat() + "Z",
+        "seconds": round(time.perf_counter() - start, 4)
+    }
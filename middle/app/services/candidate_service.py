@@ -0,0 +1,115 @@
+import asyncio
+import os
+import time
+from typing import AsyncIterator, Dict, List, Any, Optional
+from app.models.schemas import CandidateVariation
+from app.services import ollama_service
+from app.services.resilience import GenerationError
+from app.services.turn_service import PreparedTurn
+
+# Most candidate replies one turn may ask for
+MESSAGE_MAX_CANDIDATES = int(os.getenv("MESSAGE_MAX_CANDIDATES", "8"))
+
+def candidate_settings(
+    recipient_persona: Dict[str, Any],
+    n_candidates: int,
+    variations: Optional[List[CandidateVariation]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Work out the sampling settings of each candidate reply
+    
+    Variation i applies to candidate i; fields it leaves unset, and candidates
+    without a variation, use the persona's settings. When the persona pins a
+    seed, candidates after the first that set no seed of their own get the
+    persona's seed plus their index, so they do not all produce the same text.
+    
+    Args:
+        recipient_persona: The recipient persona's settings
+        n_candidates: The number of candidates
+        variations: The per-candidate variations, if any
+        
+    Returns:
+        The temperature and seed of each candidate, in index order
+        
+    Raises:
+        ValueError: If more candidates than MESSAGE_MAX_CANDIDATES are asked for, or more variations than candidates
+    """
+    variations = variations or []
+    if n_candidates > MESSAGE_MAX_CANDIDATES:
+        raise ValueError(f"At most {MESSAGE_MAX_CANDIDATES} candidates may be generated per turn")
+    if len(variations) > n_candidates:
+        raise ValueError(f"{len(variations)} candidate variations given for {n_candidates} candidates")
+    
+    settings = []
+    persona_seed = recipient_persona.get("seed")
+    for index in range(n_candidates):
+        variation = variations[index] if index < len(variations) else CandidateVariation()
+        seed = variation.seed
+        if seed is None and persona_seed is not None:
+            seed = persona_seed + index
+        settings.append({
+            "index": index,
+            "temperature": recipient_persona["temperature"] if variation.temperature is None else variation.temperature,
+            "seed": seed
+        })
+    return settings
+
+async def _generate_candidate(turn: PreparedTurn, settings: Dict[str, Any]) -> Dict[str, Any]:
+    # Generate one candidate and time its wait for a slot and its generation separately
+    start = time.perf_counter()
+    admitted_at = None
+    
+    def on_admitted() -> None:
+        nonlocal admitted_at
+        admitted_at = time.perf_counter()
+    
+    candidate = dict(settings)
+    try:
+        candidate["raw_text"] = await ollama_service.generate_response(
+            model=turn.recipient_persona["model"],
+            prompt=turn.prompt,
+            temperature=settings["temperature"],
+            messages=turn.messages,
+            next_model=turn.next_model,
+            seed=settings["seed"],
+            on_admitted=on_admitted
+        )
+    except GenerationError as e:
+        candidate.update(raw_text=None, error=str(e), status_code=e.status_code, retry_after=e.retry_after)
+    
+    end = time.perf_counter()
+    # A reply served from the response cache never waits for a slot
+    admitted_at = end if admitted_at is None else admitted_at
+    candidate.update(
+        queued_seconds=round(admitted_at - start, 4),
+        generate_seconds=round(end - admitted_at, 4),
+        seconds=round(end - start, 4)
+    )
+    return candidate
+
+async def generate_candidates(turn: PreparedTurn, settings: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Generate candidate replies to a turn concurrently and yield them as they finish
+    
+    Every candidate goes through the generation scheduler at interactive
+    priority, so the backends' concurrency limits hold: candidates beyond the
+    free slots wait in its queue, and each may be rejected or fail on its own. Closing
+    the generator early cancels the candidates still generating.
+    
+    Args:
+        turn: The prepared turn
+        settings: The candidates' settings, from candidate_settings
+        
+    Yields:
+        Each candidate's settings with its raw_text, or raw_text None with the
+        error, status_code and retry_after of its failure, and its
+        queued_seconds, generate_seconds and seconds
+    """
+    tasks = [asyncio.create_task(_generate_candidate(turn, candidate)) for candidate in settings]
+    try:
+        for next_candidate in asyncio.as_completed(tasks):
+            yield await next_candidate
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
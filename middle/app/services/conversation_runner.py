@@ -0,0 +1,336 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+from app.models.schemas import Message, PersonaSettings
+from app.services import history_service, ollama_service, turn_service
+from app.services.generation_scheduler import BACKGROUND, GenerationRejected
+from app.services.model_residency import ModelBatcher
+
+logger = logging.getLogger(__name__)
+
+# Limits for server-side auto-response jobs
+RUNNER_MAX_ACTIVE_JOBS = int(os.getenv("RUNNER_MAX_ACTIVE_JOBS", "32"))
+RUNNER_MAX_FINISHED_JOBS = int(os.getenv("RUNNER_MAX_FINISHED_JOBS", "100"))
+RUNNER_MAX_TURNS = int(os.getenv("RUNNER_MAX_TURNS", "100"))
+RUNNER_MAX_CONCURRENT_PER_BACKEND = int(os.getenv("RUNNER_MAX_CONCURRENT_PER_BACKEND", "2"))
+
+# Job states
+PENDING = "pending"
+RUNNING = "running"
+PAUSED = "paused"
+CANCELLED = "cancelled"
+COMPLETED = "completed"
+FAILED = "failed"
+
+ACTIVE_STATES = (PENDING, RUNNING, PAUSED)
+
+class JobLimitError(RuntimeError):
+    """Raised when the maximum number of active jobs is already running"""
+
+class ConversationJob:
+    """
+    State of one unattended A<->B conversation
+    """
+    def __init__(
+        self,
+        persona_settings: Dict[str, PersonaSettings],
+        message: Message,
+        turns: Dict[str, int],
+        conversation_id: Optional[str] = None
+    ):
+        now = datetime.utcnow().isoformat() + "Z"
+        self.job_id = str(uuid.uuid4())
+        # Each job writes to its own conversation unless told otherwise
+        self.conversation_id = conversation_id or self.job_id
+        self.persona_settings = persona_settings
+        self.message = message
+        self.sender = message.sender
+        self.recipient = message.recipients
+        self.turns_remaining = dict(turns)
+        self.turns_completed = 0
+        self.last_message_id: Optional[str] = None
+        self.error: Optional[str] = None
+        self.status = PENDING
+        self.created_at = now
+        self.updated_at = now
+        self.task: Optional[asyncio.Task] = None
+        # Set while the job is allowed to run; cleared to pause between turns
+        self.resume_event = asyncio.Event()
+        self.resume_event.set()
+    
+    def set_status(self, status: str) -> None:
+        self.status = status
+        self.updated_at = datetime.utcnow().isoformat() + "Z"
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "conversation_id": self.conversation_id,
+            "status": self.status,
+            "sender": self.sender,
+            "recipient": self.recipient,
+            "turns_remaining": self.turns_remaining,
+            "turns_completed": self.turns_completed,
+            "last_message_id": self.last_message_id,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at
+        }
+
+# Jobs by ID, oldest first
+jobs: "OrderedDict[str, ConversationJob]" = OrderedDict()
+
+# Generation slots for the Ollama backend pool, created lazily inside the event loop
+_backend_gates: Dict[str, ModelBatcher] = {}
+
+def _backend_gate() -> ModelBatcher:
+    # The router spreads jobs over the pool, so the pool gets one allowance per backend.
+    # Turns waiting for a slot are let through grouped by loaded model to avoid swaps.
+    pool = ",".join(ollama_service.OLLAMA_API_URLS)
+    if pool not in _backend_gates:
+        _backend_gates[pool] = ollama_service.create_batcher(RUNNER_MAX_CONCURRENT_PER_BACKEND)
+    return _backend_gates[pool]
+
+def _active_job_count() -> int:
+    return sum(1 for job in jobs.values() if job.status in ACTIVE_STATES)
+
+def _prune_finished_jobs() -> None:
+    finished = [job_id for job_id, job in jobs.items() if job.status not in ACTIVE_STATES]
+    for job_id in finished[:max(0, len(finished) - RUNNER_MAX_FINISHED_JOBS)]:
+        del jobs[job_id]
+
+def validate_job(persona_settings: Dict[str, PersonaSettings], message: Message, turns: Dict[str, int]) -> None:
+    """
+    Check that a conversation can be run
+    
+    Args:
+        persona_settings: The persona settings for both personas
+        message: The seed message
+        turns: The number of replies each persona should generate, keyed by persona ID
+        
+    Raises:
+        ValueError: If a persona or the seed message is missing, or a turn count is out of range
+    """
+    for persona_id in (message.sender, message.recipients):
+        if persona_id not in persona_settings:
+            raise ValueError(f"Missing persona settings for {persona_id}")
+    for persona_id, count in turns.items():
+        if persona_id not in (message.sender, message.recipients):
+            raise ValueError(f"Turn count given for unknown persona {persona_id}")
+        if count < 0 or count > RUNNER_MAX_TURNS:
+            raise ValueError(f"Turn count for {persona_id} must be between 0 and {RUNNER_MAX_TURNS}")
+    if not message.text.strip():
+        raise ValueError("Seed message cannot be empty")
+
+def start_job(
+    persona_settings: Dict[str, PersonaSettings],
+    message: Message,
+    turns: Dict[str, int],
+    conversation_id: Optional[str] = None
+) -> ConversationJob:
+    """
+    Start an auto-response conversation in the background
+    
+    The seed message is sent from message.sender to message.recipients. Each persona
+    then replies to the other until its entry in turns is used up.
+    
+    Args:
+        persona_settings: The persona settings for both personas
+        message: The seed message
+        turns: The number of replies each persona should generate, keyed by persona ID
+        conversation_id: The conversation to write to, defaults to a new one named after the job
+        
+    Returns:
+        The started job
+    """
+    validate_job(persona_settings, message, turns)
+    
+    if _active_job_count() >= RUNNER_MAX_ACTIVE_JOBS:
+        raise JobLimitError(f"Maximum of {RUNNER_MAX_ACTIVE_JOBS} active jobs reached")
+    
+    job = ConversationJob(persona_settings, message, turns, conversation_id)
+    jobs[job.job_id] = job
+    # Keep both personas' models loaded while the job is queued or running
+    ollama_service.residency.hold(job.job_id, {persona_settings[persona_id].model for persona_id in turns})
+    job.task = asyncio.create_task(_run_job(job))
+    _prune_finished_jobs()
+    
+    logger.info(f"Started auto-response job {job.job_id} with turns {turns}")
+    return job
+
+def get_job(job_id: str) -> Optional[ConversationJob]:
+    """
+    Get a job by ID
+    
+    Args:
+        job_id: The job ID
+        
+    Returns:
+        The job, or None if it does not exist
+    """
+    return jobs.get(job_id)
+
+def list_jobs() -> List[ConversationJob]:
+    """
+    Get all known jobs, oldest first
+    
+    Returns:
+        A list of jobs
+    """
+    return list(jobs.values())
+
+def cancel_job(job_id: str) -> Optional[ConversationJob]:
+    """
+    Cancel a job, stopping any generation in progress
+    
+    Args:
+        job_id: The job ID
+        
+    Returns:
+        The job, or None if it does not exist
+    """
+    job = jobs.get(job_id)
+    if job is not None and job.status in ACTIVE_STATES:
+        job.set_status(CANCELLED)
+        if job.task is not None:
+            job.task.cancel()
+        logger.info(f"Cancelled auto-response job {job_id}")
+    return job
+
+def pause_job(job_id: str) -> Optional[ConversationJob]:
+    """
+    Pause a job after the turn currently being generated
+    
+    Args:
+        job_id: The job ID
+        
+    Returns:
+        The job, or None if it does not exist
+    """
+    job = jobs.get(job_id)
+    if job is not None and job.status in (PENDING, RUNNING):
+        job.resume_event.clear()
+        job.set_status(PAUSED)
+        logger.info(f"Paused auto-response job {job_id}")
+    return job
+
+def resume_job(job_id: str) -> Optional[ConversationJob]:
+    """
+    Resume a paused job
+    
+    Args:
+        job_id: The job ID
+        
+    Returns:
+        The job, or None if it does not exist
+    """
+    job = jobs.get(job_id)
+    if job is not None and job.status == PAUSED:
+        job.set_status(RUNNING)
+        job.resume_event.set()
+        logger.info(f"Resumed auto-response job {job_id}")
+    return job
+
+async def _run_job(job: ConversationJob) -> None:
+    sender, recipient = job.sender, job.recipient
+    text = job.message.text
+    raw_text = job.message.raw_text
+    
+    try:
+        while job.turns_remaining.get(recipient, 0) > 0:
+            await job.resume_event.wait()
+            if job.status == PENDING:
+                job.set_status(RUNNING)
+            
+            turn = await turn_service.prepare_turn(
+                timestamp=datetime.utcnow().isoformat() + "Z",
+                persona_settings=job.persona_settings,
+                message=Message(sender=sender, recipients=recipient, text=text, raw_text=raw_text),
+                conversation_id=job.conversation_id
+            )
+            job.last_message_id = turn.message_id
+            
+            answered = job.turns_remaining.get(sender, 0) > 0
+            reply = await generate_turn(turn, next_model=turn.next_model if answered else None)
+            
+            job.turns_remaining[recipient] -= 1
+            job.turns_completed += 1
+            job.updated_at = datetime.utcnow().isoformat() + "Z"
+            
+            # The reply becomes the next message, sent back the other way
+            sender, recipient = recipient, sender
+            text = reply
+            raw_text = reply
+        
+        # Record the final reply, which no persona answers
+        if job.turns_completed > 0:
+            job.last_message_id = await history_service.add_message(
+                timestamp=datetime.utcnow().isoformat() + "Z",
+                persona_settings=job.persona_settings,
+                message=Message(sender=sender, recipients=recipient, text=text, raw_text=raw_text),
+                conversation_id=job.conversation_id
+            )
+        
+        job.set_status(COMPLETED)
+        logger.info(f"Auto-response job {job.job_id} completed after {job.turns_completed} turns")
+    
+    except asyncio.CancelledError:
+        job.set_status(CANCELLED)
+        raise
+    
+    except Exception as e:
+        logger.error(f"Auto-response job {job.job_id} failed: {str(e)}")
+        job.error = str(e)
+        job.set_status(FAILED)
+    
+    finally:
+        ollama_service.residency.release(job.job_id)
+
+async def generate_turn(turn: turn_service.PreparedTurn, next_model: Optional[str]) -> str:
+    """
+    Generate an unattended reply through the pool's shared generation gate
+    
+    Replies run at background priority. When the scheduler turns one away to
+    make room for interactive requests, it waits as advised and tries again.
+    
+    Args:
+        turn: The prepared turn
+        next_model: The model expected to generate the next turn, which may be pre-warmed
+        
+    Returns:
+        The generated reply text
+        
+    Raises:
+        GenerationError: If the generation failed after its retries, which ends the job
+    """
+    model = turn.recipient_persona["model"]
+    while True:
+        try:
+            async with _backend_gate().slot(model):
+                return await ollama_service.generate_response(
+                    model=model,
+                    prompt=turn.prompt,
+                    temperature=turn.recipient_persona["temperature"],
+                    messages=turn.messages,
+                    next_model=next_model,
+                    seed=turn.recipient_persona.get("seed"),
+                    priority=BACKGROUND
+                )
+        except GenerationRejected as e:
+            logger.info(f"Generation for message {turn.message_id} deferred, retrying in {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+
+async def shutdown() -> None:
+    """
+    Cancel all active jobs, used when the application stops
+    """
+    tasks = [job.task for job in jobs.values() if job.status in ACTIVE_STATES and job.task is not None]
+    for job in jobs.values():
+        if job.status in ACTIVE_STATES:
+            cancel_job(job.job_id)
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,310 @@
+import asyncio
+import itertools
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Any, Optional
+from app.services.backend_router import Backend, BackendRouter
+from app.services.metrics import TURN_PHASE_SECONDS
+from app.services.resilience import GenerationError, HALF_OPEN
+
+logger = logging.getLogger(__name__)
+
+# Generations each backend runs at once; further requests wait in the scheduler's queue
+SCHEDULER_MAX_CONCURRENT_PER_BACKEND = int(os.getenv("SCHEDULER_MAX_CONCURRENT_PER_BACKEND", "2"))
+
+# Requests that may wait for a slot; further requests are rejected with 429
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "64"))
+
+# Seconds a request may wait for a slot before it is rejected with 503; 0 waits without limit
+SCHEDULER_INTERACTIVE_QUEUE_TIMEOUT = float(os.getenv("SCHEDULER_INTERACTIVE_QUEUE_TIMEOUT", "30"))
+SCHEDULER_BACKGROUND_QUEUE_TIMEOUT = float(os.getenv("SCHEDULER_BACKGROUND_QUEUE_TIMEOUT", "0"))
+
+# Priorities; lower values are served first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+class GenerationRejected(GenerationError):
+    """
+    Raised when a generation is not admitted, with the HTTP status and Retry-After to report
+    """
+    def __init__(self, detail: str, status_code: int, retry_after: int):
+        super().__init__(detail, retry_after=retry_after)
+        self.status_code = status_code
+
+class _Waiter:
+    def __init__(self, model: str, priority: int, sequence: int, future: asyncio.Future):
+        self.model = model
+        self.priority = priority
+        self.sequence = sequence
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+class GenerationScheduler:
+    """
+    Admission control for generations in front of the backend pool
+    
+    Each backend runs at most slots_per_backend generations at once. Requests
+    beyond that wait in one bounded queue, interactive turns ahead of background
+    work such as auto-response jobs and summaries, and oldest first within a
+    priority. A free slot goes to the backend the router would pick for the
+    waiter's model; a waiter only takes a slot on a backend that may have its
+    model pulled, so it can be passed by one whose model another backend serves. When the queue is full, a new interactive request takes the
+    place of the newest background waiter, which is rejected; otherwise the new
+    request is rejected at once with 429. A request that waits past its queue
+    timeout is rejected with 503. Both carry a Retry-After estimated from recent
+    generation times, so callers back off instead of piling up until the
+    generation timeout fires. Waiters are dispatched again whenever capacity
+    grows: a slot is released, a backend is added or readmitted, or an ejected
+    backend's circuit is due to let traffic through.
+    """
+    def __init__(
+        self,
+        router: BackendRouter,
+        slots_per_backend: Optional[int] = None,
+        max_queue: Optional[int] = None
+    ):
+        self.router = router
+        self.slots_per_backend = SCHEDULER_MAX_CONCURRENT_PER_BACKEND if slots_per_backend is None else slots_per_backend
+        self.max_queue = SCHEDULER_MAX_QUEUE if max_queue is None else max_queue
+        self.waiters: List[_Waiter] = []
+        self.reserved: Dict[str, int] = {}
+        self._sequence = itertools.count()
+        # Moving average of how long a generation holds its slot
+        self.service_seconds = 0.0
+        self.admitted = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.wait_seconds = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.evicted = 0
+        self._circuit_timer: Optional[asyncio.TimerHandle] = None
+        router.capacity_listeners.append(self._dispatch)
+    
+    @asynccontextmanager
+    async def slot(self, model: str, priority: int = INTERACTIVE, timeout: Optional[float] = None) -> AsyncIterator[Backend]:
+        """
+        Hold a generation slot on a backend
+        
+        Args:
+            model: The model the generation uses
+            priority: INTERACTIVE or BACKGROUND
+            timeout: Seconds to wait for a slot, defaulting to the priority's queue timeout
+            
+        Yields:
+            The backend to send the generation to
+            
+        Raises:
+            GenerationRejected: If the queue is full or the wait timed out
+        """
+        backend = await self.acquire(model, priority, timeout)
+        started = time.monotonic()
+        try:
+            yield backend
+        finally:
+            self.release(backend, time.monotonic() - started)
+    
+    async def acquire(self, model: str, priority: int = INTERACTIVE, timeout: Optional[float] = None) -> Backend:
+        if not self.waiters:
+            backend = self._free_backend(model)
+            if backend is not None:
+                self._admit(backend, priority, 0.0)
+                return backend
+        
+        if len(self.waiters) >= self.max_queue:
+            self._make_room(priority)
+        
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(model, priority, next(self._sequence), loop.create_future())
+        self.waiters.append(waiter)
+        self._watch_circuits()
+        if timeout is None:
+            timeout = SCHEDULER_INTERACTIVE_QUEUE_TIMEOUT if priority == INTERACTIVE else SCHEDULER_BACKGROUND_QUEUE_TIMEOUT
+        if timeout > 0:
+            waiter.timer = loop.call_later(timeout, self._expire, waiter, timeout)
+        
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was handed over just as the waiter was cancelled
+                self.release(waiter.future.result(), None)
+            else:
+                self._remove(waiter)
+            raise
+    
+    def try_acquire(self, model: str, exclude: Backend) -> Optional[Backend]:
+        """
+        Take a free slot on a healthy backend other than the given one, without waiting
+        
+        Used for hedged requests, which only use capacity no queued request is
+        waiting for. The slot is given back with release.
+        
+        Args:
+            model: The model the generation uses
+            exclude: The backend already generating the request
+            
+        Returns:
+            The backend, or None if no other backend has a free slot or requests are queued
+        """
+        if self.waiters:
+            return None
+        available = [
+            backend for backend in self.router.backends
+            if backend is not exclude and backend.healthy and backend.may_have(model)
+            and self.reserved.get(backend.url, 0) < self._slots(backend)
+        ]
+        if not available:
+            return None
+        backend = self.router.choose(model, available)
+        self.reserved[backend.url] = self.reserved.get(backend.url, 0) + 1
+        return backend
+    
+    def release(self, backend: Backend, service_seconds: Optional[float]) -> None:
+        self.reserved[backend.url] = max(0, self.reserved.get(backend.url, 0) - 1)
+        if service_seconds is not None:
+            self.service_seconds = service_seconds if not self.service_seconds else 0.8 * self.service_seconds + 0.2 * service_seconds
+        self._dispatch()
+    
+    def _capacity(self) -> int:
+        return self.slots_per_backend * len(self.router.healthy_backends())
+    
+    def _free_backend(self, model: str) -> Optional[Backend]:
+        # A request waits for a backend with its model rather than taking a free one without it
+        available = [
+            backend for backend in self.router.serving(model, self.router.healthy_backends())
+            if self.reserved.get(backend.url, 0) < self._slots(backend)
+        ]
+        if not available:
+            return None
+        return self.router.choose(model, available)
+    
+    def _slots(self, backend: Backend) -> int:
+        # A half-open backend gets one slot, for the single trial request its circuit lets through
+        return 1 if backend.breaker.state == HALF_OPEN else self.slots_per_backend
+    
+    def _admit(self, backend: Backend, priority: int, waited: float) -> None:
+        self.reserved[backend.url] = self.reserved.get(backend.url, 0) + 1
+        name = PRIORITY_NAMES[priority]
+        self.admitted[name] += 1
+        self.wait_seconds[name] += waited
+        TURN_PHASE_SECONDS.observe(waited, phase="queue_wait")
+    
+    def _dispatch(self) -> None:
+        # A waiter whose model's backends are all busy does not hold up one whose model has a free slot elsewhere
+        for waiter in sorted(self.waiters, key=lambda item: (item.priority, item.sequence)):
+            backend = self._free_backend(waiter.model)
+            if backend is None:
+                continue
+            self._remove(waiter)
+            self._admit(backend, waiter.priority, time.monotonic() - waiter.enqueued_at)
+            waiter.future.set_result(backend)
+        if self.waiters:
+            self._watch_circuits()
+    
+    def _watch_circuits(self) -> None:
+        # Dispatch again once the first ejected backend's circuit lets traffic through, which no event announces
+        ejected = [backend for backend in self.router.backends if not backend.healthy]
+        if not ejected or self._circuit_timer is not None:
+            return
+        delay = min(backend.breaker.retry_after() for backend in ejected)
+        self._circuit_timer = asyncio.get_running_loop().call_later(delay, self._circuit_due)
+    
+    def _circuit_due(self) -> None:
+        self._circuit_timer = None
+        self._dispatch()
+    
+    def _remove(self, waiter: _Waiter) -> None:
+        if waiter.timer is not None:
+            waiter.timer.cancel()
+        self.waiters = [item for item in self.waiters if item is not waiter]
+    
+    def check(self, priority: int = INTERACTIVE) -> None:
+        """
+        Reject a request up front if it could not be queued now
+        
+        Used before committing to a streamed response, whose status cannot
+        change once the first byte is sent.
+        
+        Args:
+            priority: INTERACTIVE or BACKGROUND
+            
+        Raises:
+            GenerationRejected: If the queue is full of requests of the same or a higher priority
+        """
+        if len(self.waiters) >= self.max_queue and not any(waiter.priority > priority for waiter in self.waiters):
+            raise self._queue_full(priority)
+    
+    def _queue_full(self, priority: int) -> GenerationRejected:
+        self.rejected_full += 1
+        retry_after = self.retry_after()
+        logger.warning(f"Rejected {PRIORITY_NAMES[priority]} generation, {len(self.waiters)} requests already queued")
+        return GenerationRejected(
+            f"Generation queue is full ({len(self.waiters)} waiting), retry in {retry_after}s", 429, retry_after
+        )
+    
+    def _make_room(self, priority: int) -> None:
+        # Evict the newest waiter of a lower priority, or reject the new request
+        lower = [waiter for waiter in self.waiters if waiter.priority > priority]
+        if not lower:
+            raise self._queue_full(priority)
+        victim = max(lower, key=lambda waiter: (waiter.priority, waiter.sequence))
+        self._remove(victim)
+        self.evicted += 1
+        retry_after = self.retry_after()
+        victim.future.set_exception(GenerationRejected(
+            f"Generation was displaced by an interactive request, retry in {retry_after}s", 429, retry_after
+        ))
+    
+    def _expire(self, waiter: _Waiter, timeout: float) -> None:
+        if waiter.future.done():
+            return
+        waiter.timer = None
+        self._remove(waiter)
+        self.rejected_timeout += 1
+        retry_after = self.retry_after()
+        logger.warning(f"{PRIORITY_NAMES[waiter.priority].capitalize()} generation for {waiter.model} waited {timeout:g}s without a slot")
+        waiter.future.set_exception(GenerationRejected(
+            f"No generation slot became free within {timeout:g}s, retry in {retry_after}s", 503, retry_after
+        ))
+    
+    def retry_after(self) -> int:
+        """
+        Estimate how many seconds the current queue takes to drain
+        
+        Returns:
+            Whole seconds, at least 1
+        """
+        per_slot = self.service_seconds or 1.0
+        return max(1, math.ceil(per_slot * (len(self.waiters) + 1) / max(1, self._capacity())))
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get slot use, queue lengths and rejection counts
+        
+        Returns:
+            A dictionary of scheduler statistics
+        """
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for waiter in self.waiters:
+            queued[PRIORITY_NAMES[waiter.priority]] += 1
+        return {
+            "slots_per_backend": self.slots_per_backend,
+            "capacity": self._capacity(),
+            "in_use": sum(self.reserved.values()),
+            "queued": queued,
+            "max_queue": self.max_queue,
+            "admitted": dict(self.admitted),
+            "average_wait_seconds": {
+                name: round(self.wait_seconds[name] / count, 3) if count else 0.0
+                for name, count in self.admitted.items()
+            },
+            "average_generation_seconds": round(self.service_seconds, 3),
+            "rejected_queue_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "evicted": self.evicted
+        }
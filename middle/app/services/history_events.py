@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import os
+from typing import Dict, Any, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Events buffered per subscriber before it is treated as a slow consumer
+HISTORY_SUBSCRIBER_QUEUE_SIZE = int(os.getenv("HISTORY_SUBSCRIBER_QUEUE_SIZE", "256"))
+
+class Subscription:
+    """
+    A subscriber's bounded queue of history events
+    """
+    def __init__(self, conversation_id: Optional[str], maxsize: int):
+        self.conversation_id = conversation_id
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=maxsize)
+        self.evicted = False
+    
+    def wants(self, event: Dict[str, Any]) -> bool:
+        return self.conversation_id is None or self.conversation_id == event["conversation_id"]
+
+# Active subscriptions
+subscribers: Set[Subscription] = set()
+
+def subscribe(conversation_id: Optional[str] = None) -> Subscription:
+    """
+    Start receiving history events
+    
+    Args:
+        conversation_id: Only receive events for this conversation, or None for all
+        
+    Returns:
+        The subscription, whose queue receives the events
+    """
+    subscription = Subscription(conversation_id, HISTORY_SUBSCRIBER_QUEUE_SIZE)
+    subscribers.add(subscription)
+    logger.info(f"History subscriber added ({len(subscribers)} active)")
+    return subscription
+
+def unsubscribe(subscription: Subscription) -> None:
+    """
+    Stop receiving history events
+    
+    Args:
+        subscription: The subscription to remove
+    """
+    if subscription in subscribers:
+        subscribers.discard(subscription)
+        logger.info(f"History subscriber removed ({len(subscribers)} active)")
+
+def _evict(subscription: Subscription) -> None:
+    # Drop what the subscriber has not read and leave it a single eviction notice
+    subscribers.discard(subscription)
+    subscription.evicted = True
+    while not subscription.queue.empty():
+        subscription.queue.get_nowait()
+    subscription.queue.put_nowait({"type": "evicted", "conversation_id": subscription.conversation_id})
+    logger.warning(f"Evicted slow history subscriber ({len(subscribers)} active)")
+
+def publish(event: Dict[str, Any]) -> None:
+    """
+    Deliver an event to every interested subscriber without waiting
+    
+    Subscribers whose queue is full are evicted rather than slowing down the
+    writer. Must be called from the event loop thread.
+    
+    Args:
+        event: The event, with at least "type" and "conversation_id"
+    """
+    for subscription in list(subscribers):
+        if not subscription.wants(event):
+            continue
+        try:
+            subscription.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            _evict(subscription)
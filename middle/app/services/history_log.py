@@ -0,0 +1,224 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# History persistence settings
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "memory").lower()
+HISTORY_LOG_PATH = os.getenv("HISTORY_LOG_PATH", "data/history.jsonl")
+HISTORY_FSYNC_INTERVAL = float(os.getenv("HISTORY_FSYNC_INTERVAL", "0.5"))
+HISTORY_FSYNC_BATCH = int(os.getenv("HISTORY_FSYNC_BATCH", "1000"))
+HISTORY_COMPACT_MIN_RECORDS = int(os.getenv("HISTORY_COMPACT_MIN_RECORDS", "10000"))
+HISTORY_COMPACT_RATIO = float(os.getenv("HISTORY_COMPACT_RATIO", "2.0"))
+
+# Marker that stops the writer thread
+_STOP = object()
+
+class HistoryLog:
+    """
+    Append-only JSONL log of history changes
+    
+    Every change is one line: {"op": "append", "conversation_id", "entry"} or
+    {"op": "reset", "conversation_id"}. Callers only enqueue records; a writer
+    thread writes them and fsyncs once per batch or interval, so disk latency
+    stays off the request path. Compaction rewrites the log from a snapshot of
+    the store in the writer thread and atomically replaces the old file.
+    """
+    def __init__(
+        self,
+        path: str,
+        fsync_interval: float = HISTORY_FSYNC_INTERVAL,
+        fsync_batch: int = HISTORY_FSYNC_BATCH
+    ):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self.records_in_log = 0
+        self.compacting = False
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+    
+    def replay(self, store) -> int:
+        """
+        Rebuild a ConversationStore from the log
+        
+        A torn final line, left by a crash in the middle of a write, is cut off so
+        that new records start on a clean line. Other unreadable lines are skipped.
+        
+        Args:
+            store: The ConversationStore to apply the records to
+            
+        Returns:
+            The number of records replayed
+        """
+        if not os.path.exists(self.path):
+            return 0
+        
+        # Decoding str lines with one decoder skips json.loads' per-call encoding detection
+        decode = json.JSONDecoder().decode
+        replayed = 0
+        skipped = 0
+        good_offset = 0
+        with open(self.path, "rb") as log_file:
+            for line in log_file:
+                if not line.endswith(b"\n"):
+                    logger.warning(f"Discarding torn record at the end of {self.path}")
+                    break
+                good_offset += len(line)
+                try:
+                    record = decode(line.decode("utf-8"))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    skipped += 1
+                    continue
+                
+                if record["op"] == "append":
+                    store.append(record["conversation_id"], record["entry"])
+                elif record["op"] == "reset":
+                    store.replace(record["conversation_id"], [])
+                replayed += 1
+        
+        if good_offset < os.path.getsize(self.path):
+            with open(self.path, "r+b") as log_file:
+                log_file.truncate(good_offset)
+        
+        if skipped:
+            logger.error(f"Skipped {skipped} unreadable records in {self.path}")
+        
+        self.records_in_log = replayed
+        logger.info(f"Replayed {replayed} history records from {self.path}")
+        return replayed
+    
+    def start(self) -> None:
+        """
+        Open the log for appending and start the writer thread
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="history-log-writer", daemon=True)
+        self._thread.start()
+    
+    def append(self, conversation_id: str, entry: Dict[str, Any]) -> None:
+        """
+        Queue an appended entry for writing
+        
+        Args:
+            conversation_id: The conversation the entry was added to
+            entry: The history entry
+        """
+        self.records_in_log += 1
+        self._queue.put({"op": "append", "conversation_id": conversation_id, "entry": entry})
+    
+    def reset(self, conversation_id: str, entries: List[Dict[str, Any]]) -> None:
+        """
+        Queue the replacement of a conversation's history for writing
+        
+        Args:
+            conversation_id: The conversation that was replaced
+            entries: The new entries of the conversation
+        """
+        self.records_in_log += 1
+        self._queue.put({"op": "reset", "conversation_id": conversation_id})
+        for entry in entries:
+            self.append(conversation_id, entry)
+    
+    def needs_compaction(self, live_entries: int) -> bool:
+        """
+        Check whether the log has grown enough, relative to the live history, to compact
+        
+        Args:
+            live_entries: The number of entries currently in the store
+            
+        Returns:
+            True if a compaction should be requested
+        """
+        return (
+            not self.compacting
+            and self.records_in_log >= HISTORY_COMPACT_MIN_RECORDS
+            and self.records_in_log > live_entries * HISTORY_COMPACT_RATIO
+        )
+    
+    def compact(self, snapshot: Dict[str, List[Dict[str, Any]]]) -> None:
+        """
+        Queue a compaction of the log down to the given snapshot
+        
+        The snapshot must be taken at the moment of the call, so that it reflects
+        exactly the records queued before it.
+        
+        Args:
+            snapshot: The entries of every conversation, keyed by conversation ID
+        """
+        self.compacting = True
+        self.records_in_log = sum(len(entries) + 1 for entries in snapshot.values())
+        self._queue.put(("compact", snapshot))
+    
+    def close(self) -> None:
+        """
+        Write and fsync everything queued, then stop the writer thread
+        """
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+    
+    def _run(self) -> None:
+        pending = 0
+        last_sync = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                item = None
+            
+            if item is _STOP:
+                self._sync()
+                self._file.close()
+                return
+            
+            if isinstance(item, tuple):
+                self._sync()
+                self._rewrite(item[1])
+                pending = 0
+            elif item is not None:
+                self._file.write(json.dumps(item) + "\n")
+                pending += 1
+            
+            if pending and (pending >= self.fsync_batch or time.monotonic() - last_sync >= self.fsync_interval):
+                self._sync()
+                pending = 0
+                last_sync = time.monotonic()
+    
+    def _sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+    
+    def _rewrite(self, snapshot: Dict[str, List[Dict[str, Any]]]) -> None:
+        started = time.perf_counter()
+        temp_path = self.path + ".compact"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as temp_file:
+                for conversation_id, entries in snapshot.items():
+                    temp_file.write(json.dumps({"op": "reset", "conversation_id": conversation_id}) + "\n")
+                    for entry in entries:
+                        temp_file.write(json.dumps({"op": "append", "conversation_id": conversation_id, "entry": entry}) + "\n")
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            
+            self._file.close()
+            os.replace(temp_path, self.path)
+            self._file = open(self.path, "a", encoding="utf-8")
+            logger.info(f"Compacted {self.path} in {time.perf_counter() - started:.2f}s")
+        except OSError as e:
+            logger.error(f"Failed to compact {self.path}: {str(e)}")
+            if self._file.closed:
+                self._file = open(self.path, "a", encoding="utf-8")
+        finally:
+            self.compacting = False
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import os
+import zlib
+from typing import IO, AsyncIterator, Dict, Iterable, Iterator, List, Any, Tuple
+from pydantic import TypeAdapter, ValidationError
+from app.models.schemas import HistoryEntry
+
+# Entries serialized or validated together on export and import
+HISTORY_NDJSON_BATCH = int(os.getenv("HISTORY_NDJSON_BATCH", "1000"))
+
+# Longest line accepted on import, in bytes; bounds the buffer for a line still being read
+HISTORY_NDJSON_MAX_LINE_BYTES = int(os.getenv("HISTORY_NDJSON_MAX_LINE_BYTES", str(1024 * 1024)))
+
+# The first bytes of a gzip stream
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Most bytes inflated from one piece of gzip input at a time, so a small upload cannot expand all at once
+_INFLATE_BYTES = 64 * 1024
+
+# zlib window bits for the gzip container
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+_entries_adapter = TypeAdapter(List[HistoryEntry])
+
+def encode(batches: Iterable[List[Dict[str, Any]]], compress: bool = False) -> Iterator[bytes]:
+    """
+    Serialize history entries as NDJSON, one entry per line
+    
+    Args:
+        batches: The entries, in batches
+        compress: Whether to gzip the output
+        
+    Yields:
+        The encoded bytes, one piece per batch
+    """
+    compressor = zlib.compressobj(wbits=_GZIP_WBITS) if compress else None
+    for batch in batches:
+        data = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch).encode("utf-8")
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor is not None:
+        yield compressor.flush()
+
+def _validate(lines: List[Tuple[int, bytes]]) -> List[Dict[str, Any]]:
+    # Validate the batch as one JSON array, which is much faster than line by line;
+    # only when that fails are the lines checked one by one to report which is wrong
+    try:
+        entries = _entries_adapter.validate_json(b"[" + b",".join(line for _, line in lines) + b"]")
+        if len(entries) == len(lines):
+            return _entries_adapter.dump_python(entries)
+    except ValidationError:
+        pass
+    for number, line in lines:
+        try:
+            HistoryEntry.model_validate_json(line)
+        except ValidationError as e:
+            error = e.errors()[0]
+            location = ".".join(str(part) for part in error["loc"])
+            raise ValueError(f"Line {number}: {location + ': ' if location else ''}{error['msg']}")
+    raise ValueError(f"Lines {lines[0][0]}-{lines[-1][0]}: each line must hold exactly one history entry")
+
+def _inflate(decompressor: Any, data: bytes) -> Iterator[bytes]:
+    try:
+        while data:
+            yield decompressor.decompress(data, _INFLATE_BYTES)
+            data = decompressor.unconsumed_tail
+    except zlib.error as e:
+        raise ValueError(f"Invalid gzip data: {str(e)}")
+
+async def decode(chunks: AsyncIterator[bytes]) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Parse and validate an NDJSON history, one entry per line, as it arrives
+    
+    Gzipped input is detected from its first bytes and inflated on the fly. At
+    most HISTORY_NDJSON_BATCH lines and one partial line are held at a time, and
+    each batch is validated in a worker thread so a large import does not stall
+    the event loop. Blank lines are ignored.
+    
+    Args:
+        chunks: The raw bytes, such as a request body stream
+        
+    Yields:
+        Batches of validated entries in input order
+        
+    Raises:
+        ValueError: If a line is not a valid history entry or is too long, or the gzip data is corrupt
+    """
+    head = b""
+    decompressor = None
+    started = False
+    buffer = b""
+    line_number = 0
+    batch: List[Tuple[int, bytes]] = []
+    
+    async def pieces() -> AsyncIterator[bytes]:
+        nonlocal head, decompressor, started
+        async for chunk in chunks:
+            if not started:
+                # Wait for enough bytes to recognise gzip
+                head += chunk
+                if len(head) < len(GZIP_MAGIC):
+                    continue
+                started = True
+                if head.startswith(GZIP_MAGIC):
+                    decompressor = zlib.decompressobj(wbits=_GZIP_WBITS)
+                chunk, head = head, b""
+            if decompressor is None:
+                yield chunk
+            else:
+                for piece in _inflate(decompressor, chunk):
+                    yield piece
+        if head:
+            yield head
+        if decompressor is not None:
+            yield decompressor.flush()
+            if not decompressor.eof:
+                raise ValueError("Invalid gzip data: the stream is truncated")
+    
+    async for piece in pieces():
+        buffer += piece
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        if len(buffer) > HISTORY_NDJSON_MAX_LINE_BYTES:
+            raise ValueError(f"Line {line_number + len(lines) + 1}: longer than {HISTORY_NDJSON_MAX_LINE_BYTES} bytes")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                batch.append((line_number, line))
+            if len(batch) >= HISTORY_NDJSON_BATCH:
+                yield await asyncio.to_thread(_validate, batch)
+                batch = []
+    
+    if buffer.strip():
+        batch.append((line_number + 1, buffer))
+    if batch:
+        yield await asyncio.to_thread(_validate, batch)
+
+def _write_batch(staged: IO[str], batch: List[Dict[str, Any]]) -> None:
+    staged.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch)
+
+async def stage(batches: AsyncIterator[List[Dict[str, Any]]], staged: IO[str]) -> int:
+    """
+    Write validated history entries to a file as NDJSON, so an import does not hold them in memory
+    
+    Each batch is written in a worker thread. Read the entries back with read_staged.
+    
+    Args:
+        batches: Batches of validated entries, from decode
+        staged: An open text file, such as a temporary file
+        
+    Returns:
+        The number of entries written
+        
+    Raises:
+        ValueError: If decode rejects the input
+    """
+    count = 0
+    async for batch in batches:
+        await asyncio.to_thread(_write_batch, staged, batch)
+        count += len(batch)
+    return count
+
+def read_staged(staged: IO[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Read back the entries stage wrote, from the start of the file
+    
+    Args:
+        staged: The file stage wrote to
+        
+    Yields:
+        The entries in input order
+    """
+    staged.seek(0)
+    decode = json.JSONDecoder().decode
+    for line in staged:
+        yield decode(line)
@@ -1,14 +1,257 @@
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional
+from bisect import bisect_left, bisect_right, insort
+from itertools import chain
+from typing import Iterable, Iterator, List, Dict, Any, Optional, Tuple
 from datetime import datetime
 import uuid
 import json
+import os
 from app.models.schemas import HistoryEntry, Message, PersonaSettings
+from app.services import history_events, history_log, state_backend, tokenizer_service
 
 logger = logging.getLogger(__name__)
 
+# Conversation used when a caller does not name one
+DEFAULT_CONVERSATION_ID = "default"
+
+# Upper bound on context messages, whatever the token budget allows
+CONTEXT_MAX_MESSAGES = int(os.getenv("CONTEXT_MAX_MESSAGES", "50"))
+
+# Tokens added by formatting one context line ("sender: " and the separator)
+CONTEXT_LINE_OVERHEAD = 4
+
+# Share of the budget an anchored context is cut back to once it overflows
+CONTEXT_TRIM_RATIO = float(os.getenv("CONTEXT_TRIM_RATIO", "0.5"))
+
+# History change records read from the state backend at a time
+HISTORY_SYNC_BATCH = 1000
+
+class ConversationStore:
+    """
+    In-memory history storage, scoped by conversation
+    
+    Each conversation is an append-only list of entries. A dict maps every
+    message_id to its conversation and position, and a sorted list of
+    (timestamp, position) keys per conversation serves timestamp range queries.
+    Every change takes the next value of a store-wide revision counter, which
+    is recorded per conversation so readers can cheaply tell whether it changed.
+    A caller may supply the revision instead, such as the sequence number of a
+    change in the shared state backend, which every worker agrees on.
+    """
+    def __init__(self):
+        self.conversations: Dict[str, List[Dict[str, Any]]] = {}
+        self.index: Dict[str, Tuple[str, int]] = {}
+        self.timestamps: Dict[str, List[Tuple[str, int]]] = {}
+        self.revision = 0
+        self.revisions: Dict[str, int] = {}
+        self.reset_revisions: Dict[str, int] = {}
+        # Cached token counts of message texts, per tokenizer name and message_id
+        self.token_counts: Dict[str, Dict[str, int]] = {}
+    
+    def append(self, conversation_id: str, entry: Dict[str, Any], revision: Optional[int] = None) -> None:
+        entries = self.conversations.setdefault(conversation_id, [])
+        keys = self.timestamps.setdefault(conversation_id, [])
+        position = len(entries)
+        entries.append(entry)
+        self.index[entry["message_id"]] = (conversation_id, position)
+        key = (entry["timestamp"], position)
+        # Timestamps normally arrive in order, which keeps this an append
+        if not keys or keys[-1] <= key:
+            keys.append(key)
+        else:
+            insort(keys, key)
+        self.revision = self.revision + 1 if revision is None else revision
+        self.revisions[conversation_id] = self.revision
+    
+    def replace(self, conversation_id: str, entries: List[Dict[str, Any]], revision: Optional[int] = None) -> None:
+        for entry in self.conversations.pop(conversation_id, []):
+            if self.index.get(entry["message_id"], (None,))[0] == conversation_id:
+                del self.index[entry["message_id"]]
+                for counts in self.token_counts.values():
+                    counts.pop(entry["message_id"], None)
+        self.timestamps.pop(conversation_id, None)
+        self.conversations[conversation_id] = []
+        self.revision = self.revision + 1 if revision is None else revision
+        self.revisions[conversation_id] = self.revision
+        self.reset_revisions[conversation_id] = self.revision
+        for entry in entries:
+            self.append(conversation_id, entry, revision)
+    
+    def get(self, message_id: str) -> Optional[Dict[str, Any]]:
+        location = self.index.get(message_id)
+        if location is None:
+            return None
+        conversation_id, position = location
+        return self.conversations[conversation_id][position]
+    
+    def entries(self, conversation_id: str) -> List[Dict[str, Any]]:
+        return self.conversations.get(conversation_id, [])
+    
+    def token_count(self, entry: Dict[str, Any], tokenizer_name: str) -> int:
+        counts = self.token_counts.setdefault(tokenizer_name, {})
+        count = counts.get(entry["message_id"])
+        if count is None:
+            count = tokenizer_service.count_tokens(entry["message"]["text"], tokenizer_name)
+            counts[entry["message_id"]] = count
+        return count
+    
+    def position(self, conversation_id: str, message_id: str) -> Optional[int]:
+        location = self.index.get(message_id)
+        if location is None or location[0] != conversation_id:
+            return None
+        return location[1]
+    
+    def tail(self, conversation_id: str, count: int) -> List[Dict[str, Any]]:
+        if count <= 0:
+            return []
+        return self.conversations.get(conversation_id, [])[-count:]
+    
+    def between(self, conversation_id: str, start: Optional[str], end: Optional[str]) -> List[Dict[str, Any]]:
+        entries = self.conversations.get(conversation_id, [])
+        keys = self.timestamps.get(conversation_id, [])
+        low = bisect_left(keys, (start, -1)) if start is not None else 0
+        high = bisect_right(keys, (end, len(entries))) if end is not None else len(keys)
+        return [entries[position] for _, position in keys[low:high]]
+
 # In-memory history storage
-message_history: List[Dict[str, Any]] = []
+store = ConversationStore()
+
+# First context position per (conversation, anchor key), with the reset revision it belongs to
+_context_anchors: Dict[Tuple[str, str], Tuple[int, int]] = {}
+
+# Sequence number of the last history change applied from the state backend
+_applied_seq = 0
+
+# Conversations whose import is being applied, with the number of imported entries still to come
+_pending_resets: Dict[str, int] = {}
+
+# Applies other workers' history changes in the background when the state backend is shared
+_follow_task: Optional[asyncio.Task] = None
+
+# Durable log of history changes, set when HISTORY_BACKEND=jsonl
+persistence: Optional[history_log.HistoryLog] = None
+
+def start_persistence() -> None:
+    """
+    Replay the on-disk history log and start recording changes, if enabled
+    """
+    global persistence
+    if history_log.HISTORY_BACKEND != "jsonl" or persistence is not None:
+        return
+    if state_backend.get_backend().shared:
+        logger.warning("HISTORY_BACKEND=jsonl is ignored; the shared state backend already keeps history")
+        return
+    
+    persistence = history_log.HistoryLog(history_log.HISTORY_LOG_PATH)
+    persistence.replay(store)
+    persistence.start()
+    _maybe_compact()
+
+def stop_persistence() -> None:
+    """
+    Flush and close the on-disk history log
+    """
+    global persistence
+    if persistence is not None:
+        persistence.close()
+        persistence = None
+
+def start_sync() -> None:
+    """
+    Follow history changes made by other workers, if the state backend is shared
+    
+    Reads apply them anyway; following them in the background also delivers
+    them to history feed subscribers of this worker.
+    """
+    global _follow_task
+    if state_backend.get_backend().shared and _follow_task is None:
+        _follow_task = asyncio.create_task(_follow())
+
+async def stop_sync() -> None:
+    """
+    Stop following history changes made by other workers
+    """
+    global _follow_task
+    if _follow_task is not None:
+        _follow_task.cancel()
+        await asyncio.gather(_follow_task, return_exceptions=True)
+        _follow_task = None
+
+async def _follow() -> None:
+    while True:
+        await asyncio.sleep(state_backend.STATE_SYNC_INTERVAL)
+        try:
+            await _sync()
+        except Exception as e:
+            logger.error(f"Error reading history changes: {str(e)}")
+
+async def _sync() -> None:
+    # Apply the history changes logged since the last sync, by this worker or another, in log order.
+    # The log is read in a worker thread when it is shared, and other tasks run between batches,
+    # so neither the database nor a large import holds up the event loop
+    backend = state_backend.get_backend()
+    while True:
+        records = await state_backend.run(backend.history_since, _applied_seq, HISTORY_SYNC_BATCH)
+        if not records:
+            return
+        _apply_records(records, backend.shared)
+        if len(records) < HISTORY_SYNC_BATCH:
+            return
+        await asyncio.sleep(0)
+
+def _apply_records(records: List[Tuple[int, Dict[str, Any]]], shared: bool) -> None:
+    # Apply records read from the log, skipping those another sync applied since they were read
+    global _applied_seq
+    for seq, record in records:
+        if seq <= _applied_seq:
+            continue
+        _apply(record, seq if shared else None)
+        _applied_seq = seq
+
+def _apply(record: Dict[str, Any], revision: Optional[int]) -> None:
+    # Apply one change record to the store and tell history feed subscribers about it;
+    # the entries of an import are announced together by one reset event once all are applied
+    conversation_id = record["conversation_id"]
+    if record["op"] == "reset":
+        store.replace(conversation_id, [], revision)
+        _pending_resets.pop(conversation_id, None)
+        if record["count"]:
+            _pending_resets[conversation_id] = record["count"]
+        else:
+            _publish_reset(conversation_id, 0)
+        return
+    
+    store.append(conversation_id, record["entry"], revision)
+    remaining = _pending_resets.get(conversation_id)
+    if remaining is None:
+        history_events.publish({
+            "type": "append",
+            "conversation_id": conversation_id,
+            "version": _version(conversation_id),
+            "entry": record["entry"]
+        })
+    elif remaining > 1:
+        _pending_resets[conversation_id] = remaining - 1
+    else:
+        del _pending_resets[conversation_id]
+        _publish_reset(conversation_id, len(store.entries(conversation_id)))
+
+def _publish_reset(conversation_id: str, count: int) -> None:
+    history_events.publish({
+        "type": "reset",
+        "conversation_id": conversation_id,
+        "version": _version(conversation_id),
+        "count": count
+    })
+
+def _maybe_compact() -> None:
+    live_entries = len(store.index)
+    if persistence.needs_compaction(live_entries):
+        logger.info(f"Compacting history log ({persistence.records_in_log} records, {live_entries} live)")
+        persistence.compact({
+            conversation_id: list(entries) for conversation_id, entries in store.conversations.items()
+        })
 
 def generate_message_id() -> str:
     """
@@ -21,10 +264,11 @@ def generate_message_id() -> str:
     random_string = str(uuid.uuid4())[:8]
     return f"{timestamp}-{random_string}"
 
-def add_message(
+async def add_message(
     timestamp: str,
     persona_settings: Dict[str, PersonaSettings],
-    message: Message
+    message: Message,
+    conversation_id: str = DEFAULT_CONVERSATION_ID
 ) -> str:
     """
     Add a message to the history
@@ -33,6 +277,7 @@ def add_message(
         timestamp: The timestamp of the message
         persona_settings: The persona settings at the time of the message
         message: The message object
+        conversation_id: The conversation to add the message to
         
     Returns:
         The generated message ID
@@ -48,38 +293,237 @@ def add_message(
         "message": message.model_dump()
     }
     
-    message_history.append(entry)
-    logger.info(f"Added message to history with ID: {message_id}")
+    backend = state_backend.get_backend()
+    await state_backend.run(backend.append_history, [{"op": "append", "conversation_id": conversation_id, "entry": entry}])
+    await _sync()
+    # Count tokens once, when the message is stored, for the context builder
+    store.token_count(entry, tokenizer_service.CONTEXT_TOKENIZER)
+    if persistence is not None:
+        persistence.append(conversation_id, entry)
+        _maybe_compact()
+    logger.info(f"Added message to history with ID: {message_id} (conversation {conversation_id})")
     
     return message_id
 
-def get_history() -> List[Dict[str, Any]]:
+async def get_history(conversation_id: str = DEFAULT_CONVERSATION_ID) -> List[Dict[str, Any]]:
     """
-    Get the complete message history
+    Get the complete message history of a conversation
     
+    Args:
+        conversation_id: The conversation to read
+        
     Returns:
         The complete message history
     """
-    return message_history
+    await _sync()
+    return list(store.entries(conversation_id))
 
-def import_history(history: List[Dict[str, Any]]) -> int:
+async def iter_history(
+    conversation_id: str = DEFAULT_CONVERSATION_ID,
+    batch_size: int = 1000
+) -> Iterator[List[Dict[str, Any]]]:
     """
-    Import a history from an external source
+    Iterate over the message history of a conversation in batches, without copying it
+    
+    The messages are those present when iteration starts. Messages appended
+    later are left out, and an import during iteration does not affect it.
+    
+    Args:
+        conversation_id: The conversation to read
+        batch_size: The number of messages per batch
+        
+    Returns:
+        An iterator over batches of messages, oldest first, which may be consumed from another thread
+    """
+    # Sync and take the list now rather than on the first batch, which may be read from a worker thread.
+    # An import replaces the conversation's list rather than changing it, so this one stays intact.
+    await _sync()
+    entries = store.entries(conversation_id)
+    end = len(entries)
+    return (entries[start:min(start + batch_size, end)] for start in range(0, end, batch_size))
+
+async def get_history_between(
+    conversation_id: str = DEFAULT_CONVERSATION_ID,
+    start: Optional[str] = None,
+    end: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Get the messages of a conversation with timestamps in an inclusive range
+    
+    Args:
+        conversation_id: The conversation to read
+        start: The earliest timestamp to include, or None for no lower bound
+        end: The latest timestamp to include, or None for no upper bound
+        
+    Returns:
+        The matching messages in timestamp order
+    """
+    await _sync()
+    return store.between(conversation_id, start, end)
+
+async def get_history_version(conversation_id: str = DEFAULT_CONVERSATION_ID) -> str:
+    """
+    Get an opaque version string that changes whenever a conversation changes
+    
+    Args:
+        conversation_id: The conversation to check
+        
+    Returns:
+        The version string, suitable for use as an ETag
+    """
+    await _sync()
+    return _version(conversation_id)
+
+def _version(conversation_id: str) -> str:
+    return f"{state_backend.get_backend().instance_id}-{store.revisions.get(conversation_id, 0)}"
+
+def _replaced_since(conversation_id: str, version: Optional[str]) -> bool:
+    if version is None:
+        return False
+    instance_id, _, revision = version.partition("-")
+    if instance_id != state_backend.get_backend().instance_id or not revision.isdigit():
+        return True
+    return int(revision) < store.reset_revisions.get(conversation_id, 0)
+
+async def get_history_page(
+    conversation_id: str = DEFAULT_CONVERSATION_ID,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    known_version: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], bool, bool]:
+    """
+    Get the messages of a conversation that follow a cursor
+    
+    Args:
+        conversation_id: The conversation to read
+        after: The message_id of the last message the caller already has, or None to start at the beginning
+        limit: The maximum number of messages to return, or None for no limit
+        known_version: The version the caller's copy was read at, if known
+        
+    Returns:
+        A tuple of (messages, has_more, reset). reset is True when the caller's
+        copy is no longer a prefix of the conversation, for example after an
+        import, in which case messages start from the beginning.
+    """
+    await _sync()
+    entries = store.entries(conversation_id)
+    start = 0
+    reset = False
+    
+    if after is not None:
+        position = store.position(conversation_id, after)
+        if position is None or _replaced_since(conversation_id, known_version):
+            reset = True
+        else:
+            start = position + 1
+    
+    end = len(entries) if limit is None else min(len(entries), start + limit)
+    return entries[start:end], end < len(entries), reset
+
+async def get_messages(conversation_id: str, start: int, end: int) -> List[Dict[str, Any]]:
+    """
+    Get the messages of a conversation between two positions
+    
+    Args:
+        conversation_id: The conversation to read
+        start: The position of the first message to include
+        end: The position after the last message to include
+        
+    Returns:
+        The messages, oldest first
+    """
+    await _sync()
+    return store.entries(conversation_id)[start:end]
+
+async def get_conversation_length(conversation_id: str = DEFAULT_CONVERSATION_ID) -> int:
+    """
+    Get the number of messages in a conversation
+    
+    Args:
+        conversation_id: The conversation to check
+        
+    Returns:
+        The number of messages
+    """
+    await _sync()
+    return len(store.entries(conversation_id))
+
+async def get_reset_revision(conversation_id: str = DEFAULT_CONVERSATION_ID) -> int:
+    """
+    Get the revision at which a conversation was last replaced by an import
+    
+    Args:
+        conversation_id: The conversation to check
+        
+    Returns:
+        The revision, or 0 if it was never replaced
+    """
+    await _sync()
+    return store.reset_revisions.get(conversation_id, 0)
+
+async def get_message(message_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Look up a message by its ID
+    
+    Args:
+        message_id: The message ID
+        
+    Returns:
+        The history entry, or None if it does not exist
+    """
+    await _sync()
+    return store.get(message_id)
+
+async def list_conversations() -> Dict[str, int]:
+    """
+    Get the known conversations
+    
+    Returns:
+        The number of messages in each conversation, keyed by conversation ID
+    """
+    await _sync()
+    return {conversation_id: len(entries) for conversation_id, entries in store.conversations.items()}
+
+async def import_history(
+    history: Iterable[Dict[str, Any]],
+    conversation_id: str = DEFAULT_CONVERSATION_ID,
+    count: Optional[int] = None
+) -> int:
+    """
+    Import a history from an external source, replacing the conversation's history
+    
+    The history is written to the state backend in one transaction, so other
+    readers see either the old or the new conversation. It is read only once,
+    in a worker thread while it is written, so it may come lazily from a staged
+    file. It is then applied to the store in batches, letting other tasks run
+    between them.
     
     Args:
         history: The history to import
+        conversation_id: The conversation to replace
+        count: The number of entries in history, needed unless it is a list
         
     Returns:
         The number of messages imported
     """
-    global message_history
-    message_history = history
-    logger.info(f"Imported {len(history)} messages into history")
-    return len(history)
+    if count is None:
+        count = len(history)
+    # In a worker thread for every backend, since reading a large history is slow even when storing it is not
+    await asyncio.to_thread(state_backend.get_backend().append_history, chain(
+        [{"op": "reset", "conversation_id": conversation_id, "count": count}],
+        ({"op": "append", "conversation_id": conversation_id, "entry": entry} for entry in history)
+    ))
+    await _sync()
+    if persistence is not None:
+        persistence.reset(conversation_id, store.entries(conversation_id)[:count])
+        _maybe_compact()
+    logger.info(f"Imported {count} messages into history (conversation {conversation_id})")
+    return count
 
-def get_conversation_context(
+async def get_conversation_context(
     current_message: Dict[str, Any],
-    num_previous_messages: int = 2
+    num_previous_messages: int = 2,
+    conversation_id: str = DEFAULT_CONVERSATION_ID
 ) -> List[Dict[str, Any]]:
     """
     Get the conversation context for a message
@@ -87,12 +531,14 @@ def get_conversation_context(
     Args:
         current_message: The current message
         num_previous_messages: The number of previous messages to include
+        conversation_id: The conversation the message belongs to
         
     Returns:
         A list of messages representing the conversation context
     """
+    await _sync()
     # Get the most recent messages, limited by num_previous_messages
-    recent_messages = message_history[-num_previous_messages:] if message_history else []
+    recent_messages = store.tail(conversation_id, num_previous_messages)
     
     # Format the messages for the context
     context = []
@@ -104,4 +550,111 @@ def get_conversation_context(
             "text": message_data["text"]
         })
     
-    return context 
\ No newline at end of file
+    return context
+
+async def get_budgeted_context(
+    token_budget: int,
+    tokenizer_name: str = "heuristic",
+    conversation_id: str = DEFAULT_CONVERSATION_ID,
+    exclude_message_id: Optional[str] = None,
+    max_messages: int = CONTEXT_MAX_MESSAGES
+) -> List[Dict[str, Any]]:
+    """
+    Get the most recent messages of a conversation that fit in a token budget
+    
+    Args:
+        token_budget: The number of tokens the context may use
+        tokenizer_name: The tokenizer to count with
+        conversation_id: The conversation to read
+        exclude_message_id: A message to leave out, normally the one being answered
+        max_messages: The maximum number of messages to include
+        
+    Returns:
+        A list of messages representing the conversation context, oldest first
+    """
+    await _sync()
+    entries = store.entries(conversation_id)
+    selected = []
+    used = 0
+    
+    for entry in reversed(entries):
+        if len(selected) >= max_messages:
+            break
+        if entry["message_id"] == exclude_message_id:
+            continue
+        
+        cost = store.token_count(entry, tokenizer_name) + CONTEXT_LINE_OVERHEAD
+        if used + cost > token_budget:
+            break
+        
+        used += cost
+        selected.append(entry)
+    
+    return [
+        {"sender": entry["message"]["sender"], "text": entry["message"]["text"]}
+        for entry in reversed(selected)
+    ]
+
+async def get_anchored_context(
+    token_budget: int,
+    anchor_key: str,
+    tokenizer_name: str = "heuristic",
+    conversation_id: str = DEFAULT_CONVERSATION_ID,
+    exclude_message_id: Optional[str] = None,
+    max_messages: int = CONTEXT_MAX_MESSAGES
+) -> List[Dict[str, Any]]:
+    """
+    Get a token-budgeted context whose first message stays fixed between turns
+    
+    get_budgeted_context slides its window by one message per turn, which changes
+    the start of every prompt. This variant keeps the window's start anchored and
+    only grows it, so consecutive prompts share a prefix. When the window no
+    longer fits, it is cut back to CONTEXT_TRIM_RATIO of the budget in one go, so
+    the prefix changes once per many turns instead of on every turn.
+    
+    Args:
+        token_budget: The number of tokens the context may use
+        anchor_key: Identifies whose prompt prefix to keep stable, such as the recipient persona
+        tokenizer_name: The tokenizer to count with
+        conversation_id: The conversation to read
+        exclude_message_id: A message to leave out, normally the one being answered
+        max_messages: The maximum number of messages to include
+        
+    Returns:
+        A list of messages representing the conversation context, oldest first
+    """
+    await _sync()
+    entries = store.entries(conversation_id)
+    end = len(entries)
+    if end and entries[-1]["message_id"] == exclude_message_id:
+        end -= 1
+    
+    key = (conversation_id, anchor_key)
+    reset_revision = store.reset_revisions.get(conversation_id, 0)
+    saved = _context_anchors.get(key)
+    anchor = saved[1] if saved is not None and saved[0] == reset_revision else 0
+    anchor = min(anchor, end)
+    
+    def cost(entry: Dict[str, Any]) -> int:
+        return store.token_count(entry, tokenizer_name) + CONTEXT_LINE_OVERHEAD
+    
+    used = sum(cost(entry) for entry in entries[anchor:end])
+    if used > token_budget or end - anchor > max_messages:
+        # Re-anchor on the newest messages that fit in the trimmed budget
+        trimmed_budget = token_budget * CONTEXT_TRIM_RATIO
+        trimmed_count = max(1, int(max_messages * CONTEXT_TRIM_RATIO))
+        anchor = end
+        used = 0
+        while anchor > 0 and end - anchor < trimmed_count:
+            next_cost = cost(entries[anchor - 1])
+            if used + next_cost > trimmed_budget:
+                break
+            used += next_cost
+            anchor -= 1
+    
+    _context_anchors[key] = (reset_revision, anchor)
+    
+    return [
+        {"sender": entry["message"]["sender"], "text": entry["message"]["text"]}
+        for entry in entries[anchor:end]
+    ]
@@ -0,0 +1,230 @@
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, List, Any, Optional, Sequence, Tuple
+
+# Histogram buckets in seconds, from a fast prompt build to a long generation
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Histogram buckets for token counts
+TOKEN_BUCKETS = (1, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Metric:
+    """
+    A named metric family with optional labels, rendered in the Prometheus text format
+    """
+    kind = "untyped"
+    
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+    
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Metric {self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+    
+    def _label_dict(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labels, key))
+    
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        return iter(())
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    """
+    A value that only goes up, such as a number of requests
+    """
+    kind = "counter"
+    
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+    
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+    
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        for key, value in sorted(self.values.items()):
+            yield self.name, self._label_dict(key), value
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, such as requests in flight
+    """
+    kind = "gauge"
+    
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+    
+    def set(self, value: float, **labels: Any) -> None:
+        self.values[self._key(labels)] = value
+    
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+    
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+    
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        for key, value in sorted(self.values.items()):
+            yield self.name, self._label_dict(key), value
+
+class Histogram(Metric):
+    """
+    Counts of observations in cumulative buckets, with their sum
+    """
+    kind = "histogram"
+    
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: observations per bucket (the last one is +Inf), and their sum
+        self.counts: Dict[Tuple[str, ...], List[int]] = {}
+        self.sums: Dict[Tuple[str, ...], float] = {}
+    
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[key] += value
+    
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        for key, counts in sorted(self.counts.items()):
+            labels = self._label_dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, self.sums[key]
+            yield f"{self.name}_count", labels, cumulative
+
+class Registry:
+    """
+    The metrics exposed on /metrics
+    """
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+    
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+    
+    def render(self, extra: Iterable[Metric] = ()) -> str:
+        """
+        Render every metric in the Prometheus text exposition format
+        
+        Args:
+            extra: Metrics built at scrape time from state owned elsewhere, such as cache counters
+            
+        Returns:
+            The exposition text
+        """
+        lines: List[str] = []
+        for metric in list(self.metrics.values()) + list(extra):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help_text, labels))
+
+def gauge(name: str, help_text: str, labels: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help_text, labels))
+
+def histogram(name: str, help_text: str, labels: Sequence[str] = (), buckets: Optional[Sequence[float]] = None) -> Histogram:
+    return REGISTRY.register(Histogram(name, help_text, labels, buckets or LATENCY_BUCKETS))
+
+# Request latency per route, observed by the HTTP middleware
+HTTP_REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds",
+    "Time until the response starts, per route",
+    ("method", "route", "status")
+)
+
+# Where a turn's time goes, from recording the message to the end of generation
+TURN_PHASE_SECONDS = histogram(
+    "turn_phase_duration_seconds",
+    "Time spent in each phase of a turn: history_append, context_build, prompt_construction, "
+    "queue_wait, ollama_first_byte and generation",
+    ("phase",)
+)
+
+# What Ollama reports for each generation
+OLLAMA_EVAL_TOKENS = histogram(
+    "ollama_eval_count",
+    "Tokens generated per response, as reported by Ollama",
+    ("model",),
+    TOKEN_BUCKETS
+)
+OLLAMA_EVAL_SECONDS = histogram(
+    "ollama_eval_duration_seconds",
+    "Time Ollama spent generating tokens per response",
+    ("model",)
+)
+OLLAMA_PROMPT_EVAL_TOKENS = histogram(
+    "ollama_prompt_eval_count",
+    "Prompt tokens evaluated per response, as reported by Ollama",
+    ("model",),
+    TOKEN_BUCKETS
+)
+OLLAMA_GENERATIONS = counter(
+    "ollama_generations_total",
+    "Generations sent to Ollama, by outcome",
+    ("model", "outcome")
+)
+
+OLLAMA_RETRIES = counter(
+    "ollama_retries_total",
+    "Generations sent again after a failure that is safe to repeat",
+    ("model",)
+)
+
+OLLAMA_HEDGES = counter(
+    "ollama_hedged_requests_total",
+    "Generations also sent to a second backend after running past the hedge percentile, by which reply won",
+    ("model", "winner")
+)
+
+def observe_ollama_stats(model: str, data: Dict[str, Any]) -> None:
+    """
+    Record the counts and durations from Ollama's final response or chunk
+    
+    Args:
+        model: The model that generated the response
+        data: The response, with durations in nanoseconds
+    """
+    if "eval_count" in data:
+        OLLAMA_EVAL_TOKENS.observe(data["eval_count"], model=model)
+    if "eval_duration" in data:
+        OLLAMA_EVAL_SECONDS.observe(data["eval_duration"] / 1e9, model=model)
+    if "prompt_eval_count" in data:
+        OLLAMA_PROMPT_EVAL_TOKENS.observe(data["prompt_eval_count"], model=model)
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Any, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# keep_alive sent with requests for models of active persona pairs and for everything else
+RESIDENCY_KEEP_ALIVE_ACTIVE = os.getenv("RESIDENCY_KEEP_ALIVE_ACTIVE", "30m")
+RESIDENCY_KEEP_ALIVE_IDLE = os.getenv("RESIDENCY_KEEP_ALIVE_IDLE", "5m")
+
+# Seconds a persona pair seen in an interactive turn counts as active
+RESIDENCY_PAIR_TTL = float(os.getenv("RESIDENCY_PAIR_TTL", "600"))
+
+# What fits on one backend, used to decide whether pre-warming can evict nothing; 0 means unknown
+RESIDENCY_MEMORY_BUDGET = int(os.getenv("RESIDENCY_MEMORY_BUDGET", "0"))
+RESIDENCY_MAX_LOADED_MODELS = int(os.getenv("RESIDENCY_MAX_LOADED_MODELS", "0"))
+
+# Queued turns for a loaded model that may go ahead of an older turn for another model,
+# and seconds a free slot is held for such a turn before an unloaded model gets it
+RESIDENCY_MAX_BATCH = int(os.getenv("RESIDENCY_MAX_BATCH", "16"))
+RESIDENCY_BATCH_WAIT = float(os.getenv("RESIDENCY_BATCH_WAIT", "0.05"))
+
+class ResidencyManager:
+    """
+    Keep the models of active conversations loaded and count model swaps
+    
+    Models of persona pairs that are talking, whether in an auto-response job or
+    in recent interactive turns, get a long keep_alive; other models get the
+    idle keep_alive so they free memory sooner. A model may be pre-warmed while
+    the other persona's model generates, but only when the backend's known
+    budget shows it fits without evicting anything.
+    """
+    def __init__(self):
+        self.held: Dict[str, Set[str]] = {}
+        self.pairs: Dict[Tuple[str, str], float] = {}
+        self.model_sizes: Dict[str, int] = {}
+        self.swaps = 0
+        self.load_seconds = 0.0
+        self.loads_by_model: Dict[str, int] = {}
+        self.prewarms = 0
+    
+    def hold(self, owner: str, models: Iterable[str]) -> None:
+        """
+        Mark models as active until released, such as for a queued or running job
+        
+        Args:
+            owner: Identifies the holder, such as a job ID
+            models: The models it will use
+        """
+        self.held[owner] = set(models)
+    
+    def release(self, owner: str) -> None:
+        """
+        Release the models held by an owner
+        
+        Args:
+            owner: The holder passed to hold()
+        """
+        self.held.pop(owner, None)
+    
+    def note_pair(self, model: str, next_model: str) -> None:
+        """
+        Record that two models are taking turns in a conversation
+        
+        Args:
+            model: The model generating now
+            next_model: The model expected to generate the next turn
+        """
+        self.pairs[tuple(sorted((model, next_model)))] = time.monotonic() + RESIDENCY_PAIR_TTL
+    
+    def active_models(self) -> Set[str]:
+        """
+        Get the models of held jobs and of persona pairs seen recently
+        
+        Returns:
+            The set of active model names
+        """
+        now = time.monotonic()
+        for pair in [pair for pair, expires in self.pairs.items() if expires < now]:
+            del self.pairs[pair]
+        active: Set[str] = set()
+        for models in self.held.values():
+            active |= models
+        for pair in self.pairs:
+            active.update(pair)
+        return active
+    
+    def keep_alive(self, model: str) -> str:
+        """
+        Get the keep_alive to send with a request for a model
+        
+        Args:
+            model: The model name
+            
+        Returns:
+            An Ollama keep_alive duration
+        """
+        if model in self.active_models():
+            return RESIDENCY_KEEP_ALIVE_ACTIVE
+        return RESIDENCY_KEEP_ALIVE_IDLE
+    
+    def record_sizes(self, models: List[Dict[str, Any]]) -> None:
+        """
+        Remember model sizes from /api/tags or /api/ps entries
+        
+        Args:
+            models: Model information dictionaries
+        """
+        for model in models:
+            name = model.get("model") or model.get("name")
+            size = model.get("size_vram") or model.get("size")
+            if name and size:
+                self.model_sizes[name] = size
+    
+    def fits(self, model: str, loaded: Dict[str, int]) -> bool:
+        """
+        Check whether loading a model would evict nothing on a backend
+        
+        Args:
+            model: The model to load
+            loaded: The models loaded on the backend and their sizes
+            
+        Returns:
+            True if a configured limit shows the model fits; False if it does not or nothing is known
+        """
+        if not RESIDENCY_MEMORY_BUDGET and not RESIDENCY_MAX_LOADED_MODELS:
+            return False
+        if RESIDENCY_MAX_LOADED_MODELS and len(loaded) + 1 > RESIDENCY_MAX_LOADED_MODELS:
+            return False
+        if RESIDENCY_MEMORY_BUDGET:
+            size = self.model_sizes.get(model)
+            if size is None:
+                return False
+            used = sum(loaded_size or self.model_sizes.get(name, 0) for name, loaded_size in loaded.items())
+            if used + size > RESIDENCY_MEMORY_BUDGET:
+                return False
+        return True
+    
+    def record_load(self, backend_url: str, model: str, load_seconds: float) -> None:
+        """
+        Count a cold model load and log it
+        
+        Args:
+            backend_url: The backend the model was loaded on
+            model: The model that was loaded
+            load_seconds: How long the load took
+        """
+        self.swaps += 1
+        self.load_seconds += load_seconds
+        self.loads_by_model[model] = self.loads_by_model.get(model, 0) + 1
+        logger.info(
+            f"Loaded model {model} on {backend_url} in {load_seconds:.2f}s "
+            f"(swap {self.swaps}, {self.load_seconds:.1f}s spent loading so far)"
+        )
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get swap counts and load times
+        
+        Returns:
+            A dictionary of residency statistics
+        """
+        return {
+            "swaps": self.swaps,
+            "load_seconds": round(self.load_seconds, 3),
+            "loads_by_model": dict(self.loads_by_model),
+            "prewarms": self.prewarms,
+            "active_models": sorted(self.active_models())
+        }
+
+class ModelBatcher:
+    """
+    A semaphore that lets waiters for already loaded models go first
+    
+    When a slot frees up, a waiter whose model is loaded is preferred over older
+    waiters for other models, so queued turns run in batches per model instead
+    of alternating models and forcing a load on every turn. If only waiters for
+    other models are queued, the slot is held for RESIDENCY_BATCH_WAIT seconds,
+    since the turn that just finished usually queues its follow-up straight
+    away. After RESIDENCY_MAX_BATCH turns have gone ahead, the oldest waiter is
+    served, so no model waits forever.
+    """
+    def __init__(
+        self,
+        slots: int,
+        resident: Callable[[], Set[str]],
+        max_batch: Optional[int] = None,
+        batch_wait: Optional[float] = None
+    ):
+        self.free = slots
+        self.resident = resident
+        self.max_batch = RESIDENCY_MAX_BATCH if max_batch is None else max_batch
+        self.batch_wait = RESIDENCY_BATCH_WAIT if batch_wait is None else batch_wait
+        self.skipped = 0
+        self.waiters: List[Tuple[str, asyncio.Future]] = []
+        self._held: Optional[asyncio.TimerHandle] = None
+    
+    @asynccontextmanager
+    async def slot(self, model: str) -> AsyncIterator[None]:
+        """
+        Hold a slot for a generation with the given model
+        
+        Args:
+            model: The model the generation uses
+        """
+        await self.acquire(model)
+        try:
+            yield
+        finally:
+            self.release()
+    
+    async def acquire(self, model: str) -> None:
+        if self.free > 0 and (not self.waiters or (self._held is not None and self._may_skip(model))):
+            if self.waiters:
+                self.skipped += 1
+            self.free -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append((model, waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the waiter was cancelled
+                self.release()
+            else:
+                self.waiters = [item for item in self.waiters if item[1] is not waiter]
+            raise
+    
+    def release(self) -> None:
+        self.free += 1
+        self._dispatch(hold=True)
+    
+    def _may_skip(self, model: str) -> bool:
+        return self.skipped < self.max_batch and model in self.resident()
+    
+    def _dispatch(self, hold: bool = False) -> None:
+        if self._held is not None:
+            self._held.cancel()
+            self._held = None
+        while self.free > 0 and self.waiters:
+            index = self._next_index()
+            if index is None:
+                if hold and self.batch_wait > 0:
+                    self._held = asyncio.get_running_loop().call_later(self.batch_wait, self._dispatch)
+                    return
+                index = 0
+            _, waiter = self.waiters.pop(index)
+            if waiter.done():
+                continue
+            if index == 0:
+                self.skipped = 0
+            else:
+                self.skipped += 1
+            self.free -= 1
+            waiter.set_result(None)
+    
+    def _next_index(self) -> Optional[int]:
+        # The first waiter for a loaded model, 0 once enough have gone ahead, or None if there is none
+        if self.skipped >= self.max_batch:
+            return 0
+        resident = self.resident()
+        for index, (model, _) in enumerate(self.waiters):
+            if model in resident:
+                return index
+        return None
@@ -1,116 +1,807 @@
+import asyncio
 import httpx
 import logging
 import json
 import os
-from typing import Dict, List, Any, Optional
-from app.models.schemas import OllamaRequest, OllamaResponse
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Any, Optional, Set, Tuple
+from app.models.schemas import OllamaRequest, OllamaChatRequest, OllamaResponse
+from app.services.backend_router import Backend, BackendRouter
+from app.services.generation_scheduler import GenerationRejected, GenerationScheduler, INTERACTIVE
+from app.services.model_residency import ModelBatcher, ResidencyManager
+from app.services import metrics, resilience, response_cache
+from app.services.resilience import BackendError, BackendTimeout, BackendUnavailable, GenerationError, HALF_OPEN, LatencyWindow, ModelNotFound, backoff_delay
+from app.services.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
 # Get Ollama API URL from environment variable or use default
 OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://ollama:11434/api")
 
-async def generate_response(model: str, prompt: str, temperature: float = 0.7) -> str:
+# Comma-separated pool of Ollama API URLs; defaults to the single OLLAMA_API_URL
+OLLAMA_API_URLS = [url.strip() for url in os.getenv("OLLAMA_API_URLS", OLLAMA_API_URL).split(",") if url.strip()]
+
+# Seconds between health probes of every backend, which also refresh their loaded models; 0 disables them
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+
+# Load time above which a reply counts as a cold load, which may have evicted other models
+OLLAMA_COLD_LOAD_SECONDS = float(os.getenv("OLLAMA_COLD_LOAD_SECONDS", "0.05"))
+
+# Connection pool settings for the shared Ollama client
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "100"))
+OLLAMA_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OLLAMA_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "30"))
+OLLAMA_HTTP2 = os.getenv("OLLAMA_HTTP2", "False").lower() == "true"
+
+# Per-operation timeouts in seconds
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_GENERATE_TIMEOUT = float(os.getenv("OLLAMA_GENERATE_TIMEOUT", "60"))
+OLLAMA_METADATA_TIMEOUT = float(os.getenv("OLLAMA_METADATA_TIMEOUT", "5"))
+OLLAMA_UNLOAD_TIMEOUT = float(os.getenv("OLLAMA_UNLOAD_TIMEOUT", "30"))
+
+# Seconds /api/tags and /api/ps results are cached, and for how much longer a stale
+# result may still be served while it is refreshed in the background
+OLLAMA_MODELS_CACHE_TTL = float(os.getenv("OLLAMA_MODELS_CACHE_TTL", "30"))
+OLLAMA_RUNNING_MODELS_CACHE_TTL = float(os.getenv("OLLAMA_RUNNING_MODELS_CACHE_TTL", "2"))
+OLLAMA_CACHE_STALE_TTL = float(os.getenv("OLLAMA_CACHE_STALE_TTL", "30"))
+
+# Unloads the housekeeping routine runs at once
+OLLAMA_UNLOAD_CONCURRENCY = int(os.getenv("OLLAMA_UNLOAD_CONCURRENCY", "4"))
+
+GENERATE_TIMEOUT = httpx.Timeout(OLLAMA_GENERATE_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT)
+METADATA_TIMEOUT = httpx.Timeout(OLLAMA_METADATA_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT)
+UNLOAD_TIMEOUT = httpx.Timeout(OLLAMA_UNLOAD_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT)
+
+# Shared client, created on application startup and closed on shutdown
+_client: Optional[httpx.AsyncClient] = None
+
+router = BackendRouter(OLLAMA_API_URLS)
+_health_task: Optional[asyncio.Task] = None
+_refresh_tasks: Dict[str, asyncio.Task] = {}
+
+scheduler = GenerationScheduler(router)
+
+residency = ResidencyManager()
+_prewarm_tasks: Dict[str, asyncio.Task] = {}
+_housekeeping_tasks: Set[asyncio.Task] = set()
+
+models_cache = TTLCache("models", OLLAMA_MODELS_CACHE_TTL, OLLAMA_CACHE_STALE_TTL)
+running_models_cache = TTLCache("running models", OLLAMA_RUNNING_MODELS_CACHE_TTL, OLLAMA_CACHE_STALE_TTL)
+responses = response_cache.ResponseCache()
+
+# Recent generation times per model, which set when a generation is hedged
+latencies = LatencyWindow()
+
+def configure_backends(urls: List[str]) -> None:
     """
-    Generate a response from Ollama
+    Replace the pool of Ollama backends
     
     Args:
+        urls: The API URLs of the backends
+    """
+    global OLLAMA_API_URL, OLLAMA_API_URLS
+    router.configure(urls)
+    models_cache.invalidate()
+    running_models_cache.invalidate()
+    OLLAMA_API_URLS = [backend.url for backend in router.backends]
+    OLLAMA_API_URL = OLLAMA_API_URLS[0]
+
+def _http2_enabled() -> bool:
+    """
+    Check whether HTTP/2 was requested and the h2 package is installed
+    
+    Returns:
+        True if the shared client should negotiate HTTP/2
+    """
+    if not OLLAMA_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("OLLAMA_HTTP2 is enabled but the h2 package is not installed, using HTTP/1.1")
+        return False
+
+def _create_client() -> httpx.AsyncClient:
+    """
+    Create the pooled HTTP client used for all Ollama calls
+    
+    Returns:
+        A new httpx.AsyncClient configured from the environment
+    """
+    limits = httpx.Limits(
+        max_connections=OLLAMA_MAX_CONNECTIONS,
+        max_keepalive_connections=OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=GENERATE_TIMEOUT,
+        http2=_http2_enabled()
+    )
+
+async def start_client() -> httpx.AsyncClient:
+    """
+    Create the shared Ollama client if it does not exist yet
+    
+    Returns:
+        The shared client
+    """
+    global _client, _health_task
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+        logger.info(
+            f"Started shared Ollama client (max_connections={OLLAMA_MAX_CONNECTIONS}, "
+            f"max_keepalive={OLLAMA_MAX_KEEPALIVE_CONNECTIONS}, http2={_http2_enabled()}, "
+            f"backends={len(router.backends)})"
+        )
+    if OLLAMA_HEALTH_INTERVAL > 0 and (_health_task is None or _health_task.done()):
+        _health_task = asyncio.create_task(_health_loop())
+    return _client
+
+async def close_client() -> None:
+    """
+    Close the shared Ollama client and release its connections
+    """
+    global _client, _health_task
+    tasks = list(_refresh_tasks.values()) + list(_prewarm_tasks.values()) + list(_housekeeping_tasks)
+    if _health_task is not None:
+        tasks.append(_health_task)
+        _health_task = None
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("Closed shared Ollama client")
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Get the shared Ollama client, creating it lazily when used outside the app lifespan
+    
+    Returns:
+        The shared client
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+async def _probe(backend: Backend) -> None:
+    try:
+        response = await get_client().get(f"{backend.url}/ps", timeout=METADATA_TIMEOUT)
+        if response.status_code == 200:
+            models = response.json().get("models", [])
+            residency.record_sizes(models)
+            loaded = {
+                model.get("model") or model.get("name"): model.get("size_vram") or model.get("size") or 0
+                for model in models
+            }
+            loaded.pop(None, None)
+            router.record_probe(backend, loaded)
+            return
+        logger.warning(f"Health probe of {backend.url} returned status {response.status_code}")
+    except (httpx.RequestError, ValueError) as e:
+        logger.warning(f"Health probe of {backend.url} failed: {str(e)}")
+    router.record_probe(backend, None)
+
+async def probe_backends() -> None:
+    """
+    Probe every backend's /api/ps, refreshing its health and loaded models
+    """
+    await asyncio.gather(*(_probe(backend) for backend in router.backends))
+
+def _refresh(backend: Backend) -> None:
+    # Re-read one backend's loaded models in the background, at most once at a time
+    if backend.url not in _refresh_tasks:
+        task = asyncio.create_task(_probe(backend))
+        _refresh_tasks[backend.url] = task
+        task.add_done_callback(lambda _: _refresh_tasks.pop(backend.url, None))
+
+def _record_loaded(backend: Backend, model: str, data: Dict[str, Any]) -> None:
+    # A cold load may have evicted other models from the backend, so the router's view is refreshed
+    load_duration = data.get("load_duration", 0)
+    cold = load_duration >= OLLAMA_COLD_LOAD_SECONDS * 1e9
+    if cold:
+        residency.record_load(backend.url, model, load_duration / 1e9)
+    if cold or model not in backend.loaded_models:
+        _refresh(backend)
+    backend.loaded_models.add(model)
+
+def resident_models() -> Set[str]:
+    """
+    Get the models loaded on any healthy backend, as last seen by the router
+    
+    Returns:
+        The set of loaded model names
+    """
+    return router.resident_models()
+
+def create_batcher(slots_per_backend: int) -> ModelBatcher:
+    """
+    Create a generation gate for the backend pool that batches waiting turns by loaded model
+    
+    Args:
+        slots_per_backend: Concurrent generations allowed per backend
+        
+    Returns:
+        A new ModelBatcher
+    """
+    return ModelBatcher(slots_per_backend * len(router.backends), resident_models)
+
+def _prewarm_next(current: Backend, model: str, next_model: Optional[str]) -> None:
+    # Load the next turn's model while this one generates, if it fits without evicting anything
+    if not next_model or next_model == model:
+        return
+    residency.note_pair(model, next_model)
+    if next_model in _prewarm_tasks or next_model in router.resident_models():
+        return
+    backend = router.choose(next_model)
+    loaded = {name: backend.model_sizes.get(name, 0) for name in backend.loaded_models}
+    if backend is current:
+        loaded.setdefault(model, current.model_sizes.get(model, 0))
+    if not residency.fits(next_model, loaded):
+        return
+    task = asyncio.create_task(_prewarm(backend, next_model))
+    _prewarm_tasks[next_model] = task
+    task.add_done_callback(lambda _: _prewarm_tasks.pop(next_model, None))
+
+async def _prewarm(backend: Backend, model: str) -> None:
+    try:
+        logger.info(f"Pre-warming model {model} on {backend.url}")
+        residency.prewarms += 1
+        payload = {"model": model, "keep_alive": residency.keep_alive(model)}
+        async with router.route(model, backend):
+            response = await get_client().post(f"{backend.url}/generate", json=payload, timeout=GENERATE_TIMEOUT)
+        if response.status_code == 200:
+            _record_loaded(backend, model, response.json())
+        else:
+            logger.warning(f"Failed to pre-warm model {model}: {response.text}")
+    except (httpx.RequestError, ValueError) as e:
+        logger.warning(f"Failed to pre-warm model {model}: {str(e)}")
+
+async def _health_loop() -> None:
+    while True:
+        await probe_backends()
+        # Keeps each backend's pulled models current for routing, at most once per OLLAMA_MODELS_CACHE_TTL
+        await get_available_models()
+        await asyncio.sleep(OLLAMA_HEALTH_INTERVAL)
+
+def _generation_request(
+    base_url: str,
+    model: str,
+    prompt: str,
+    temperature: float,
+    messages: Optional[List[Dict[str, str]]],
+    stream: bool,
+    keep_alive: Optional[str] = None,
+    seed: Optional[int] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Build the endpoint and body of a generation request
+    
+    Args:
+        base_url: The API URL of the backend
+        model: The model to use
+        prompt: The prompt to send to /api/generate
+        temperature: The temperature to use for generation
+        messages: Chat messages to send to /api/chat instead of the prompt, if set
+        stream: Whether to request a streamed response
+        keep_alive: How long Ollama should keep the model loaded afterwards
+        seed: The sampling seed, if pinned
+        
+    Returns:
+        A tuple of (endpoint URL, JSON body)
+    """
+    # Ollama only reads sampling parameters from options
+    options: Dict[str, Any] = {"temperature": temperature}
+    if seed is not None:
+        options["seed"] = seed
+    
+    if messages is not None:
+        request_data = OllamaChatRequest(
+            model=model, messages=messages, temperature=temperature, stream=stream, keep_alive=keep_alive, options=options
+        )
+        return f"{base_url}/chat", request_data.model_dump(exclude_none=True)
+    
+    request_data = OllamaRequest(
+        model=model, prompt=prompt, temperature=temperature, stream=stream, keep_alive=keep_alive, options=options
+    )
+    return f"{base_url}/generate", request_data.model_dump(exclude_none=True)
+
+def _record_failure(backend: Backend, failed: Set[Backend]) -> None:
+    # Count a request against a backend once, however many of its retries fail there, so one
+    # request cannot open a circuit alone; a half-open circuit's trial is always counted
+    if backend not in failed or backend.breaker.trial_in_flight:
+        failed.add(backend)
+        router.record_failure(backend)
+
+def _record_status(backend: Backend, status_code: int, failed: Set[Backend]) -> None:
+    # Server errors count against the backend; client errors such as an unknown model do not
+    if status_code >= 500:
+        _record_failure(backend, failed)
+    else:
+        router.record_success(backend)
+
+def _response_text(data: Dict[str, Any]) -> str:
+    # /api/generate returns "response", /api/chat returns "message.content"
+    if "message" in data:
+        return data["message"].get("content", "")
+    return data.get("response", "")
+
+def _transport_error(backend: Backend, error: httpx.RequestError, failed: Set[Backend]) -> GenerationError:
+    # Count a failed request against the backend and say whether sending it again is safe
+    _record_failure(backend, failed)
+    logger.error(f"Request error when calling Ollama API ({backend.url}): {str(error)}")
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)):
+        return BackendUnavailable(f"Could not connect to Ollama backend {backend.url}", retryable=True)
+    if isinstance(error, httpx.TimeoutException):
+        return BackendTimeout(f"Ollama backend {backend.url} did not answer in time")
+    # Generation has no side effects, so a request cut off mid-reply can be sent again
+    return BackendUnavailable(f"Connection to Ollama backend {backend.url} failed", retryable=True)
+
+def _status_error(backend: Backend, model: str, status_code: int, body: bytes) -> GenerationError:
+    # Ollama reports errors as {"error": ...}; _record_status has already judged the backend
+    try:
+        detail = json.loads(body).get("error")
+    except (ValueError, AttributeError):
+        detail = None
+    detail = detail or body.decode(errors="replace")[:200] or f"status {status_code}"
+    logger.error(f"Error from Ollama API ({backend.url}): {detail}")
+    if status_code == 404:
+        # Backends may have different models pulled, so the request is retried while another may have it
+        router.record_missing(backend, model)
+        elsewhere = any(candidate.may_have(model) for candidate in router.healthy_backends())
+        return ModelNotFound(f"Model {model} is not available: {detail}", retryable=elsewhere)
+    return BackendError(f"Ollama backend returned status {status_code}: {detail}", retryable=status_code >= 500)
+
+@asynccontextmanager
+async def _circuit(backend: Backend) -> AsyncIterator[None]:
+    # Hold one attempt to the backend's circuit. A request only lands on an ejected backend when
+    # every backend is ejected, or when another request took a half-open circuit's trial first
+    trial = backend.breaker.state == HALF_OPEN
+    if not backend.breaker.allow_request():
+        raise BackendUnavailable(
+            f"Ollama backend {backend.url} is failing, retry in {backend.breaker.retry_after()}s",
+            retryable=trial,
+            retry_after=backend.breaker.retry_after()
+        )
+    try:
+        yield
+    finally:
+        # A trial that ended without a result, such as a cancelled one, lets the next request try
+        if trial:
+            backend.breaker.end_trial()
+
+async def _attempt(
+    backend: Backend,
+    model: str,
+    prompt: str,
+    temperature: float,
+    messages: Optional[List[Dict[str, str]]],
+    seed: Optional[int],
+    failed: Set[Backend]
+) -> Dict[str, Any]:
+    """
+    Send one generation request to a backend
+    
+    Args:
+        backend: The backend, already reserved
         model: The model to use
         prompt: The prompt to send to the model
         temperature: The temperature to use for generation
+        messages: Chat messages to send to /api/chat instead of the prompt, if set
+        seed: The sampling seed, if pinned
+        failed: The backends earlier attempts of the same request failed on, updated in place
         
     Returns:
-        The generated response text
+        Ollama's reply
+        
+    Raises:
+        GenerationError: If the backend could not be reached or did not reply successfully
     """
+    url, body = _generation_request(
+        backend.url, model, prompt, temperature, messages, stream=False,
+        keep_alive=residency.keep_alive(model), seed=seed
+    )
+    async with _circuit(backend):
+        try:
+            sent = time.perf_counter()
+            async with get_client().stream("POST", url, json=body, timeout=GENERATE_TIMEOUT) as response:
+                metrics.TURN_PHASE_SECONDS.observe(time.perf_counter() - sent, phase="ollama_first_byte")
+                content = await response.aread()
+            elapsed = time.perf_counter() - sent
+        except httpx.RequestError as e:
+            raise _transport_error(backend, e, failed)
+        
+        _record_status(backend, response.status_code, failed)
+    if response.status_code != 200:
+        raise _status_error(backend, model, response.status_code, content)
     try:
-        logger.info(f"Generating response with model: {model}")
+        data = json.loads(content)
+    except ValueError:
+        raise BackendError(f"Invalid response from Ollama backend {backend.url}")
+    
+    metrics.TURN_PHASE_SECONDS.observe(elapsed, phase="generation")
+    latencies.record(model, elapsed)
+    _record_loaded(backend, model, data)
+    return data
+
+async def _hedge(
+    backend: Backend,
+    model: str,
+    prompt: str,
+    temperature: float,
+    messages: Optional[List[Dict[str, str]]],
+    seed: Optional[int],
+    failed: Set[Backend]
+) -> Dict[str, Any]:
+    # Run the second request of a hedged generation in the slot try_acquire reserved for it
+    try:
+        async with router.route(model, backend):
+            return await _attempt(backend, model, prompt, temperature, messages, seed, failed)
+    finally:
+        scheduler.release(backend, None)
+
+async def _generate_once(
+    model: str,
+    prompt: str,
+    temperature: float,
+    messages: Optional[List[Dict[str, str]]],
+    next_model: Optional[str],
+    seed: Optional[int],
+    priority: int,
+    on_admitted: Optional[Callable[[], None]],
+    failed: Set[Backend]
+) -> Dict[str, Any]:
+    """
+    Generate a reply in one scheduler slot, hedging it if it runs long
+    
+    With OLLAMA_HEDGE_PERCENTILE set, an interactive generation still running
+    after that percentile of the model's recent generation times is also sent
+    to another backend, if one has a slot no queued request is waiting for.
+    The first successful reply wins and the other request is cancelled.
+    
+    Returns:
+        Ollama's reply
         
-        request_data = OllamaRequest(
-            model=model,
-            prompt=prompt,
-            temperature=temperature,
-            stream=False
-        )
+    Raises:
+        GenerationError: If the generation was not admitted or failed
+    """
+    async with scheduler.slot(model, priority) as backend, router.route(model, backend):
+        if on_admitted is not None:
+            on_admitted()
+        _prewarm_next(backend, model, next_model)
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{OLLAMA_API_URL}/generate",
-                json=request_data.model_dump()
+        hedge_after = None
+        if resilience.OLLAMA_HEDGE_PERCENTILE > 0 and priority == INTERACTIVE and len(router.backends) > 1:
+            hedge_after = latencies.percentile(
+                model, resilience.OLLAMA_HEDGE_PERCENTILE, resilience.OLLAMA_HEDGE_MIN_SAMPLES
             )
+        if hedge_after is None:
+            return await _attempt(backend, model, prompt, temperature, messages, seed, failed)
+        
+        primary = asyncio.create_task(_attempt(backend, model, prompt, temperature, messages, seed, failed))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                hedge_backend = scheduler.try_acquire(model, exclude=backend)
+                if hedge_backend is not None:
+                    logger.info(f"Hedging generation with {model} to {hedge_backend.url} after {hedge_after:.2f}s")
+                    tasks.add(asyncio.create_task(_hedge(hedge_backend, model, prompt, temperature, messages, seed, failed)))
             
-            if response.status_code != 200:
-                logger.error(f"Error from Ollama API: {response.text}")
-                return f"Error: Failed to generate response. Status code: {response.status_code}"
-            
-            response_data = response.json()
-            return response_data.get("response", "")
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            metrics.OLLAMA_HEDGES.inc(model=model, winner="primary" if task is primary else "hedge")
+                        return task.result()
+            # Both requests failed; the primary's error is the one to report
+            return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+async def generate_response(
+    model: str,
+    prompt: str,
+    temperature: float = 0.7,
+    messages: Optional[List[Dict[str, str]]] = None,
+    next_model: Optional[str] = None,
+    seed: Optional[int] = None,
+    priority: int = INTERACTIVE,
+    on_admitted: Optional[Callable[[], None]] = None
+) -> str:
+    """
+    Generate a response from Ollama
     
-    except httpx.RequestError as e:
-        logger.error(f"Request error when calling Ollama API: {str(e)}")
-        return "Error: Failed to connect to Ollama API"
+    The generation waits for a slot from the scheduler first. With
+    RESPONSE_CACHE_ENABLED, deterministic requests (temperature 0 or a pinned
+    seed) are answered from the response cache when the same request was
+    generated before, without taking a slot. A failure that is safe to repeat,
+    such as a refused connection or a server error, is retried up to
+    OLLAMA_RETRY_ATTEMPTS times after a jittered backoff, each time in a new
+    slot. A 404 from a backend without the model is retried on another backend
+    that may have it. A backend's circuit counts the generation as one failure however
+    often it is retried there. While every backend's circuit is open the
+    generation fails at once.
     
-    except Exception as e:
-        logger.error(f"Unexpected error when generating response: {str(e)}")
-        return f"Error: {str(e)}"
+    Args:
+        model: The model to use
+        prompt: The prompt to send to the model
+        temperature: The temperature to use for generation
+        messages: Chat messages to send to /api/chat instead of the prompt, if set
+        next_model: The model expected to generate the next turn, which may be pre-warmed
+        seed: The sampling seed, if pinned
+        priority: The scheduler priority, INTERACTIVE or BACKGROUND
+        on_admitted: Called once the generation first holds a slot, before the request is sent
+        
+    Returns:
+        The generated response text
+        
+    Raises:
+        GenerationRejected: If the scheduler did not admit the generation
+        GenerationError: If no backend produced a reply, with the HTTP status to report
+    """
+    cache_key = None
+    if response_cache.RESPONSE_CACHE_ENABLED and response_cache.is_deterministic(temperature, seed):
+        _, body = _generation_request("", model, prompt, temperature, messages, stream=False, seed=seed)
+        cache_key = response_cache.request_key(body)
+        cached = await responses.get(cache_key)
+        if cached is not None:
+            logger.info(f"Serving cached response for model: {model}")
+            metrics.OLLAMA_GENERATIONS.inc(model=model, outcome="cached")
+            return cached
+    
+    logger.info(f"Generating response with model: {model}")
+    
+    attempt = 0
+    failed: Set[Backend] = set()
+    try:
+        while True:
+            router.check_available()
+            try:
+                response_data = await _generate_once(
+                    model, prompt, temperature, messages, next_model, seed, priority,
+                    on_admitted if attempt == 0 else None, failed
+                )
+                break
+            except GenerationError as e:
+                if not e.retryable or attempt >= resilience.OLLAMA_RETRY_ATTEMPTS:
+                    raise
+                delay = backoff_delay(attempt)
+                attempt += 1
+                logger.warning(f"Generation with {model} failed ({str(e)}), retry {attempt} in {delay:.2f}s")
+                metrics.OLLAMA_RETRIES.inc(model=model)
+                await asyncio.sleep(delay)
+    
+    except GenerationRejected:
+        metrics.OLLAMA_GENERATIONS.inc(model=model, outcome="rejected")
+        raise
+    
+    except GenerationError:
+        metrics.OLLAMA_GENERATIONS.inc(model=model, outcome="error")
+        raise
+    
+    metrics.OLLAMA_GENERATIONS.inc(model=model, outcome="success")
+    metrics.observe_ollama_stats(model, response_data)
+    text = _response_text(response_data)
+    if cache_key is not None:
+        await responses.put(cache_key, text)
+    return text
+
+async def _stream_attempt(
+    model: str,
+    prompt: str,
+    temperature: float,
+    messages: Optional[List[Dict[str, str]]],
+    next_model: Optional[str],
+    seed: Optional[int],
+    priority: int,
+    failed: Set[Backend]
+) -> AsyncIterator[Dict[str, Any]]:
+    # Stream one generation in one scheduler slot, raising a GenerationError on failure
+    async with scheduler.slot(model, priority) as backend, router.route(model, backend), _circuit(backend):
+        url, body = _generation_request(
+            backend.url, model, prompt, temperature, messages, stream=True,
+            keep_alive=residency.keep_alive(model), seed=seed
+        )
+        _prewarm_next(backend, model, next_model)
+        try:
+            sent = time.perf_counter()
+            async with get_client().stream("POST", url, json=body, timeout=GENERATE_TIMEOUT) as response:
+                _record_status(backend, response.status_code, failed)
+                if response.status_code != 200:
+                    raise _status_error(backend, model, response.status_code, await response.aread())
+                
+                first_chunk = True
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    if first_chunk:
+                        # The first token, rather than the headers, is what the user waits for
+                        metrics.TURN_PHASE_SECONDS.observe(time.perf_counter() - sent, phase="ollama_first_byte")
+                        first_chunk = False
+                    try:
+                        chunk = json.loads(line)
+                    except ValueError:
+                        raise BackendError(f"Invalid chunk in stream from Ollama backend {backend.url}")
+                    if "message" in chunk:
+                        chunk["response"] = _response_text(chunk)
+                    if chunk.get("done"):
+                        elapsed = time.perf_counter() - sent
+                        metrics.TURN_PHASE_SECONDS.observe(elapsed, phase="generation")
+                        metrics.OLLAMA_GENERATIONS.inc(model=model, outcome="success")
+                        metrics.observe_ollama_stats(model, chunk)
+                        latencies.record(model, elapsed)
+                        _record_loaded(backend, model, chunk)
+                    yield chunk
+        except httpx.RequestError as e:
+            raise _transport_error(backend, e, failed)
+
+async def stream_response(
+    model: str,
+    prompt: str,
+    temperature: float = 0.7,
+    messages: Optional[List[Dict[str, str]]] = None,
+    next_model: Optional[str] = None,
+    seed: Optional[int] = None,
+    priority: int = INTERACTIVE
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Stream a response from Ollama chunk by chunk
+    
+    Each yielded item is one parsed line of Ollama's NDJSON stream, with the text
+    under "response" for both /api/generate and /api/chat. The last chunk has
+    "done" set and carries the eval counts and timings. Failures are yielded as
+    a single {"error": ...} chunk, the same shape Ollama uses for in-stream errors,
+    with the "status_code" to report and, if known, "retry_after". A failure
+    that is safe to repeat is retried as in generate_response, but only before
+    the first chunk; streams are not hedged. Closing the generator early closes
+    the upstream connection, which makes Ollama stop generating.
+    
+    Args:
+        model: The model to use
+        prompt: The prompt to send to the model
+        temperature: The temperature to use for generation
+        messages: Chat messages to send to /api/chat instead of the prompt, if set
+        next_model: The model expected to generate the next turn, which may be pre-warmed
+        seed: The sampling seed, if pinned
+        priority: The scheduler priority, INTERACTIVE or BACKGROUND
+        
+    Yields:
+        Parsed NDJSON chunks from Ollama
+    """
+    logger.info(f"Streaming response with model: {model}")
+    
+    attempt = 0
+    streamed = False
+    failed: Set[Backend] = set()
+    try:
+        while True:
+            router.check_available()
+            try:
+                async for chunk in _stream_attempt(model, prompt, temperature, messages, next_model, seed, priority, failed):
+                    streamed = True
+                    yield chunk
+                return
+            except GenerationError as e:
+                if streamed or not e.retryable or attempt >= resilience.OLLAMA_RETRY_ATTEMPTS:
+                    raise
+                delay = backoff_delay(attempt)
+                attempt += 1
+                logger.warning(f"Stream with {model} failed ({str(e)}), retry {attempt} in {delay:.2f}s")
+                metrics.OLLAMA_RETRIES.inc(model=model)
+                await asyncio.sleep(delay)
+    
+    except GenerationError as e:
+        rejected = isinstance(e, GenerationRejected)
+        metrics.OLLAMA_GENERATIONS.inc(model=model, outcome="rejected" if rejected else "error")
+        chunk = {"error": str(e), "status_code": e.status_code}
+        if e.retry_after is not None:
+            chunk["retry_after"] = e.retry_after
+        yield chunk
 
 async def get_available_models() -> List[Dict[str, str]]:
     """
     Get a list of available models from Ollama
     
+    Results are cached for OLLAMA_MODELS_CACHE_TTL seconds, and concurrent
+    callers share one upstream request.
+    
     Returns:
         A list of model information dictionaries
     """
+    return await models_cache.get("tags", _fetch_available_models)
+
+async def _fetch_available_models() -> List[Dict[str, Any]]:
+    logger.info("Getting available models from Ollama")
+    
+    # Backends may have different models pulled, so list the union
+    results = await asyncio.gather(*(_get_models(backend, "tags") for backend in router.healthy_backends()))
+    models: Dict[str, Dict[str, Any]] = {}
+    for backend_models in results:
+        for model in backend_models:
+            models.setdefault(model.get("name"), model)
+    return list(models.values())
+
+async def _get_models(backend: Backend, endpoint: str) -> List[Dict[str, Any]]:
     try:
-        logger.info("Getting available models from Ollama")
+        client = get_client()
+        response = await client.get(f"{backend.url}/{endpoint}", timeout=METADATA_TIMEOUT)
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{OLLAMA_API_URL}/tags")
-            
-            if response.status_code == 200:
-                models = response.json().get("models", [])
-                return models
-            else:
-                logger.error(f"Failed to get models from Ollama: {response.text}")
-                return []
+        if response.status_code == 200:
+            models = response.json().get("models", [])
+            residency.record_sizes(models)
+            if endpoint == "tags":
+                router.record_pulled(backend, (model.get("name") or model.get("model") for model in models))
+            return models
+        else:
+            logger.error(f"Failed to get /{endpoint} from Ollama at {backend.url}: {response.text}")
+            return []
     except Exception as e:
-        logger.error(f"Error getting models from Ollama: {str(e)}")
+        logger.error(f"Error getting /{endpoint} from Ollama at {backend.url}: {str(e)}")
         return []
 
-async def get_running_models() -> List[Dict[str, Any]]:
+async def get_running_models(use_cache: bool = True) -> List[Dict[str, Any]]:
     """
-    Get a list of models currently loaded in memory
+    Get a list of models currently loaded in memory on any backend
     
+    Results are cached for OLLAMA_RUNNING_MODELS_CACHE_TTL seconds, and concurrent
+    callers share one upstream request. The cache is dropped whenever a model
+    is unloaded.
+    
+    Args:
+        use_cache: False to always ask the backends
+        
     Returns:
-        A list of running model information
+        A list of running model information, each with the "backend" it is loaded on
     """
-    try:
-        logger.info("Getting running models from Ollama")
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{OLLAMA_API_URL}/ps")
-            
-            if response.status_code == 200:
-                models = response.json().get("models", [])
-                return models
-            else:
-                logger.error(f"Failed to get running models from Ollama: {response.text}")
-                return []
-    except Exception as e:
-        logger.error(f"Error getting running models from Ollama: {str(e)}")
-        return []
+    if not use_cache:
+        return await _fetch_running_models()
+    return await running_models_cache.get("ps", _fetch_running_models)
 
-async def unload_model(model_name: str) -> bool:
+async def _fetch_running_models() -> List[Dict[str, Any]]:
+    logger.info("Getting running models from Ollama")
+    
+    backends = router.healthy_backends()
+    results = await asyncio.gather(*(_get_models(backend, "ps") for backend in backends))
+    running = []
+    for backend, backend_models in zip(backends, results):
+        for model in backend_models:
+            running.append({**model, "backend": backend.url})
+    return running
+
+async def unload_model(model_name: str, backend_url: Optional[str] = None) -> bool:
     """
     Unload a model from memory
     
     Args:
         model_name: The name of the model to unload
+        backend_url: The backend to unload it from, or None for every backend
         
     Returns:
         True if successful, False otherwise
     """
+    backends = [
+        backend for backend in router.healthy_backends()
+        if backend_url is None or backend.url == backend_url.rstrip("/")
+    ]
+    if not backends:
+        logger.error(f"Unknown Ollama backend {backend_url}")
+        return False
+    results = await asyncio.gather(*(_unload(backend, model_name) for backend in backends))
+    return all(results)
+
+async def _unload(backend: Backend, model_name: str) -> bool:
     try:
-        logger.info(f"Unloading model {model_name} from memory")
+        logger.info(f"Unloading model {model_name} from memory on {backend.url}")
         
         payload = {
             "model": model_name,
@@ -118,15 +809,56 @@ async def unload_model(model_name: str) -> bool:
             "keep_alive": 0
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{OLLAMA_API_URL}/generate", json=payload)
-            
-            if response.status_code == 200:
-                logger.info(f"Successfully unloaded model {model_name}")
-                return True
-            else:
-                logger.error(f"Failed to unload model {model_name}: {response.text}")
-                return False
+        client = get_client()
+        response = await client.post(f"{backend.url}/generate", json=payload, timeout=UNLOAD_TIMEOUT)
+        
+        if response.status_code == 200:
+            backend.loaded_models.discard(model_name)
+            running_models_cache.invalidate()
+            logger.info(f"Successfully unloaded model {model_name}")
+            return True
+        else:
+            logger.error(f"Failed to unload model {model_name}: {response.text}")
+            return False
     except Exception as e:
         logger.error(f"Error unloading model {model_name}: {str(e)}")
-        return False 
\ No newline at end of file
+        return False
+
+async def unload_all_models() -> Tuple[int, int]:
+    """
+    Unload every model loaded on any backend
+    
+    Unloads run concurrently, at most OLLAMA_UNLOAD_CONCURRENCY at a time, and
+    each one is given up after OLLAMA_UNLOAD_TIMEOUT seconds, so the whole call
+    takes about as long as the slowest unload rather than all of them together.
+    
+    Returns:
+        A tuple of (successful unloads, failed unloads)
+    """
+    running_models = [model for model in await get_running_models(use_cache=False) if model.get("model")]
+    semaphore = asyncio.Semaphore(OLLAMA_UNLOAD_CONCURRENCY)
+    
+    async def unload_one(model: Dict[str, Any]) -> bool:
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(
+                    unload_model(model["model"], model.get("backend")),
+                    timeout=OLLAMA_UNLOAD_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                logger.error(f"Timed out unloading model {model['model']} after {OLLAMA_UNLOAD_TIMEOUT}s")
+                return False
+    
+    results = await asyncio.gather(*(unload_one(model) for model in running_models))
+    successful_unloads = sum(1 for success in results if success)
+    failed_unloads = len(results) - successful_unloads
+    logger.info(f"Unloaded {successful_unloads} models, {failed_unloads} failed")
+    return successful_unloads, failed_unloads
+
+def unload_all_models_in_background() -> None:
+    """
+    Start unloading every model without waiting for it to finish
+    """
+    task = asyncio.create_task(unload_all_models())
+    _housekeeping_tasks.add(task)
+    task.add_done_callback(_housekeeping_tasks.discard)
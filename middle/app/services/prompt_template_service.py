@@ -1,5 +1,8 @@
 import logging
-from typing import Dict, List, Any, Optional
+import os
+from string import Formatter
+from typing import Dict, List, Any, Optional, Tuple
+from app.services import state_backend, summary_service
 
 logger = logging.getLogger(__name__)
 
@@ -15,27 +18,150 @@ Previous conversation:
 
 {recipient_name}:"""
 
-# Current prompt template
-current_template = DEFAULT_TEMPLATE
+# Variables a prompt template may use
+TEMPLATE_VARIABLES = (
+    "recipient_system_prompt",
+    "recipient_name",
+    "sender_name",
+    "message_text",
+    "conversation_history",
+    "conversation_summary"
+)
 
-# Store the latest payload
-latest_payload: Dict[str, Any] = {
+# Variables that change on every turn, which chat mode sends as messages of their own
+TURN_VARIABLES = ("conversation_history", "message_text")
+
+# Payloads of recent turns kept for /api/latest-payload, across all conversations
+RECENT_PAYLOADS_MAX_ENTRIES = int(os.getenv("RECENT_PAYLOADS_MAX_ENTRIES", "100"))
+
+# State backend key of the current prompt template and collection of recent payloads, shared by every worker
+TEMPLATE_KEY = "prompt_template"
+PAYLOADS_COLLECTION = "payloads"
+
+# Returned before any payload was built
+EMPTY_PAYLOAD: Dict[str, Any] = {
+    "message_id": None,
+    "conversation_id": None,
     "prompt": None,
     "model": None,
     "temperature": None,
     "timestamp": None
 }
 
-def get_template() -> str:
+class CompiledTemplate:
+    """
+    A prompt template parsed once into static text and variable slots
+    
+    Rendering fills the slots of the precomputed pieces and joins them, instead
+    of parsing the template with str.format on every turn. Variables the
+    template does not use are listed in variables, so callers can skip
+    computing them.
+    """
+    def __init__(self, template: str):
+        self.template = template
+        self.pieces: List[str] = []
+        self.slots: List[Tuple[int, str]] = []
+        
+        try:
+            parsed = list(Formatter().parse(template))
+        except ValueError as e:
+            raise ValueError(f"{str(e)}; write literal braces as {{{{ and }}}}")
+        for literal, name, format_spec, conversion in parsed:
+            if literal:
+                self.pieces.append(literal)
+            if name is None:
+                continue
+            if name not in TEMPLATE_VARIABLES:
+                raise ValueError(
+                    f"Unknown variable {{{name}}}; available variables are "
+                    + ", ".join(f"{{{variable}}}" for variable in TEMPLATE_VARIABLES)
+                )
+            if format_spec or conversion:
+                raise ValueError(f"Variable {{{name}}} may not have a format spec or conversion")
+            self.slots.append((len(self.pieces), name))
+            self.pieces.append("")
+        self.variables = frozenset(name for _, name in self.slots)
+        self._system: Optional["CompiledTemplate"] = None
+    
+    def render(self, values: Dict[str, str]) -> str:
+        """
+        Render the template
+        
+        Args:
+            values: The value of every variable in self.variables
+            
+        Returns:
+            The rendered prompt
+        """
+        pieces = list(self.pieces)
+        for index, name in self.slots:
+            pieces[index] = values[name]
+        return "".join(pieces)
+    
+    def system_template(self) -> "CompiledTemplate":
+        """
+        Get the part of the template chat mode sends as the system message
+        
+        That is the paragraphs before the first one that uses a variable in
+        TURN_VARIABLES, or the whole template if it uses none. A template that
+        starts with one of them falls back to the default template's.
+        
+        Returns:
+            The compiled system message template
+        """
+        if self._system is not None:
+            return self._system
+        
+        slot_names = dict(self.slots)
+        text = ""
+        for index, piece in enumerate(self.pieces):
+            name = slot_names.get(index)
+            if name in TURN_VARIABLES:
+                # Drop the start of the paragraph that introduces the history or the message
+                cut = text.rfind("\n\n")
+                text = text[:cut] if cut >= 0 else text
+                break
+            text += f"{{{name}}}" if name else piece.replace("{", "{{").replace("}", "}}")
+        text = text.strip()
+        
+        self._system = CompiledTemplate(text) if text else CompiledTemplate(DEFAULT_TEMPLATE).system_template()
+        return self._system
+
+# Compiled form of the template text last read from the state backend
+_compiled = CompiledTemplate(DEFAULT_TEMPLATE)
+
+async def get_template() -> str:
     """
     Get the current prompt template
     
     Returns:
         The current prompt template
     """
-    return current_template
+    return await state_backend.run(state_backend.get_backend().get, TEMPLATE_KEY) or DEFAULT_TEMPLATE
+
+async def get_compiled_template() -> CompiledTemplate:
+    """
+    Get the current prompt template in compiled form
+    
+    The template is only compiled again when its text changed, such as when
+    another worker updated it.
+    
+    Returns:
+        The compiled template
+    """
+    global _compiled
+    template = await get_template()
+    if template != _compiled.template:
+        try:
+            _compiled = CompiledTemplate(template)
+        except ValueError as e:
+            # Only reachable for a template stored before templates were validated
+            logger.error(f"Stored prompt template is invalid, using the default: {str(e)}")
+            _compiled = CompiledTemplate(DEFAULT_TEMPLATE)
+            _compiled.template = template
+    return _compiled
 
-def update_template(template: str) -> bool:
+async def update_template(template: str) -> bool:
     """
     Update the prompt template
     
@@ -44,10 +170,15 @@ def update_template(template: str) -> bool:
         
     Returns:
         True if the template was updated successfully
+        
+    Raises:
+        ValueError: If the template uses an unknown variable or has unbalanced braces
     """
-    global current_template
-    current_template = template
-    logger.info("Prompt template updated")
+    global _compiled
+    compiled = CompiledTemplate(template)
+    await state_backend.run(state_backend.get_backend().set, TEMPLATE_KEY, template)
+    _compiled = compiled
+    logger.info(f"Prompt template updated ({len(compiled.slots)} variable slots)")
     return True
 
 def format_conversation_history(context: List[Dict[str, Any]]) -> str:
@@ -69,65 +200,158 @@ def format_conversation_history(context: List[Dict[str, Any]]) -> str:
     
     return formatted_history.strip()
 
-def construct_prompt(
+def _summary_block(conversation_summary: str) -> str:
+    # The summary for a template that does not place {conversation_summary} itself;
+    # empty while summaries are off or nothing has been summarised yet
+    if not conversation_summary or conversation_summary == summary_service.NO_SUMMARY:
+        return ""
+    return f"Summary of the earlier conversation:\n{conversation_summary}"
+
+async def construct_prompt(
     sender_persona: Dict[str, Any],
     recipient_persona: Dict[str, Any],
     message_text: str,
-    conversation_context: List[Dict[str, Any]]
+    conversation_context: List[Dict[str, Any]],
+    conversation_summary: str = ""
 ) -> str:
     """
     Construct a prompt using the template
     
+    A template that does not use {conversation_summary} gets the summary, once
+    there is one, ahead of {conversation_history}, so the messages it covers
+    are not lost from the context.
+    
     Args:
         sender_persona: The sender's persona settings
         recipient_persona: The recipient's persona settings
         message_text: The message text
         conversation_context: The conversation context
+        conversation_summary: The rolling summary of messages older than the context
         
     Returns:
         The constructed prompt
     """
-    try:
-        # Extract values from persona dictionaries
-        sender_name = sender_persona.get('name', 'Unknown')
-        recipient_name = recipient_persona.get('name', 'Unknown')
-        recipient_system_prompt = recipient_persona.get('system_prompt', 'You are an AI assistant.')
+    template = await get_compiled_template()
+    values = {
+        "sender_name": sender_persona.get('name', 'Unknown'),
+        "recipient_name": recipient_persona.get('name', 'Unknown'),
+        "recipient_system_prompt": recipient_persona.get('system_prompt', 'You are an AI assistant.'),
+        "message_text": message_text,
+        "conversation_summary": conversation_summary
+    }
+    # Formatting the history is the costly part, so skip it when the template does not use it
+    if "conversation_history" in template.variables:
+        values["conversation_history"] = format_conversation_history(conversation_context)
+        summary_block = _summary_block(conversation_summary)
+        if summary_block and "conversation_summary" not in template.variables:
+            values["conversation_history"] = f"{summary_block}\n\n{values['conversation_history']}"
+    
+    return template.render(values)
+
+async def construct_chat_messages(
+    sender_persona: Dict[str, Any],
+    recipient_persona: Dict[str, Any],
+    recipient_id: str,
+    message_text: str,
+    conversation_context: List[Dict[str, Any]],
+    conversation_summary: str = ""
+) -> List[Dict[str, str]]:
+    """
+    Construct an ordered message list for Ollama's /api/chat endpoint
+    
+    The system message comes first and only depends on the persona pair (and the
+    summary), and history follows in order, so consecutive turns share a long
+    common prefix that the backend can keep in its KV cache. The system message
+    is rendered from the prompt template's system_template; if that does not
+    use {conversation_summary}, the summary is appended to it once there is one.
+    
+    Args:
+        sender_persona: The sender's persona settings
+        recipient_persona: The recipient's persona settings
+        recipient_id: The recipient's persona ID, used to tell its own past messages apart
+        message_text: The message text
+        conversation_context: The conversation context
+        conversation_summary: The rolling summary of messages older than the context
         
-        # Format conversation history
-        conversation_history = format_conversation_history(conversation_context)
+    Returns:
+        The chat messages, each with a role and content
+    """
+    template = (await get_compiled_template()).system_template()
+    system = template.render({
+        "sender_name": sender_persona.get('name', 'Unknown'),
+        "recipient_name": recipient_persona.get('name', 'Unknown'),
+        "recipient_system_prompt": recipient_persona.get('system_prompt', 'You are an AI assistant.'),
+        "conversation_summary": conversation_summary
+    })
+    summary_block = _summary_block(conversation_summary)
+    if summary_block and "conversation_summary" not in template.variables:
+        system += f"\n\n{summary_block}"
+    
+    messages = [{"role": "system", "content": system}]
+    for msg in conversation_context:
+        role = "assistant" if msg["sender"] == recipient_id else "user"
+        messages.append({"role": role, "content": msg["text"]})
+    messages.append({"role": "user", "content": message_text})
+    
+    return messages
+
+def render_chat_messages(messages: List[Dict[str, str]]) -> str:
+    """
+    Render chat messages as text, for display and token counting
+    
+    Args:
+        messages: The chat messages
         
-        # Apply the template with flattened variables
-        prompt = current_template.format(
-            sender_name=sender_name,
-            recipient_name=recipient_name,
-            recipient_system_prompt=recipient_system_prompt,
-            message_text=message_text,
-            conversation_history=conversation_history
-        )
-
-        # Store the latest payload
-        global latest_payload
-        latest_payload = {
+    Returns:
+        The messages as "role: content" blocks
+    """
+    return "\n\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+
+async def record_payload(
+    message_id: str,
+    conversation_id: str,
+    prompt: str,
+    recipient_persona: Dict[str, Any],
+    timestamp: str
+) -> None:
+    """
+    Keep the payload of a turn among the recent payloads
+    
+    Args:
+        message_id: The message the payload answers
+        conversation_id: The conversation the message belongs to
+        prompt: The prompt, or the chat messages rendered as text
+        recipient_persona: The persona settings of the model's persona
+        timestamp: When the prompt was built
+    """
+    await state_backend.run(
+        state_backend.get_backend().add_recent,
+        PAYLOADS_COLLECTION,
+        message_id,
+        {
+            "message_id": message_id,
+            "conversation_id": conversation_id,
             "prompt": prompt,
             "model": recipient_persona.get('model'),
             "temperature": recipient_persona.get('temperature'),
-            "timestamp": None  # Will be set when used in message.py
-        }
-        
-        return prompt
-    except KeyError as e:
-        logger.error(f"Error formatting prompt template: {str(e)}")
-        # Fall back to a simple prompt if template formatting fails
-        return f"You are {recipient_persona.get('name', 'an AI')}. Respond to: {message_text}"
-    except Exception as e:
-        logger.error(f"Unexpected error formatting prompt: {str(e)}")
-        return f"You are {recipient_persona.get('name', 'an AI')}. Respond to: {message_text}"
+            "timestamp": timestamp
+        },
+        RECENT_PAYLOADS_MAX_ENTRIES
+    )
 
-def get_latest_payload() -> Dict[str, Any]:
+async def get_payload(message_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
     """
-    Get the latest payload sent to the model
+    Get a recent payload sent to the model, by any worker
     
+    Args:
+        message_id: The message the payload answers, or None for the latest payload
+        
     Returns:
-        A dictionary containing the latest prompt, model, temperature, and timestamp
+        A dictionary containing the prompt, model, temperature, and timestamp. For
+        the latest payload, an empty one if none was built yet; for a message,
+        None if its payload is no longer among the recent ones.
     """
-    return latest_payload 
\ No newline at end of file
+    payload = await state_backend.run(state_backend.get_backend().get_recent, PAYLOADS_COLLECTION, message_id)
+    if payload is None and message_id is None:
+        return EMPTY_PAYLOAD
+    return payload
\ No newline at end of file
@@ -0,0 +1,211 @@
+import math
+import os
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+# Retries of a generation after a failure that is safe to repeat, such as a refused connection or a 5xx
+OLLAMA_RETRY_ATTEMPTS = int(os.getenv("OLLAMA_RETRY_ATTEMPTS", "2"))
+
+# Backoff before retry n is drawn uniformly from 0 to min(max, base * 2**n) seconds
+OLLAMA_RETRY_BASE_DELAY = float(os.getenv("OLLAMA_RETRY_BASE_DELAY", "0.2"))
+OLLAMA_RETRY_MAX_DELAY = float(os.getenv("OLLAMA_RETRY_MAX_DELAY", "2"))
+
+# Seconds an open circuit fails requests fast before letting traffic through to try the backend again
+OLLAMA_CIRCUIT_RESET_SECONDS = float(os.getenv("OLLAMA_CIRCUIT_RESET_SECONDS", "15"))
+
+# Latency percentile of a model's recent generations after which an interactive generation
+# is also sent to a second backend, the first reply winning; 0 disables hedging
+OLLAMA_HEDGE_PERCENTILE = float(os.getenv("OLLAMA_HEDGE_PERCENTILE", "0"))
+
+# Generations per model the percentile is taken over, and how many must be seen before hedging starts
+OLLAMA_HEDGE_WINDOW = int(os.getenv("OLLAMA_HEDGE_WINDOW", "200"))
+OLLAMA_HEDGE_MIN_SAMPLES = int(os.getenv("OLLAMA_HEDGE_MIN_SAMPLES", "20"))
+
+# Circuit states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class GenerationError(RuntimeError):
+    """
+    Raised when a generation produced no reply, with the HTTP status to report
+    
+    retryable is set when sending the same request again may succeed, and
+    retry_after, if known, is when a client should try again.
+    """
+    status_code = 502
+    
+    def __init__(self, detail: str, retryable: bool = False, retry_after: Optional[int] = None):
+        super().__init__(detail)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+class BackendUnavailable(GenerationError):
+    """
+    Raised when no backend could be reached, or every circuit is open
+    """
+    status_code = 503
+
+class BackendTimeout(GenerationError):
+    """
+    Raised when a backend did not answer within the generation timeout
+    """
+    status_code = 504
+
+class BackendError(GenerationError):
+    """
+    Raised when a backend answered with an error or a reply that could not be read
+    """
+    status_code = 502
+
+class ModelNotFound(GenerationError):
+    """
+    Raised when a backend does not have the requested model
+    """
+    status_code = 422
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Get the delay before a retry, with full jitter so failed requests do not retry in lockstep
+    
+    Args:
+        attempt: The number of retries already made
+        
+    Returns:
+        The delay in seconds
+    """
+    return random.uniform(0, min(OLLAMA_RETRY_MAX_DELAY, OLLAMA_RETRY_BASE_DELAY * 2 ** attempt))
+
+class CircuitBreaker:
+    """
+    Tracks one backend's failures and fails requests fast while it keeps failing
+    
+    The circuit opens after failure_threshold failures in a row. While open,
+    the backend is taken out of rotation. After reset_seconds it is half open:
+    exactly one trial request goes through, and its result decides whether the
+    circuit closes or opens for another reset_seconds. Any success closes it.
+    """
+    def __init__(self, failure_threshold: int, reset_seconds: Optional[float] = None):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = OLLAMA_CIRCUIT_RESET_SECONDS if reset_seconds is None else reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.opens = 0
+    
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return HALF_OPEN
+        return OPEN
+    
+    @property
+    def available(self) -> bool:
+        # Closed, or half open with the trial request not yet taken
+        state = self.state
+        return state == CLOSED or (state == HALF_OPEN and not self.trial_in_flight)
+    
+    def allow_request(self) -> bool:
+        """
+        Decide whether a request may be sent, taking the trial request of a half-open circuit
+        
+        Returns:
+            True if the request may be sent
+        """
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+    
+    def end_trial(self) -> None:
+        """
+        Give back a trial request that ended without a result, such as one that was cancelled
+        """
+        self.trial_in_flight = False
+    
+    def record_success(self) -> bool:
+        """
+        Record a successful request or probe
+        
+        Returns:
+            True if this closed the circuit
+        """
+        self.consecutive_failures = 0
+        self.trial_in_flight = False
+        closed = self.opened_at is not None
+        self.opened_at = None
+        return closed
+    
+    def record_failure(self) -> bool:
+        """
+        Record a failed request or probe
+        
+        Returns:
+            True if this opened the circuit
+        """
+        self.consecutive_failures += 1
+        self.trial_in_flight = False
+        state = self.state
+        if state == HALF_OPEN or (state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            self.opens += 1
+            return True
+        return False
+    
+    def retry_after(self) -> int:
+        """
+        Get the whole seconds until an open circuit lets traffic through again
+        
+        Returns:
+            The seconds, at least 1
+        """
+        if self.opened_at is None:
+            return 1
+        return max(1, math.ceil(self.opened_at + self.reset_seconds - time.monotonic()))
+
+class LatencyWindow:
+    """
+    The durations of each model's most recent successful generations
+    """
+    def __init__(self, size: Optional[int] = None):
+        self.size = OLLAMA_HEDGE_WINDOW if size is None else size
+        self.samples: Dict[str, Deque[float]] = {}
+    
+    def record(self, model: str, seconds: float) -> None:
+        """
+        Record the duration of a successful generation
+        
+        Args:
+            model: The model
+            seconds: The duration in seconds
+        """
+        samples = self.samples.get(model)
+        if samples is None:
+            samples = self.samples[model] = deque(maxlen=self.size)
+        samples.append(seconds)
+    
+    def percentile(self, model: str, percentile: float, min_samples: int) -> Optional[float]:
+        """
+        Get a percentile of a model's recent generation durations
+        
+        Args:
+            model: The model
+            percentile: The percentile, from 0 to 100
+            min_samples: The fewest samples a percentile is taken over
+            
+        Returns:
+            The duration in seconds, or None if too few generations were seen
+        """
+        samples = self.samples.get(model)
+        if samples is None or len(samples) < max(1, min_samples):
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, math.ceil(percentile / 100 * len(ordered)) - 1)
+        return ordered[max(0, index)]
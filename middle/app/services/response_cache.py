@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Opt-in cache of deterministic generations, keyed on a hash of the full request
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "False").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+# Directory of the on-disk tier; empty keeps the cache in memory only
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", "")
+
+# Request fields that do not change the generated text
+_KEY_EXCLUDED_FIELDS = ("stream", "keep_alive")
+
+def is_deterministic(temperature: float, seed: Optional[int]) -> bool:
+    """
+    Check whether a generation always produces the same text for the same request
+    
+    Args:
+        temperature: The sampling temperature
+        seed: The sampling seed, if pinned
+        
+    Returns:
+        True if the temperature is 0 or the seed is pinned
+    """
+    return temperature == 0 or seed is not None
+
+def request_key(body: Dict[str, Any]) -> str:
+    """
+    Hash an Ollama request body into a cache key
+    
+    Args:
+        body: The JSON body sent to /api/generate or /api/chat
+        
+    Returns:
+        The hex SHA-256 of the body's content-affecting fields
+    """
+    content = {field: value for field, value in body.items() if field not in _KEY_EXCLUDED_FIELDS}
+    encoded = json.dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    Content-addressed cache of generated texts
+    
+    The memory tier is an LRU of max_entries texts. When a directory is given,
+    every text is also written to <directory>/<key[:2]>/<key>.json, and memory
+    misses are looked up there, so a fixed conversation suite replays at disk
+    speed across restarts. Disk reads and writes run in a worker thread.
+    """
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, directory: str = RESPONSE_CACHE_DIR):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries: "OrderedDict[str, str]" = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+    
+    async def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached text
+        
+        Args:
+            key: The request key
+            
+        Returns:
+            The cached text, or None on a miss
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.memory_hits += 1
+            return self.entries[key]
+        
+        if self.directory:
+            text = await asyncio.to_thread(self._read, key)
+            if text is not None:
+                self.disk_hits += 1
+                self._remember(key, text)
+                return text
+        
+        self.misses += 1
+        return None
+    
+    async def put(self, key: str, text: str) -> None:
+        """
+        Store a generated text
+        
+        Args:
+            key: The request key
+            text: The generated text
+        """
+        self.stores += 1
+        self._remember(key, text)
+        if self.directory:
+            await asyncio.to_thread(self._write, key, text)
+    
+    def _remember(self, key: str, text: str) -> None:
+        self.entries[key] = text
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+    
+    def _read(self, key: str) -> Optional[str]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as cache_file:
+                return json.load(cache_file)["response"]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable response cache entry {key}: {str(e)}")
+            return None
+    
+    def _write(self, key: str, text: str) -> None:
+        path = self._path(key)
+        # Unique per write, so concurrent writes of the same key never share a temporary file
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, "w", encoding="utf-8") as cache_file:
+                json.dump({"response": text}, cache_file, ensure_ascii=False)
+            # Readers never see a partly written entry
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write response cache entry {key}: {str(e)}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get hit and miss counts
+        
+        Returns:
+            A dictionary of cache statistics
+        """
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "enabled": RESPONSE_CACHE_ENABLED,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            "entries": len(self.entries)
+        }
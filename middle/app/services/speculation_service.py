@@ -0,0 +1,239 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+from app.models.schemas import Message, PersonaSettings
+from app.services import ollama_service, turn_service
+from app.services.generation_scheduler import BACKGROUND
+from app.services.resilience import GenerationError
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: while the operator reviews a reply, generate the answer to it in case it is sent unedited
+SPECULATION_ENABLED = os.getenv("SPECULATION_ENABLED", "False").lower() == "true"
+
+# Speculative generations kept at once across conversations; the oldest is discarded beyond this
+SPECULATION_MAX_PENDING = int(os.getenv("SPECULATION_MAX_PENDING", "32"))
+
+# How a speculation ended: served, request changed (an edit), still queued when needed,
+# generation failed, or dropped unclaimed (replaced, over the limit or at shutdown)
+OUTCOMES = ("hit", "miss", "late", "failed", "discarded")
+
+class Speculation:
+    """
+    An answer generated ahead of time to a reply the operator has not sent yet
+    
+    key identifies the generation request; a turn is only served from the
+    speculation when it would send exactly the same request.
+    """
+    def __init__(self, key: Tuple[Any, ...]):
+        self.key = key
+        self.task: Optional[asyncio.Task] = None
+        self.admitted_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+    
+    def mark_admitted(self) -> None:
+        """
+        Record that the generation got a slot and started using a backend
+        """
+        self.admitted_at = time.perf_counter()
+    
+    def gpu_seconds(self, until: float) -> float:
+        """
+        Get the time the generation held a slot, up to a point in time
+        
+        Args:
+            until: The point in time, from time.perf_counter()
+            
+        Returns:
+            The time in seconds, 0 if the generation never got a slot
+        """
+        if self.admitted_at is None:
+            return 0.0
+        end = until if self.finished_at is None else min(self.finished_at, until)
+        return max(0.0, end - self.admitted_at)
+
+# Speculations by conversation ID, oldest first; at most one per conversation
+pending: "OrderedDict[str, Speculation]" = OrderedDict()
+
+_outcomes: Dict[str, int] = {outcome: 0 for outcome in OUTCOMES}
+_started = 0
+_wasted_seconds = 0.0
+_saved_seconds = 0.0
+
+def _request_key(
+    model: str,
+    prompt: str,
+    messages: Optional[List[Dict[str, str]]],
+    temperature: float,
+    seed: Optional[int]
+) -> Tuple[Any, ...]:
+    return (model, prompt, json.dumps(messages) if messages is not None else None, temperature, seed)
+
+def _resolve(speculation: Speculation, outcome: str, now: float) -> None:
+    # Stop a speculation that will not be served and count the time it held a slot as wasted
+    global _wasted_seconds
+    task = speculation.task
+    if task.done() and not task.cancelled() and (task.exception() is not None or task.result() is None):
+        outcome = "failed"
+    task.cancel()
+    _outcomes[outcome] += 1
+    _wasted_seconds += speculation.gpu_seconds(now)
+
+async def _run(
+    speculation: Speculation,
+    model: str,
+    prompt: str,
+    messages: Optional[List[Dict[str, str]]],
+    temperature: float,
+    seed: Optional[int],
+    next_model: Optional[str]
+) -> Optional[str]:
+    # Generate at background priority, so operators' own turns are admitted first
+    try:
+        text = await ollama_service.generate_response(
+            model=model,
+            prompt=prompt,
+            temperature=temperature,
+            messages=messages,
+            next_model=next_model,
+            seed=seed,
+            priority=BACKGROUND,
+            on_admitted=speculation.mark_admitted
+        )
+    except GenerationError:
+        return None
+    finally:
+        speculation.finished_at = time.perf_counter()
+    return text
+
+async def speculate(
+    persona_settings: Dict[str, PersonaSettings],
+    reply: Message,
+    conversation_id: str
+) -> None:
+    """
+    Start generating the answer to a generated reply, in case the operator sends it unedited
+    
+    The prompt is built from history as it is now, which is what the turn will
+    see once the reply is recorded. Does nothing unless SPECULATION_ENABLED is
+    set. A previous speculation for the conversation is discarded.
+    
+    Args:
+        persona_settings: The persona settings of the turn that generated the reply
+        reply: The reply as the next message, from the persona that generated it
+        conversation_id: The conversation
+    """
+    global _started
+    if not SPECULATION_ENABLED:
+        return
+    
+    try:
+        prompt, messages, _ = await turn_service.build_prompt(persona_settings, reply, conversation_id)
+    except Exception as e:
+        logger.warning(f"Could not build speculative prompt for conversation {conversation_id}: {str(e)}")
+        return
+    recipient = persona_settings[reply.recipients]
+    
+    now = time.perf_counter()
+    previous = pending.pop(conversation_id, None)
+    if previous is not None:
+        _resolve(previous, "discarded", now)
+    
+    speculation = Speculation(_request_key(recipient.model, prompt, messages, recipient.temperature, recipient.seed))
+    speculation.task = asyncio.create_task(_run(
+        speculation,
+        recipient.model,
+        prompt,
+        messages,
+        recipient.temperature,
+        recipient.seed,
+        persona_settings[reply.sender].model
+    ))
+    pending[conversation_id] = speculation
+    _started += 1
+    
+    while len(pending) > SPECULATION_MAX_PENDING:
+        _, oldest = pending.popitem(last=False)
+        _resolve(oldest, "discarded", now)
+
+async def claim(
+    conversation_id: str,
+    turn: turn_service.PreparedTurn,
+    temperature: float,
+    seed: Optional[int]
+) -> Optional[str]:
+    """
+    Take the speculative answer for a turn, if it was generated for exactly the same request
+    
+    The conversation's speculation is used up either way. One whose request
+    differs, because the operator edited the reply or the context changed, is
+    cancelled. One still generating is awaited, and one still waiting for a
+    slot is cancelled, since the turn's own generation is admitted ahead of it.
+    
+    Args:
+        conversation_id: The conversation
+        turn: The prepared turn
+        temperature: The temperature the turn generates with
+        seed: The seed the turn generates with, if pinned
+        
+    Returns:
+        The answer, or None if the turn must be generated
+    """
+    global _saved_seconds
+    speculation = pending.pop(conversation_id, None)
+    if speculation is None:
+        return None
+    
+    now = time.perf_counter()
+    key = _request_key(turn.recipient_persona["model"], turn.prompt, turn.messages, temperature, seed)
+    if key != speculation.key:
+        _resolve(speculation, "miss", now)
+        return None
+    if not speculation.task.done() and speculation.admitted_at is None:
+        _resolve(speculation, "late", now)
+        return None
+    
+    text = await speculation.task
+    if text is None:
+        _resolve(speculation, "failed", now)
+        return None
+    
+    _outcomes["hit"] += 1
+    # Generation time that overlapped the operator's review
+    _saved_seconds += speculation.gpu_seconds(now)
+    logger.info(f"Serving speculative reply for message {turn.message_id}")
+    return text
+
+async def shutdown() -> None:
+    """
+    Cancel pending speculations, used when the application stops
+    """
+    now = time.perf_counter()
+    speculations = list(pending.values())
+    pending.clear()
+    for speculation in speculations:
+        _resolve(speculation, "discarded", now)
+    if speculations:
+        await asyncio.gather(*(speculation.task for speculation in speculations), return_exceptions=True)
+
+def stats() -> Dict[str, Any]:
+    """
+    Get speculation outcomes, the hit rate and the generation time wasted and saved
+    
+    Returns:
+        A dictionary of speculation statistics
+    """
+    resolved = sum(_outcomes.values())
+    return {
+        "enabled": SPECULATION_ENABLED,
+        "pending": len(pending),
+        "started": _started,
+        "outcomes": dict(_outcomes),
+        "hit_rate": round(_outcomes["hit"] / resolved, 3) if resolved else 0.0,
+        "wasted_seconds": round(_wasted_seconds, 3),
+        "saved_seconds": round(_saved_seconds, 3)
+    }
@@ -0,0 +1,344 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Callable, Deque, Dict, Iterable, List, Any, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# Where state every worker must agree on is kept: "memory" in this process, or
+# "sqlite" in a database file shared by every worker on the host
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+
+# Location of the SQLite database
+STATE_SQLITE_PATH = os.getenv("STATE_SQLITE_PATH", "data/state.db")
+
+# Seconds a SQLite call waits for another worker's write lock before failing with "database is locked"
+STATE_SQLITE_BUSY_TIMEOUT = float(os.getenv("STATE_SQLITE_BUSY_TIMEOUT", "2"))
+
+# Seconds between checks for history changes made by other workers, so history feeds see them
+STATE_SYNC_INTERVAL = float(os.getenv("STATE_SYNC_INTERVAL", "0.5"))
+
+T = TypeVar("T")
+
+class StateBackend(ABC):
+    """
+    Storage for state shared by every worker: named values, bounded collections and the history change log
+    
+    Named values hold small JSON-serializable state such as the prompt template.
+    Bounded collections keep the most recent values added under a name, each
+    with its own key, such as the payloads of the last turns by message ID.
+    The history change log holds records in the format of the JSONL history log,
+    {"op": "append", "conversation_id", "entry"} and {"op": "reset",
+    "conversation_id", "count"}, each numbered with a sequence number that
+    increases across all workers. Every worker replays the log into its own
+    in-memory indexes, so all of them serve the same history.
+    """
+    # Whether other processes see the same state
+    shared = False
+    
+    def __init__(self):
+        # Identifies the log's sequence numbers, so versions built from them are only compared with their own
+        self.instance_id = uuid.uuid4().hex[:8]
+    
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a named value
+        
+        Args:
+            key: The name
+            
+        Returns:
+            The value, or None if it was never set
+        """
+    
+    @abstractmethod
+    def set(self, key: str, value: Any) -> None:
+        """
+        Set a named value
+        
+        Args:
+            key: The name
+            value: The value, which must be JSON-serializable
+        """
+    
+    @abstractmethod
+    def add_recent(self, collection: str, key: str, value: Any, capacity: int) -> None:
+        """
+        Add a value to a bounded collection, dropping the oldest values beyond its capacity
+        
+        Args:
+            collection: The collection's name
+            key: The value's key; a value already stored under it is replaced and becomes the newest
+            value: The value, which must be JSON-serializable
+            capacity: The number of values the collection keeps
+        """
+    
+    @abstractmethod
+    def get_recent(self, collection: str, key: Optional[str] = None) -> Optional[Any]:
+        """
+        Get a value from a bounded collection
+        
+        Args:
+            collection: The collection's name
+            key: The value's key, or None for the newest value
+            
+        Returns:
+            The value, or None if it is not in the collection
+        """
+    
+    @abstractmethod
+    def append_history(self, records: Iterable[Dict[str, Any]]) -> None:
+        """
+        Append history change records to the log, atomically
+        
+        May be called from a worker thread, as imports do.
+        
+        Args:
+            records: The records, in order
+        """
+    
+    @abstractmethod
+    def history_since(self, seq: int, limit: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        Read history change records that follow a sequence number
+        
+        Records that an import made obsolete may have been dropped from the log;
+        the import's reset record is always kept.
+        
+        Args:
+            seq: The sequence number of the last record already applied
+            limit: The maximum number of records to return
+            
+        Returns:
+            (seq, record) pairs in log order
+        """
+
+class MemoryStateBackend(StateBackend):
+    """
+    State kept in this process, for a single worker
+    
+    The history log only holds records until they have been read, since this
+    process is its only reader. It may be written from a worker thread: the
+    records are read before the lock is taken, so a large import holds it only
+    for one bulk append.
+    """
+    def __init__(self):
+        super().__init__()
+        self.values: Dict[str, Any] = {}
+        self.recent: Dict[str, "OrderedDict[str, Any]"] = {}
+        self.pending: Deque[Tuple[int, Dict[str, Any]]] = deque()
+        self.seq = 0
+        self.lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Any]:
+        return self.values.get(key)
+    
+    def set(self, key: str, value: Any) -> None:
+        self.values[key] = value
+    
+    def add_recent(self, collection: str, key: str, value: Any, capacity: int) -> None:
+        values = self.recent.setdefault(collection, OrderedDict())
+        values.pop(key, None)
+        values[key] = value
+        while len(values) > capacity:
+            values.popitem(last=False)
+    
+    def get_recent(self, collection: str, key: Optional[str] = None) -> Optional[Any]:
+        values = self.recent.get(collection)
+        if not values:
+            return None
+        if key is None:
+            return next(reversed(values.values()))
+        return values.get(key)
+    
+    def append_history(self, records: Iterable[Dict[str, Any]]) -> None:
+        records = list(records)
+        with self.lock:
+            first = self.seq + 1
+            self.seq += len(records)
+            self.pending.extend(zip(range(first, self.seq + 1), records))
+    
+    def history_since(self, seq: int, limit: int) -> List[Tuple[int, Dict[str, Any]]]:
+        with self.lock:
+            while self.pending and self.pending[0][0] <= seq:
+                self.pending.popleft()
+            return list(islice(self.pending, limit))
+
+class SQLiteStateBackend(StateBackend):
+    """
+    State kept in a SQLite database in WAL mode, shared by every worker on the host
+    
+    WAL lets readers continue while one worker writes, and synchronous=NORMAL
+    makes a commit an append to the WAL file without an fsync, so a write costs
+    tens of microseconds. A power loss may lose the last commits but never
+    corrupts the database. The file must be on a local disk; SQLite locking is
+    not reliable over network filesystems.
+    
+    An import deletes the conversation's earlier records in the same
+    transaction, so the log does not grow with replaced history.
+    
+    Reads and writes use separate connections. A write can wait up to
+    STATE_SQLITE_BUSY_TIMEOUT for another worker's lock, so callers on the
+    event loop run writes through run(); reads never wait for a writer in WAL
+    mode, and with their own connection they do not queue behind this
+    worker's writes either.
+    """
+    shared = True
+    
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        # Autocommit mode, with explicit transactions for multi-statement writes
+        self.connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False, timeout=STATE_SQLITE_BUSY_TIMEOUT
+        )
+        self.lock = threading.Lock()
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS history_log ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, conversation_id TEXT NOT NULL, record TEXT NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS history_log_conversation ON history_log (conversation_id, seq)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS recent ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, collection TEXT NOT NULL, key TEXT NOT NULL, "
+                "value TEXT NOT NULL, UNIQUE (collection, key))"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS recent_order ON recent (collection, seq)")
+            # The first worker to open the database names it; the others read the name
+            self.connection.execute(
+                "INSERT OR IGNORE INTO state (key, value) VALUES ('instance_id', ?)",
+                (json.dumps(uuid.uuid4().hex[:8]),)
+            )
+        self.reader = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False, timeout=STATE_SQLITE_BUSY_TIMEOUT
+        )
+        self.read_lock = threading.Lock()
+        self.instance_id = self.get("instance_id")
+        logger.info(f"Opened shared state database {path}")
+    
+    def get(self, key: str) -> Optional[Any]:
+        with self.read_lock:
+            row = self.reader.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def set(self, key: str, value: Any) -> None:
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                (key, json.dumps(value, ensure_ascii=False))
+            )
+    
+    def add_recent(self, collection: str, key: str, value: Any, capacity: int) -> None:
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Replacing deletes the old row, so the value takes a new, newest seq
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO recent (collection, key, value) VALUES (?, ?, ?)",
+                    (collection, key, json.dumps(value, ensure_ascii=False))
+                )
+                self.connection.execute(
+                    "DELETE FROM recent WHERE collection = ? AND seq NOT IN "
+                    "(SELECT seq FROM recent WHERE collection = ? ORDER BY seq DESC LIMIT ?)",
+                    (collection, collection, capacity)
+                )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+    
+    def get_recent(self, collection: str, key: Optional[str] = None) -> Optional[Any]:
+        with self.read_lock:
+            if key is None:
+                row = self.reader.execute(
+                    "SELECT value FROM recent WHERE collection = ? ORDER BY seq DESC LIMIT 1",
+                    (collection,)
+                ).fetchone()
+            else:
+                row = self.reader.execute(
+                    "SELECT value FROM recent WHERE collection = ? AND key = ?",
+                    (collection, key)
+                ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def append_history(self, records: Iterable[Dict[str, Any]]) -> None:
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                for record in records:
+                    if record["op"] == "reset":
+                        self.connection.execute(
+                            "DELETE FROM history_log WHERE conversation_id = ?",
+                            (record["conversation_id"],)
+                        )
+                    self.connection.execute(
+                        "INSERT INTO history_log (conversation_id, record) VALUES (?, ?)",
+                        (record["conversation_id"], json.dumps(record, ensure_ascii=False))
+                    )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+    
+    def history_since(self, seq: int, limit: int) -> List[Tuple[int, Dict[str, Any]]]:
+        with self.read_lock:
+            rows = self.reader.execute(
+                "SELECT seq, record FROM history_log WHERE seq > ? ORDER BY seq LIMIT ?",
+                (seq, limit)
+            ).fetchall()
+        decode = json.JSONDecoder().decode
+        return [(row_seq, decode(record)) for row_seq, record in rows]
+
+# Created on first use, so importing the app does not open the database; lives as long as the process
+_backend: Optional[StateBackend] = None
+
+def get_backend() -> StateBackend:
+    """
+    Get the state backend selected by STATE_BACKEND
+    
+    Returns:
+        The backend
+    """
+    global _backend
+    if _backend is None:
+        if STATE_BACKEND == "sqlite":
+            _backend = SQLiteStateBackend(STATE_SQLITE_PATH)
+        else:
+            if STATE_BACKEND != "memory":
+                logger.warning(f"Unknown STATE_BACKEND {STATE_BACKEND}, keeping state in memory")
+            _backend = MemoryStateBackend()
+    return _backend
+
+async def run(call: Callable[..., T], *args: Any) -> T:
+    """
+    Call a state backend method from the event loop without blocking it
+    
+    A shared backend waits on the disk and on other workers' locks, so its
+    calls run in a worker thread; the in-memory backend's run in place.
+    
+    Args:
+        call: The backend method
+        *args: The method's arguments
+        
+    Returns:
+        The method's result
+    """
+    if get_backend().shared:
+        return await asyncio.to_thread(call, *args)
+    return call(*args)
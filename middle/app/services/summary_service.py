@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Any, Optional
+from app.services import history_service, ollama_service
+from app.services.generation_scheduler import BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+# Rolling summary settings
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "False").lower() == "true"
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "dolphin-phi")
+SUMMARY_TEMPERATURE = float(os.getenv("SUMMARY_TEMPERATURE", "0.2"))
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "20"))
+SUMMARY_MAX_BATCH_SIZE = int(os.getenv("SUMMARY_MAX_BATCH_SIZE", "100"))
+
+# Placeholder rendered before anything has been summarised
+NO_SUMMARY = "No earlier conversation."
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+
+Rewrite the summary so that it also covers the new messages. Keep names, decisions, open questions and facts that later replies may depend on. Reply with the summary only."""
+
+class ConversationSummary:
+    """
+    The rolling summary of one conversation
+    
+    covered is the number of messages, counted from the start of the
+    conversation, that have been folded into text.
+    """
+    def __init__(self, reset_revision: int):
+        self.text = ""
+        self.covered = 0
+        self.reset_revision = reset_revision
+        self.task: Optional[asyncio.Task] = None
+
+# Summaries by conversation ID
+summaries: Dict[str, ConversationSummary] = {}
+
+async def _current(conversation_id: str) -> ConversationSummary:
+    reset_revision = await history_service.get_reset_revision(conversation_id)
+    summary = summaries.get(conversation_id)
+    # A summary of history that has since been replaced is no longer valid
+    if summary is None or summary.reset_revision != reset_revision:
+        if summary is not None and summary.task is not None:
+            summary.task.cancel()
+        summary = ConversationSummary(reset_revision)
+        summaries[conversation_id] = summary
+    return summary
+
+async def get_summary(conversation_id: str) -> str:
+    """
+    Get the rolling summary of a conversation for use in a prompt
+    
+    Args:
+        conversation_id: The conversation
+        
+    Returns:
+        The summary text, or a placeholder if nothing has been summarised yet
+    """
+    if not SUMMARY_ENABLED:
+        return NO_SUMMARY
+    return (await _current(conversation_id)).text or NO_SUMMARY
+
+async def schedule_update(conversation_id: str, context_start: int) -> None:
+    """
+    Fold messages that have dropped out of the prompt context into the summary
+    
+    Runs in the background and only once SUMMARY_BATCH_SIZE messages are waiting,
+    so the summary model is called once per batch rather than once per turn. At
+    most one update per conversation runs at a time.
+    
+    Args:
+        conversation_id: The conversation
+        context_start: The position of the oldest message still in the prompt context
+    """
+    if not SUMMARY_ENABLED:
+        return
+    
+    summary = await _current(conversation_id)
+    if summary.task is not None and not summary.task.done():
+        return
+    if context_start - summary.covered < SUMMARY_BATCH_SIZE:
+        return
+    
+    end = min(context_start, summary.covered + SUMMARY_MAX_BATCH_SIZE)
+    summary.task = asyncio.create_task(_fold(conversation_id, summary, end))
+
+def _format_messages(entries: List[Dict[str, Any]]) -> str:
+    lines = []
+    for entry in entries:
+        sender = entry["message"]["sender"]
+        name = entry["persona_settings"].get(sender, {}).get("name", sender)
+        lines.append(f"{name}: {entry['message']['text']}")
+    return "\n".join(lines)
+
+async def _fold(conversation_id: str, summary: ConversationSummary, end: int) -> None:
+    entries = await history_service.get_messages(conversation_id, summary.covered, end)
+    prompt = SUMMARY_PROMPT.format(
+        summary=summary.text or "(empty)",
+        messages=_format_messages(entries)
+    )
+    
+    try:
+        text = await ollama_service.generate_response(
+            model=SUMMARY_MODEL,
+            prompt=prompt,
+            temperature=SUMMARY_TEMPERATURE,
+            priority=BACKGROUND
+        )
+    except Exception as e:
+        logger.error(f"Error summarising conversation {conversation_id}: {str(e)}")
+        return
+    
+    if summaries.get(conversation_id) is not summary:
+        return
+    
+    summary.text = text.strip()
+    summary.covered = end
+    logger.info(f"Summary of conversation {conversation_id} now covers {end} messages")
+
+async def shutdown() -> None:
+    """
+    Cancel summary updates in progress, used when the application stops
+    """
+    tasks = [summary.task for summary in summaries.values() if summary.task is not None and not summary.task.done()]
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
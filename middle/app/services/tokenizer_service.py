@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import re
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# Token budget for a whole prompt, per model, falling back to the default
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2048"))
+CONTEXT_TOKEN_BUDGETS: Dict[str, int] = json.loads(os.getenv("CONTEXT_TOKEN_BUDGETS", "{}"))
+
+# Tokens kept free for the model's reply
+CONTEXT_RESPONSE_RESERVE = int(os.getenv("CONTEXT_RESPONSE_RESERVE", "512"))
+
+# Tokenizer name per model, falling back to the default tokenizer
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "heuristic")
+CONTEXT_TOKENIZERS: Dict[str, str] = json.loads(os.getenv("CONTEXT_TOKENIZERS", "{}"))
+
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def heuristic_token_count(text: str) -> int:
+    """
+    Estimate the number of tokens in a text without a model-specific tokenizer
+    
+    BPE tokenizers average roughly four characters per token on English text,
+    but punctuation and short words each cost a token of their own, so the
+    larger of the two estimates is used.
+    
+    Args:
+        text: The text to measure
+        
+    Returns:
+        The estimated number of tokens
+    """
+    if not text:
+        return 0
+    return max((len(text) + 3) // 4, len(_WORD_PATTERN.findall(text)))
+
+# Registered tokenizers by name
+tokenizers: Dict[str, Callable[[str], int]] = {
+    "heuristic": heuristic_token_count
+}
+
+def register_tokenizer(name: str, count_tokens: Callable[[str], int]) -> None:
+    """
+    Register a tokenizer that can be selected per model with CONTEXT_TOKENIZERS
+    
+    Args:
+        name: The tokenizer name
+        count_tokens: A function returning the number of tokens in a text
+    """
+    tokenizers[name] = count_tokens
+    logger.info(f"Registered tokenizer {name}")
+
+def get_tokenizer_name(model: str) -> str:
+    """
+    Get the name of the tokenizer used for a model
+    
+    Args:
+        model: The model name
+        
+    Returns:
+        The name of a registered tokenizer
+    """
+    name = CONTEXT_TOKENIZERS.get(model, CONTEXT_TOKENIZER)
+    if name not in tokenizers:
+        logger.warning(f"Unknown tokenizer {name} for model {model}, using heuristic")
+        return "heuristic"
+    return name
+
+def count_tokens(text: str, tokenizer_name: str = "heuristic") -> int:
+    """
+    Count the tokens in a text
+    
+    Args:
+        text: The text to measure
+        tokenizer_name: The registered tokenizer to use
+        
+    Returns:
+        The number of tokens
+    """
+    return tokenizers[tokenizer_name](text)
+
+def get_context_budget(model: str) -> int:
+    """
+    Get the prompt token budget for a model
+    
+    Args:
+        model: The model name
+        
+    Returns:
+        The number of tokens the whole prompt may use, excluding the reply reserve
+    """
+    return CONTEXT_TOKEN_BUDGETS.get(model, CONTEXT_TOKEN_BUDGET) - CONTEXT_RESPONSE_RESERVE
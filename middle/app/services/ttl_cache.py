@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class TTLCache:
+    """
+    Async cache with a time to live, single-flight loading and stale-while-revalidate
+    
+    Concurrent callers that miss share one in-flight load instead of each
+    calling upstream. A value older than ttl but younger than ttl + stale_ttl is
+    returned at once while one background load refreshes it. invalidate() drops
+    cached values and cancels loads already running, so they cannot bring
+    back data from before the invalidation; their callers join a fresh load.
+    """
+    def __init__(self, name: str, ttl: float, stale_ttl: float = 0.0):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.entries: Dict[Any, Tuple[float, Any]] = {}
+        self.generation = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._loading: Dict[Any, asyncio.Task] = {}
+    
+    async def get(self, key: Any, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Get a cached value, loading it if needed
+        
+        Args:
+            key: The cache key
+            loader: Called without arguments to load the value on a miss
+            
+        Returns:
+            The cached or loaded value
+        """
+        if self.ttl <= 0:
+            return await loader()
+        
+        entry = self.entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                self.hits += 1
+                return entry[1]
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                if key not in self._loading:
+                    self._start(key, loader)
+                return entry[1]
+        
+        while True:
+            if key in self._loading:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                self._start(key, loader)
+            task = self._loading[key]
+            generation = self.generation
+            try:
+                # Shielded so that a caller giving up does not cancel the load shared with others
+                return await asyncio.shield(task)
+            except asyncio.CancelledError:
+                # Only a load cancelled by invalidate(), which moves to a new generation, is retried;
+                # a caller that was cancelled leaves the shielded load running
+                if not (task.cancelled() and self.generation != generation):
+                    raise
+    
+    def _start(self, key: Any, loader: Callable[[], Awaitable[Any]]) -> None:
+        task = asyncio.create_task(self._load(key, loader, self.generation))
+        self._loading[key] = task
+        task.add_done_callback(lambda done: self._load_done(key, done))
+    
+    async def _load(self, key: Any, loader: Callable[[], Awaitable[Any]], generation: int) -> Any:
+        value = await loader()
+        if generation == self.generation:
+            self.entries[key] = (time.monotonic(), value)
+        return value
+    
+    def _load_done(self, key: Any, task: asyncio.Task) -> None:
+        if self._loading.get(key) is task:
+            del self._loading[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Loading {self.name} cache failed: {str(task.exception())}")
+    
+    def invalidate(self, key: Optional[Any] = None) -> None:
+        """
+        Drop cached values so the next caller loads fresh ones
+        
+        Args:
+            key: The key to drop, or None to drop every key
+        """
+        self.generation += 1
+        if key is None:
+            self.entries.clear()
+            loading = list(self._loading.values())
+            self._loading.clear()
+        else:
+            self.entries.pop(key, None)
+            task = self._loading.pop(key, None)
+            loading = [task] if task is not None else []
+        for task in loading:
+            task.cancel()
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get hit and miss counts
+        
+        Returns:
+            A dictionary of cache statistics
+        """
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self.entries)
+        }
@@ -0,0 +1,186 @@
+import logging
+import os
+import time
+from typing import Dict, List, Any, NamedTuple, Optional, Tuple
+from datetime import datetime
+from app.models.schemas import Message, PersonaSettings
+from app.services import history_service, prompt_template_service, summary_service, tokenizer_service
+from app.services.metrics import TURN_PHASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# "generate" sends a flat prompt to /api/generate, "chat" sends a message list to /api/chat
+GENERATION_MODE = os.getenv("GENERATION_MODE", "generate").lower()
+
+class PreparedTurn(NamedTuple):
+    """
+    Everything needed to generate the recipient's reply to a recorded message
+    
+    messages is set in chat mode, in which case prompt is its text rendering.
+    next_model is the sender's model, which answers the reply if the conversation goes on.
+    """
+    message_id: str
+    recipient_persona: Dict[str, Any]
+    prompt: str
+    messages: Optional[List[Dict[str, str]]] = None
+    next_model: Optional[str] = None
+
+def _end_phase(phase: str, phase_start: float) -> float:
+    # Record a phase of turn preparation and return the start of the next one
+    now = time.perf_counter()
+    TURN_PHASE_SECONDS.observe(now - phase_start, phase=phase)
+    return now
+
+async def build_prompt(
+    persona_settings: Dict[str, PersonaSettings],
+    message: Message,
+    conversation_id: str = history_service.DEFAULT_CONVERSATION_ID,
+    exclude_message_id: Optional[str] = None
+) -> Tuple[str, Optional[List[Dict[str, str]]], int]:
+    """
+    Build the prompt for the recipient's reply to a message, without recording anything
+    
+    The message is given separately, so it need not be in history yet; if it
+    is, pass its ID to keep it out of the conversation context.
+    
+    Args:
+        persona_settings: The persona settings at the time of the message
+        message: The message object
+        conversation_id: The conversation the message belongs to
+        exclude_message_id: The ID of the message in history, if it was recorded
+        
+    Returns:
+        The prompt, the chat messages in chat mode or None, and the number of history messages in the context
+    """
+    phase_start = time.perf_counter()
+    
+    # Determine sender and recipient personas
+    sender_persona = persona_settings[message.sender].model_dump()
+    recipient_persona = persona_settings[message.recipients].model_dump()
+    
+    # Fill the rest of the recipient model's token budget with the most recent history
+    model = recipient_persona["model"]
+    tokenizer_name = tokenizer_service.get_tokenizer_name(model)
+    conversation_summary = await summary_service.get_summary(conversation_id)
+    
+    if GENERATION_MODE == "chat":
+        fixed_messages = await prompt_template_service.construct_chat_messages(
+            sender_persona=sender_persona,
+            recipient_persona=recipient_persona,
+            recipient_id=message.recipients,
+            message_text=message.text,
+            conversation_context=[],
+            conversation_summary=conversation_summary
+        )
+        fixed_prompt = prompt_template_service.render_chat_messages(fixed_messages)
+    else:
+        fixed_prompt = await prompt_template_service.construct_prompt(
+            sender_persona=sender_persona,
+            recipient_persona=recipient_persona,
+            message_text=message.text,
+            conversation_context=[],
+            conversation_summary=conversation_summary
+        )
+    history_budget = (
+        tokenizer_service.get_context_budget(model)
+        - tokenizer_service.count_tokens(fixed_prompt, tokenizer_name)
+    )
+    
+    if GENERATION_MODE == "chat":
+        # Keep the start of the message list stable so the backend can reuse its KV cache
+        conversation_context = await history_service.get_anchored_context(
+            token_budget=history_budget,
+            anchor_key=message.recipients,
+            tokenizer_name=tokenizer_name,
+            conversation_id=conversation_id,
+            exclude_message_id=exclude_message_id
+        )
+    else:
+        conversation_context = await history_service.get_budgeted_context(
+            token_budget=history_budget,
+            tokenizer_name=tokenizer_name,
+            conversation_id=conversation_id,
+            exclude_message_id=exclude_message_id
+        )
+    
+    phase_start = _end_phase("context_build", phase_start)
+    
+    # Construct prompt
+    messages = None
+    if GENERATION_MODE == "chat":
+        messages = await prompt_template_service.construct_chat_messages(
+            sender_persona=sender_persona,
+            recipient_persona=recipient_persona,
+            recipient_id=message.recipients,
+            message_text=message.text,
+            conversation_context=conversation_context,
+            conversation_summary=conversation_summary
+        )
+        prompt = prompt_template_service.render_chat_messages(messages)
+    else:
+        prompt = await prompt_template_service.construct_prompt(
+            sender_persona=sender_persona,
+            recipient_persona=recipient_persona,
+            message_text=message.text,
+            conversation_context=conversation_context,
+            conversation_summary=conversation_summary
+        )
+    
+    _end_phase("prompt_construction", phase_start)
+    
+    return prompt, messages, len(conversation_context)
+
+async def prepare_turn(
+    timestamp: str,
+    persona_settings: Dict[str, PersonaSettings],
+    message: Message,
+    conversation_id: str = history_service.DEFAULT_CONVERSATION_ID
+) -> PreparedTurn:
+    """
+    Record a message in history and build the prompt for the recipient's reply
+    
+    Args:
+        timestamp: The timestamp of the message
+        persona_settings: The persona settings at the time of the message
+        message: The message object
+        conversation_id: The conversation the message belongs to
+        
+    Returns:
+        The prepared turn
+    """
+    # Add the message to history
+    phase_start = time.perf_counter()
+    message_id = await history_service.add_message(
+        timestamp=timestamp,
+        persona_settings=persona_settings,
+        message=message,
+        conversation_id=conversation_id
+    )
+    
+    _end_phase("history_append", phase_start)
+    
+    # If this is an edited AI response, log it but continue processing
+    if message.raw_text is not None:
+        logger.info(f"Message {message_id} is an edited AI response, continuing conversation")
+    
+    prompt, messages, context_length = await build_prompt(
+        persona_settings,
+        message,
+        conversation_id,
+        exclude_message_id=message_id
+    )
+    
+    # Messages older than the context are folded into the summary in the background
+    context_start = await history_service.get_conversation_length(conversation_id) - 1 - context_length
+    await summary_service.schedule_update(conversation_id, context_start)
+    
+    recipient_persona = persona_settings[message.recipients].model_dump()
+    await prompt_template_service.record_payload(
+        message_id,
+        conversation_id,
+        prompt,
+        recipient_persona,
+        datetime.utcnow().isoformat() + "Z"
+    )
+    
+    return PreparedTurn(message_id, recipient_persona, prompt, messages, persona_settings[message.sender].model)
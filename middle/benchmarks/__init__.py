@@ -0,0 +1,2 @@
+# Benchmarks for the multi-agentic middle tier
+# Run from the middle/ directory, e.g. python -m benchmarks.bench_client_pool
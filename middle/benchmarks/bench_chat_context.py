@@ -0,0 +1,88 @@
+"""
+Compare prompt evaluation cost of the flat /api/generate prompt against /api/chat
+with an anchored context window.
+
+The stub server evaluates only the part of each prompt after the prefix shared
+with the model's previous prompt, like Ollama's KV cache reuse, and reports it
+as prompt_eval_count and prompt_eval_duration.
+
+Usage (from the middle/ directory):
+    python -m benchmarks.bench_chat_context --turns 200 --budget 1024
+"""
+import argparse
+import asyncio
+import json
+import statistics
+from datetime import datetime
+from typing import Dict, Any
+
+from app.models.schemas import Message, PersonaSettings
+from app.services import ollama_service, tokenizer_service, turn_service
+from benchmarks.stub_ollama import StubOllamaServer
+
+PERSONAS = {
+    "A": PersonaSettings(name="Alice", system_prompt="You are Alice, a curious scientist.", model="stub-a", temperature=0.7),
+    "B": PersonaSettings(name="Bob", system_prompt="You are Bob, a patient teacher.", model="stub-b", temperature=0.7)
+}
+
+async def run_mode(mode: str, turns: int, stub: StubOllamaServer) -> Dict[str, Any]:
+    turn_service.GENERATION_MODE = mode
+    conversation_id = f"bench-{mode}"
+    stub.state.reset()
+    
+    sender, recipient = "A", "B"
+    text = "Let us talk about the weather on other planets."
+    for i in range(turns):
+        turn = await turn_service.prepare_turn(
+            timestamp=datetime.utcnow().isoformat() + "Z",
+            persona_settings=PERSONAS,
+            message=Message(sender=sender, recipients=recipient, text=f"{text} (turn {i})"),
+            conversation_id=conversation_id
+        )
+        text = await ollama_service.generate_response(
+            model=turn.recipient_persona["model"],
+            prompt=turn.prompt,
+            temperature=turn.recipient_persona["temperature"],
+            messages=turn.messages
+        )
+        sender, recipient = recipient, sender
+    
+    evaluated = [stats["prompt_eval_count"] for stats in stub.state.prompt_evals]
+    prompt_tokens = [stats["prompt_tokens"] for stats in stub.state.prompt_evals]
+    durations = [stats["prompt_eval_duration"] for stats in stub.state.prompt_evals]
+    return {
+        "turns": turns,
+        "mean_prompt_tokens": round(statistics.mean(prompt_tokens), 1),
+        "mean_prompt_eval_count": round(statistics.mean(evaluated), 1),
+        "mean_prompt_eval_duration_ns": round(statistics.mean(durations)),
+        "total_prompt_eval_duration_ns": sum(durations),
+        "cache_reuse_ratio": round(1 - sum(evaluated) / max(1, sum(prompt_tokens)), 3)
+    }
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    tokenizer_service.CONTEXT_TOKEN_BUDGET = args.budget + tokenizer_service.CONTEXT_RESPONSE_RESERVE
+    results: Dict[str, Any] = {}
+    with StubOllamaServer(prompt_token_cost=args.token_cost) as stub:
+        ollama_service.configure_backends([stub.api_url])
+        await ollama_service.start_client()
+        for mode in ("generate", "chat"):
+            results[mode] = await run_mode(mode, args.turns, stub)
+        await ollama_service.close_client()
+    
+    generate_total = results["generate"]["total_prompt_eval_duration_ns"]
+    chat_total = results["chat"]["total_prompt_eval_duration_ns"]
+    results["prompt_eval_duration_reduction"] = round(1 - chat_total / max(1, generate_total), 3)
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--budget", type=int, default=1024, help="History token budget per prompt")
+    parser.add_argument("--token-cost", type=int, default=1000, help="Simulated ns of prompt evaluation per token")
+    args = parser.parse_args()
+    
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
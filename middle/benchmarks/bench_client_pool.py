@@ -0,0 +1,81 @@
+"""
+Compare a new httpx client per Ollama call against the shared pooled client.
+
+Usage (from the middle/ directory):
+    python -m benchmarks.bench_client_pool --requests 500 --concurrency 10 --latency 0.005
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Awaitable, Callable, Dict, Any, List
+
+import httpx
+
+from app.services import ollama_service
+from benchmarks.stub_ollama import StubOllamaServer
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+async def per_call_generate(model: str, prompt: str) -> str:
+    # Reproduces the previous behaviour: one client, and one connection, per call
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        response = await client.post(
+            f"{ollama_service.OLLAMA_API_URL}/generate",
+            json={"model": model, "prompt": prompt, "stream": False}
+        )
+        return response.json().get("response", "")
+
+async def shared_generate(model: str, prompt: str) -> str:
+    return await ollama_service.generate_response(model=model, prompt=prompt)
+
+async def drive(call: Callable[[str, str], Awaitable[str]], requests: int, concurrency: int) -> List[float]:
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def one(i: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await call("stub-model", f"prompt {i}")
+            latencies.append(time.perf_counter() - start)
+    
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    with StubOllamaServer(latency=args.latency) as stub:
+        ollama_service.configure_backends([stub.api_url])
+        for name, call in (("per_call_client", per_call_generate), ("shared_client", shared_generate)):
+            await ollama_service.start_client()
+            stub.state.reset()
+            start = time.perf_counter()
+            latencies = await drive(call, args.requests, args.concurrency)
+            elapsed = time.perf_counter() - start
+            results[name] = {
+                "requests": stub.state.requests,
+                "connections_opened": len(stub.state.connections),
+                "throughput_rps": round(args.requests / elapsed, 1),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+                "mean_ms": round(statistics.mean(latencies) * 1000, 3)
+            }
+            await ollama_service.close_client()
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.005, help="Simulated generation latency in seconds")
+    args = parser.parse_args()
+    
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
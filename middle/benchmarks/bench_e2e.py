@@ -0,0 +1,368 @@
+"""
+End-to-end load benchmark of the middle tier against the stub Ollama server.
+
+The app runs under uvicorn in a child process, as it does in production, and
+talks to a stub Ollama server in this process with configurable latency and
+token rate. Three scenarios drive it over HTTP:
+
+    operators      concurrent simulated operators, each sending --turns turns in
+                   their own conversation, a share of them streamed over SSE
+    auto_respond   concurrent server-side auto-response jobs, polled until done
+    mixed          the operators again while the auto-response jobs run
+
+Each scenario reports throughput, p50/p95/p99 latency (and time to first token
+for streamed turns), CPU time of the app process per request and its memory
+growth, read from /proc on Linux. The results are JSON; --output writes them to
+a file and --compare adds the change from an earlier file, so runs before and
+after a change can be compared.
+
+Usage (from the middle/ directory):
+    python -m benchmarks.bench_e2e --operators 16 --turns 10 --jobs 4 --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+import httpx
+
+from benchmarks.bench_client_pool import percentile
+from benchmarks.stub_ollama import StubOllamaServer
+
+# Metrics compared by --compare, and whether a higher value is better
+COMPARED_METRICS = {
+    "throughput_per_second": True,
+    "latency_p50_ms": False,
+    "latency_p95_ms": False,
+    "latency_p99_ms": False,
+    "cpu_ms_per_request": False,
+    "rss_growth_mb": False
+}
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def process_usage(pid: int) -> Optional[Dict[str, float]]:
+    """
+    Read a process's CPU time and resident memory from /proc
+    
+    Args:
+        pid: The process ID
+        
+    Returns:
+        {"cpu_seconds", "rss_mb"}, or None where /proc is not available
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r") as stat_file:
+            # Fields after the command name, which may contain spaces, start at field 3 (state)
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        rss_mb = 0.0
+        with open(f"/proc/{pid}/status", "r") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    rss_mb = int(line.split()[1]) / 1024
+        return {"cpu_seconds": cpu_seconds, "rss_mb": rss_mb}
+    except (OSError, ValueError, IndexError):
+        return None
+
+def latency_summary(samples: List[float], prefix: str) -> Dict[str, Any]:
+    if not samples:
+        return {}
+    return {
+        f"{prefix}_p50_ms": round(percentile(samples, 50) * 1000, 1),
+        f"{prefix}_p95_ms": round(percentile(samples, 95) * 1000, 1),
+        f"{prefix}_p99_ms": round(percentile(samples, 99) * 1000, 1),
+        f"{prefix}_max_ms": round(max(samples) * 1000, 1)
+    }
+
+class MiddleProcess:
+    """
+    The middle tier running under uvicorn in a child process
+    """
+    def __init__(self, ollama_url: str, env: Dict[str, str]):
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.env = {
+            **os.environ,
+            "OLLAMA_API_URL": ollama_url,
+            "OLLAMA_API_URLS": ollama_url,
+            "LOG_LEVEL": "WARNING",
+            **env
+        }
+        self.process: Optional[subprocess.Popen] = None
+    
+    async def __aenter__(self) -> "MiddleProcess":
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--log-level", "warning"],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=self.env
+        )
+        deadline = time.monotonic() + 30
+        async with httpx.AsyncClient() as client:
+            while True:
+                try:
+                    if (await client.get(f"{self.base_url}/")).status_code == 200:
+                        return self
+                except httpx.RequestError:
+                    pass
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("The middle tier did not start")
+                await asyncio.sleep(0.1)
+    
+    async def __aexit__(self, *exc) -> None:
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+    
+    def usage(self) -> Optional[Dict[str, float]]:
+        return process_usage(self.process.pid)
+
+def _personas(index: int, models: List[str]) -> Dict[str, Any]:
+    return {
+        "A": {"name": f"Alice {index}", "system_prompt": "You are curious and ask questions.",
+              "model": models[(2 * index) % len(models)], "temperature": 0.7},
+        "B": {"name": f"Bob {index}", "system_prompt": "You answer briefly and precisely.",
+              "model": models[(2 * index + 1) % len(models)], "temperature": 0.7}
+    }
+
+async def _send_turn(
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    body: Dict[str, Any],
+    stream: bool,
+    latencies: List[float],
+    first_tokens: List[float],
+    errors: List[str]
+) -> None:
+    start = time.perf_counter()
+    try:
+        if not stream:
+            response = await client.post("/api/message", json=body)
+            if response.status_code != 200:
+                errors.append(f"HTTP {response.status_code}")
+                return
+        else:
+            first_token = None
+            async with client.stream("POST", "/api/message/stream", json=body) as response:
+                if response.status_code != 200:
+                    errors.append(f"HTTP {response.status_code}")
+                    return
+                async for line in response.aiter_lines():
+                    if line == "event: token" and first_token is None:
+                        first_token = time.perf_counter() - start
+                    elif line == "event: error":
+                        errors.append("stream error")
+                        return
+            if first_token is not None:
+                first_tokens.append(first_token)
+        latencies.append(time.perf_counter() - start)
+    except httpx.HTTPError as e:
+        errors.append(type(e).__name__)
+
+async def _operator(
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    index: int,
+    latencies: List[float],
+    first_tokens: List[float],
+    errors: List[str]
+) -> None:
+    personas = _personas(index, args.models)
+    conversation_id = f"bench-operator-{index}-{time.monotonic_ns()}"
+    sender, recipient = "A", "B"
+    for turn in range(args.turns):
+        if args.think:
+            await asyncio.sleep(args.think)
+        body = {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "persona_settings": personas,
+            "message": {"sender": sender, "recipients": recipient, "text": f"Operator {index} says hello, turn {turn}."},
+            "conversation_id": conversation_id
+        }
+        # Spread streamed turns evenly over the run
+        stream = int((turn + 1) * args.stream_ratio) > int(turn * args.stream_ratio)
+        await _send_turn(client, args, body, stream, latencies, first_tokens, errors)
+        sender, recipient = recipient, sender
+
+async def _auto_respond_job(
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    index: int,
+    durations: List[float],
+    errors: List[str]
+) -> int:
+    start = time.perf_counter()
+    response = await client.post("/api/auto-respond/jobs", json={
+        "persona_settings": _personas(index, args.models),
+        "message": {"sender": "A", "recipients": "B", "text": f"Job {index} opening line."},
+        "turns": {"A": args.job_turns, "B": args.job_turns}
+    })
+    if response.status_code != 200:
+        errors.append(f"HTTP {response.status_code}")
+        return 0
+    job_id = response.json()["job"]["job_id"]
+    while True:
+        await asyncio.sleep(0.05)
+        job = (await client.get(f"/api/auto-respond/jobs/{job_id}")).json()["job"]
+        if job["status"] in ("completed", "failed", "cancelled"):
+            break
+    if job["status"] != "completed":
+        errors.append(f"job {job['status']}: {job.get('error')}")
+    durations.append(time.perf_counter() - start)
+    return job["turns_completed"]
+
+async def run_scenario(
+    middle: MiddleProcess,
+    args: argparse.Namespace,
+    operators: int,
+    jobs: int
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    first_tokens: List[float] = []
+    job_durations: List[float] = []
+    errors: List[str] = []
+    limits = httpx.Limits(max_connections=operators + jobs + 10, max_keepalive_connections=operators + jobs + 10)
+    async with httpx.AsyncClient(base_url=middle.base_url, limits=limits, timeout=300.0) as client:
+        before = middle.usage()
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(_operator(client, args, index, latencies, first_tokens, errors) for index in range(operators)),
+            *(_auto_respond_job(client, args, index, job_durations, errors) for index in range(jobs))
+        )
+        elapsed = time.perf_counter() - start
+        after = middle.usage()
+    
+    job_turns = sum(result or 0 for result in results[operators:])
+    # Operator turns are the measured requests; job turns count only when there are no operators
+    requests = len(latencies) if operators else job_turns
+    result: Dict[str, Any] = {
+        "requests": requests,
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "throughput_per_second": round(requests / elapsed, 2) if elapsed else 0.0,
+        **latency_summary(latencies if operators else job_durations, "latency"),
+        **latency_summary(first_tokens, "first_token")
+    }
+    if jobs:
+        result["job_turns"] = job_turns
+        result["job_turns_per_second"] = round(job_turns / elapsed, 2) if elapsed else 0.0
+    if before and after:
+        handled = len(latencies) + job_turns
+        result["cpu_ms_per_request"] = round((after["cpu_seconds"] - before["cpu_seconds"]) * 1000 / max(1, handled), 3)
+        result["rss_mb_start"] = round(before["rss_mb"], 1)
+        result["rss_mb_end"] = round(after["rss_mb"], 1)
+        result["rss_growth_mb"] = round(after["rss_mb"] - before["rss_mb"], 1)
+    if errors:
+        result["error_samples"] = sorted(set(errors))[:5]
+    return result
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compare the scenarios of two runs
+    
+    Args:
+        current: The results of this run
+        baseline: The results of an earlier run
+        
+    Returns:
+        Per scenario and metric, the baseline and current values, the change in
+        percent, and whether the change is an improvement
+    """
+    comparison: Dict[str, Any] = {}
+    for name, scenario in current["scenarios"].items():
+        earlier = baseline.get("scenarios", {}).get(name)
+        if not earlier:
+            continue
+        comparison[name] = {}
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if metric not in scenario or metric not in earlier:
+                continue
+            old, new = earlier[metric], scenario[metric]
+            change = round((new - old) / old * 100, 1) if old else None
+            comparison[name][metric] = {
+                "baseline": old,
+                "current": new,
+                "change_pct": change,
+                "improved": (new > old) == higher_is_better if new != old else None
+            }
+    return comparison
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    env = dict(item.split("=", 1) for item in args.env)
+    with StubOllamaServer(
+        latency=args.latency,
+        tokens=args.tokens,
+        token_rate=args.token_rate,
+        parallel=args.parallel,
+        models=args.models
+    ) as stub:
+        async with MiddleProcess(stub.api_url, env) as middle:
+            scenarios: Dict[str, Any] = {}
+            for name in args.scenarios:
+                if name == "operators":
+                    scenarios[name] = await run_scenario(middle, args, args.operators, 0)
+                elif name == "auto_respond":
+                    scenarios[name] = await run_scenario(middle, args, 0, args.jobs)
+                elif name == "mixed":
+                    scenarios[name] = await run_scenario(middle, args, args.operators, args.jobs)
+            return {
+                "benchmark": "e2e",
+                "started_at": datetime.utcnow().isoformat() + "Z",
+                "git_commit": _git_commit(),
+                "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+                "scenarios": scenarios
+            }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="operators,auto_respond,mixed",
+                        type=lambda value: [name.strip() for name in value.split(",") if name.strip()])
+    parser.add_argument("--operators", type=int, default=16, help="Concurrent simulated operators")
+    parser.add_argument("--turns", type=int, default=10, help="Turns per operator")
+    parser.add_argument("--think", type=float, default=0.0, help="Seconds an operator waits between turns")
+    parser.add_argument("--stream-ratio", type=float, default=0.5, help="Share of operator turns streamed over SSE")
+    parser.add_argument("--jobs", type=int, default=4, help="Concurrent auto-response jobs")
+    parser.add_argument("--job-turns", type=int, default=5, help="Turns per persona per job")
+    parser.add_argument("--models", default="model-a,model-b,model-c,model-d",
+                        type=lambda value: [name.strip() for name in value.split(",") if name.strip()])
+    parser.add_argument("--latency", type=float, default=0.02, help="Stub seconds before the first token")
+    parser.add_argument("--tokens", type=int, default=20, help="Stub tokens per reply")
+    parser.add_argument("--token-rate", type=float, default=500.0, help="Stub tokens per second; 0 for no delay")
+    parser.add_argument("--parallel", type=int, default=8, help="Stub generations run at once; 0 for no limit")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Environment setting for the middle tier, such as SCHEDULER_MAX_CONCURRENT_PER_BACKEND=8")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare with the results of an earlier run")
+    args = parser.parse_args()
+    
+    results = asyncio.run(run(args))
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as baseline_file:
+            results["comparison"] = compare(results, json.load(baseline_file))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measure append throughput and cold-start replay time of the JSONL history log.
+
+Usage (from the middle/ directory):
+    python -m benchmarks.bench_history_log --messages 1000000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Dict, Any
+
+from app.services.history_log import HistoryLog
+from app.services.history_service import ConversationStore
+
+def make_entry(i: int) -> Dict[str, Any]:
+    persona = {"name": "Bob", "system_prompt": "You are a creative technical AI assistant", "model": "dolphin-phi", "temperature": 0.7}
+    return {
+        "message_id": f"2024-01-01T00-00-00Z-{i:08x}",
+        "timestamp": f"2024-01-01T00:00:00.{i:09d}Z",
+        "persona_settings": {"persona1": persona, "persona2": dict(persona, name="Alice")},
+        "message": {"sender": "persona1", "recipients": "persona2", "text": f"Message number {i} " * 8, "raw_text": None}
+    }
+
+def run(messages: int, conversations: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "history.jsonl")
+        log = HistoryLog(path)
+        log.start()
+        
+        entries = [make_entry(i) for i in range(messages)]
+        
+        start = time.perf_counter()
+        for i, entry in enumerate(entries):
+            log.append(f"conversation-{i % conversations}", entry)
+        enqueued = time.perf_counter() - start
+        
+        log.close()
+        durable = time.perf_counter() - start
+        size = os.path.getsize(path)
+        del entries
+        
+        store = ConversationStore()
+        start = time.perf_counter()
+        replayed = HistoryLog(path).replay(store)
+        replay = time.perf_counter() - start
+        
+        return {
+            "messages": messages,
+            "conversations": conversations,
+            "log_bytes": size,
+            "append_enqueue_per_sec": round(messages / enqueued),
+            "append_durable_per_sec": round(messages / durable),
+            "append_enqueue_us": round(enqueued / messages * 1e6, 3),
+            "replay_seconds": round(replay, 3),
+            "replayed_records": replayed
+        }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--conversations", type=int, default=10)
+    args = parser.parse_args()
+    
+    print(json.dumps(run(args.messages, args.conversations), indent=2))
+
+if __name__ == "__main__":
+    main()
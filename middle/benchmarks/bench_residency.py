@@ -0,0 +1,86 @@
+"""
+Measure model swaps when auto-response jobs with different persona models share one GPU.
+
+The stub backend holds a limited number of models, so a turn for any other
+model is a cold load that evicts one. The baseline lets waiting turns through
+in arrival order without pre-warming; the residency run batches waiting turns
+by loaded model and pre-warms the next persona's model when it fits.
+
+Usage (from the middle/ directory):
+    python -m benchmarks.bench_residency --jobs 4 --turns 10 --models 4 --max-loaded 2
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, Any
+
+from app.models.schemas import Message, PersonaSettings
+from app.services import conversation_runner, model_residency, ollama_service
+from benchmarks.stub_ollama import StubOllamaServer
+
+async def run_jobs(args: argparse.Namespace, batching: bool, stub: StubOllamaServer) -> Dict[str, Any]:
+    stub.state.reset()
+    model_residency.RESIDENCY_MAX_BATCH = args.max_batch if batching else 0
+    model_residency.RESIDENCY_MAX_LOADED_MODELS = args.max_loaded if batching else 0
+    ollama_service.residency = model_residency.ResidencyManager()
+    ollama_service.configure_backends([stub.api_url])
+    conversation_runner._backend_gates.clear()
+    await ollama_service.start_client()
+    
+    start = time.perf_counter()
+    jobs = []
+    for i in range(args.jobs):
+        personas = {
+            "A": PersonaSettings(name="A", system_prompt="a", model=f"model-{(2 * i) % args.models}", temperature=0.7),
+            "B": PersonaSettings(name="B", system_prompt="b", model=f"model-{(2 * i + 1) % args.models}", temperature=0.7)
+        }
+        jobs.append(conversation_runner.start_job(
+            personas,
+            Message(sender="A", recipients="B", text="hello"),
+            {"A": args.turns, "B": args.turns},
+            conversation_id=f"residency-{batching}-{i}"
+        ))
+    await asyncio.gather(*(job.task for job in jobs))
+    elapsed = time.perf_counter() - start
+    
+    stats = ollama_service.residency.stats()
+    await ollama_service.close_client()
+    return {
+        "turns": sum(job.turns_completed for job in jobs),
+        "seconds": round(elapsed, 2),
+        "cold_loads": stub.state.loads,
+        "swaps_logged": stats["swaps"],
+        "load_seconds_logged": stats["load_seconds"],
+        "prewarms": stats["prewarms"]
+    }
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    with StubOllamaServer(
+        latency=args.latency,
+        load_delay=args.load_delay,
+        max_loaded=args.max_loaded,
+        parallel=args.parallel
+    ) as stub:
+        return {
+            "arrival_order": await run_jobs(args, False, stub),
+            "residency": await run_jobs(args, True, stub)
+        }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=10, help="Turns per persona per job")
+    parser.add_argument("--models", type=int, default=4)
+    parser.add_argument("--max-loaded", type=int, default=2, help="Models the backend holds at once")
+    parser.add_argument("--max-batch", type=int, default=16, help="RESIDENCY_MAX_BATCH for the residency run")
+    parser.add_argument("--parallel", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.02, help="Simulated generation time in seconds")
+    parser.add_argument("--load-delay", type=float, default=0.1, help="Simulated cold model load time in seconds")
+    args = parser.parse_args()
+    
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
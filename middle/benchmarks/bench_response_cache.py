@@ -0,0 +1,57 @@
+"""
+Replay a fixed suite of deterministic generations through the response cache.
+
+The first pass generates everything, the second is served from memory, and
+the third starts with an empty memory tier over the same directory, like a
+restarted server, and is served from disk.
+
+Usage (from the middle/ directory):
+    python -m benchmarks.bench_response_cache --prompts 200 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from typing import Dict, Any
+
+from app.services import ollama_service, response_cache
+from benchmarks.stub_ollama import StubOllamaServer
+
+async def replay(args: argparse.Namespace) -> Dict[str, Any]:
+    start = time.perf_counter()
+    for i in range(args.prompts):
+        await ollama_service.generate_response(model="stub-model", prompt=f"suite prompt {i}", temperature=0)
+    elapsed = time.perf_counter() - start
+    return {"seconds": round(elapsed, 3), **ollama_service.responses.stats()}
+
+async def run(args: argparse.Namespace, directory: str) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    response_cache.RESPONSE_CACHE_ENABLED = True
+    with StubOllamaServer(latency=args.latency) as stub:
+        ollama_service.configure_backends([stub.api_url])
+        await ollama_service.start_client()
+        
+        ollama_service.responses = response_cache.ResponseCache(directory=directory)
+        results["generate"] = await replay(args)
+        results["memory"] = await replay(args)
+        
+        ollama_service.responses = response_cache.ResponseCache(directory=directory)
+        results["disk"] = await replay(args)
+        
+        results["upstream_requests"] = stub.state.requests
+        await ollama_service.close_client()
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated generation latency in seconds")
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        results = asyncio.run(run(args, directory))
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Compare one Ollama backend against a routed pool, with and without model affinity.
+
+Each stub backend runs a limited number of generations at once and holds a
+limited number of models, so a request for any other model is a cold load that
+evicts one. Each worker is a conversation between two personas whose models
+are drawn from a shared set, taking turns with a random pause between them.
+
+Usage (from the middle/ directory):
+    python -m benchmarks.bench_router --backends 3 --models 6 --workers 6 --requests 300
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from contextlib import ExitStack
+from typing import Dict, Any, List
+
+from app.services import backend_router, ollama_service
+from benchmarks.bench_client_pool import percentile
+from benchmarks.stub_ollama import StubOllamaServer
+
+async def drive(args: argparse.Namespace) -> Dict[str, Any]:
+    latencies: List[float] = []
+    remaining = [args.requests]
+    
+    rng = random.Random(args.seed)
+    pairs = [rng.sample(range(args.models), 2) for _ in range(args.workers)]
+    
+    async def worker(index: int) -> None:
+        turn = 0
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            model = f"model-{pairs[index][turn % 2]}"
+            await asyncio.sleep(rng.uniform(0, args.latency))
+            start = time.perf_counter()
+            await ollama_service.generate_response(model=model, prompt=f"worker {index} turn {turn}")
+            latencies.append(time.perf_counter() - start)
+            turn += 1
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(args.workers)))
+    elapsed = time.perf_counter() - start
+    return {
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1)
+    }
+
+async def run_config(stubs: List[StubOllamaServer], affinity_limit: int, args: argparse.Namespace) -> Dict[str, Any]:
+    for stub in stubs:
+        stub.state.reset()
+    backend_router.OLLAMA_AFFINITY_MAX_IN_FLIGHT = affinity_limit
+    ollama_service.configure_backends([stub.api_url for stub in stubs])
+    await ollama_service.start_client()
+    result = await drive(args)
+    await ollama_service.close_client()
+    result["cold_loads"] = sum(stub.state.loads for stub in stubs)
+    result["requests_per_backend"] = [stub.state.requests for stub in stubs]
+    return result
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    with ExitStack() as stack:
+        stubs = [
+            stack.enter_context(StubOllamaServer(
+                latency=args.latency,
+                load_delay=args.load_delay,
+                max_loaded=args.max_loaded,
+                parallel=args.parallel
+            ))
+            for _ in range(args.backends)
+        ]
+        return {
+            "single_backend": await run_config(stubs[:1], args.affinity_limit, args),
+            "pool_least_loaded": await run_config(stubs, 0, args),
+            "pool_affinity": await run_config(stubs, args.affinity_limit, args)
+        }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", type=int, default=3)
+    parser.add_argument("--models", type=int, default=6)
+    parser.add_argument("--workers", type=int, default=6)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.02, help="Simulated generation time in seconds")
+    parser.add_argument("--load-delay", type=float, default=0.1, help="Simulated cold model load time in seconds")
+    parser.add_argument("--parallel", type=int, default=4, help="Generations each backend runs at once")
+    parser.add_argument("--max-loaded", type=int, default=2, help="Models each backend holds at once")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--affinity-limit", type=int, default=4, help="OLLAMA_AFFINITY_MAX_IN_FLIGHT for the affinity run")
+    args = parser.parse_args()
+    
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Measure interactive latency while background generations saturate the backend.
+
+The stub backend runs --parallel generations at once. Background workers keep
+it busy the whole time while a few operators send interactive turns. Without
+admission control every request goes straight to the backend and waits in its
+queue in arrival order. With the scheduler, the backend gets --parallel requests
+at a time and interactive turns are let through ahead of the background queue.
+A final burst against a small queue shows the 429 rejections and how quickly
+they come back.
+
+Usage (from the middle/ directory):
+    python -m benchmarks.bench_scheduler --background 16 --operators 4 --turns 10
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List, Any
+
+from app.services import generation_scheduler, ollama_service
+from app.services.generation_scheduler import BACKGROUND, INTERACTIVE, GenerationRejected, GenerationScheduler
+from benchmarks.bench_client_pool import percentile
+from benchmarks.stub_ollama import StubOllamaServer
+
+async def background_worker(stop: asyncio.Event, completed: List[int]) -> None:
+    while not stop.is_set():
+        await ollama_service.generate_response("batch-model", "background turn", priority=BACKGROUND)
+        completed[0] += 1
+
+async def operator(args: argparse.Namespace, latencies: List[float]) -> None:
+    for turn in range(args.turns):
+        await asyncio.sleep(args.think)
+        start = time.perf_counter()
+        await ollama_service.generate_response("chat-model", f"interactive turn {turn}")
+        latencies.append(time.perf_counter() - start)
+
+async def run_mixed(args: argparse.Namespace, scheduled: bool, stub: StubOllamaServer) -> Dict[str, Any]:
+    stub.state.reset()
+    ollama_service.configure_backends([stub.api_url])
+    # Without admission control the scheduler never makes anyone wait
+    slots = args.parallel if scheduled else 1_000_000
+    ollama_service.scheduler = GenerationScheduler(ollama_service.router, slots_per_backend=slots, max_queue=1_000_000)
+    await ollama_service.start_client()
+    
+    stop = asyncio.Event()
+    completed = [0]
+    latencies: List[float] = []
+    workers = [asyncio.create_task(background_worker(stop, completed)) for _ in range(args.background)]
+    await asyncio.sleep(args.latency * 2)
+    start = time.perf_counter()
+    await asyncio.gather(*(operator(args, latencies) for _ in range(args.operators)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await asyncio.gather(*workers)
+    await ollama_service.close_client()
+    
+    return {
+        "interactive_turns": len(latencies),
+        "interactive_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "interactive_p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "interactive_max_ms": round(max(latencies) * 1000, 1),
+        "interactive_turns_per_second": round(len(latencies) / elapsed, 1),
+        "background_turns_per_second": round(completed[0] / elapsed, 1)
+    }
+
+async def run_burst(args: argparse.Namespace, stub: StubOllamaServer) -> Dict[str, Any]:
+    stub.state.reset()
+    ollama_service.configure_backends([stub.api_url])
+    ollama_service.scheduler = GenerationScheduler(
+        ollama_service.router, slots_per_backend=args.parallel, max_queue=args.max_queue
+    )
+    await ollama_service.start_client()
+    
+    async def attempt(index: int) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            await ollama_service.generate_response("chat-model", f"burst {index}", priority=INTERACTIVE)
+            return {"status": 200, "seconds": time.perf_counter() - start}
+        except GenerationRejected as e:
+            return {"status": e.status_code, "seconds": time.perf_counter() - start, "retry_after": e.retry_after}
+    
+    results = await asyncio.gather(*(attempt(i) for i in range(args.burst)))
+    await ollama_service.close_client()
+    
+    rejected = [result for result in results if result["status"] != 200]
+    return {
+        "requests": len(results),
+        "served": len(results) - len(rejected),
+        "rejected_429": sum(1 for result in rejected if result["status"] == 429),
+        "rejection_max_ms": round(max((result["seconds"] for result in rejected), default=0) * 1000, 1),
+        "retry_after_seconds": sorted({result["retry_after"] for result in rejected})
+    }
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    generation_scheduler.SCHEDULER_INTERACTIVE_QUEUE_TIMEOUT = 0
+    with StubOllamaServer(latency=args.latency, parallel=args.parallel) as stub:
+        return {
+            "no_admission_control": await run_mixed(args, False, stub),
+            "scheduler": await run_mixed(args, True, stub),
+            "burst": await run_burst(args, stub)
+        }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--background", type=int, default=16, help="Background generations kept in flight")
+    parser.add_argument("--operators", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=10, help="Interactive turns per operator")
+    parser.add_argument("--think", type=float, default=0.05, help="Seconds between an operator's turns")
+    parser.add_argument("--parallel", type=int, default=2, help="Generations the backend runs at once")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated generation time in seconds")
+    parser.add_argument("--max-queue", type=int, default=8, help="Scheduler queue length for the burst")
+    parser.add_argument("--burst", type=int, default=40, help="Simultaneous interactive requests in the burst")
+    args = parser.parse_args()
+    
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
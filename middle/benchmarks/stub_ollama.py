@@ -0,0 +1,318 @@
+import argparse
+import asyncio
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+import json
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+class StubOllamaState:
+    """
+    Counters shared between the stub server and the benchmark driving it
+    """
+    def __init__(
+        self,
+        latency: float = 0.0,
+        tokens: int = 20,
+        token_rate: float = 0.0,
+        prompt_token_cost: int = 1000,
+        load_delay: float = 0.0,
+        max_loaded: int = 0,
+        parallel: int = 0,
+        unload_delay: float = 0.0,
+        models: Optional[List[str]] = None
+    ):
+        # Seconds before the first token, tokens per reply, and tokens generated per second (0 for no delay)
+        self.latency = latency
+        self.tokens = tokens
+        self.token_rate = token_rate
+        # Simulated nanoseconds of prompt evaluation per token not covered by the KV cache
+        self.prompt_token_cost = prompt_token_cost
+        # Seconds to load a model that is not resident, how many fit at once (0 for
+        # no limit) and how many generations run at once (0 for no limit)
+        self.load_delay = load_delay
+        self.max_loaded = max_loaded
+        self.parallel = parallel
+        self.unload_delay = unload_delay
+        # Models listed by /api/tags
+        self.models = models or ["stub-model"]
+        self.loaded: "OrderedDict[str, None]" = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+        self.requests = 0
+        self.streams_started = 0
+        self.streams_completed = 0
+        self.connections: Set[Tuple[str, int]] = set()
+        self.last_prompts: Dict[str, str] = {}
+        self.prompt_evals: List[Dict[str, int]] = []
+    
+    def reset(self) -> None:
+        self.requests = 0
+        self.streams_started = 0
+        self.streams_completed = 0
+        self.connections = set()
+        self.last_prompts = {}
+        self.prompt_evals = []
+        self.loaded = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+    
+    def evaluate_prompt(self, model: str, prompt: str) -> Dict[str, int]:
+        """
+        Simulate prompt evaluation against a per-model KV cache
+        
+        Like Ollama, only the part of the prompt after the prefix shared with the
+        model's previous prompt is evaluated. Tokens are approximated as 4 characters.
+        """
+        previous = self.last_prompts.get(model, "")
+        shared = len(os.path.commonprefix([previous, prompt]))
+        self.last_prompts[model] = prompt
+        evaluated = max(1, (len(prompt) - shared) // 4)
+        stats = {
+            "prompt_tokens": len(prompt) // 4,
+            "prompt_eval_count": evaluated,
+            "prompt_eval_duration": evaluated * self.prompt_token_cost
+        }
+        self.prompt_evals.append(stats)
+        return stats
+    
+    def token_seconds(self) -> float:
+        return 1.0 / self.token_rate if self.token_rate else 0.0
+    
+    def eval_stats(self) -> Dict[str, int]:
+        return {
+            "eval_count": self.tokens,
+            "eval_duration": int(self.tokens * self.token_seconds() * 1e9) or 800
+        }
+
+def _chat_text(messages: List[Dict[str, str]]) -> str:
+    # Roughly what a chat template renders the message list to
+    return "".join(f"<|{m.get('role', '')}|>{m.get('content', '')}<|end|>" for m in messages)
+
+def create_app(state: StubOllamaState) -> FastAPI:
+    """
+    Create a minimal FastAPI app that mimics the Ollama endpoints used by the middle tier
+    
+    Args:
+        state: The counters to update on every request
+        
+    Returns:
+        The stub application
+    """
+    app = FastAPI()
+    # Created on first use so they belong to the server's event loop
+    locks: Dict[str, Any] = {}
+    
+    def slots() -> asyncio.Semaphore:
+        if "slots" not in locks:
+            locks["slots"] = asyncio.Semaphore(state.parallel or 1_000_000)
+            locks["load"] = asyncio.Lock()
+        return locks["slots"]
+    
+    async def ensure_loaded(model: str) -> int:
+        # Returns the load duration in nanoseconds, 0 when the model was resident
+        slots()
+        async with locks["load"]:
+            if model in state.loaded:
+                state.loaded.move_to_end(model)
+                return 0
+            if state.max_loaded and len(state.loaded) >= state.max_loaded:
+                state.loaded.popitem(last=False)
+                state.evictions += 1
+            if state.load_delay:
+                await asyncio.sleep(state.load_delay)
+            state.loaded[model] = None
+            state.loads += 1
+            return int(state.load_delay * 1e9)
+    
+    @app.middleware("http")
+    async def track_connections(request: Request, call_next):
+        # Each distinct client (host, port) pair is a distinct TCP connection
+        client = request.scope.get("client")
+        if client:
+            state.connections.add(tuple(client))
+        state.requests += 1
+        return await call_next(request)
+    
+    def text_field(chat: bool, text: str) -> Dict[str, Any]:
+        if chat:
+            return {"message": {"role": "assistant", "content": text}}
+        return {"response": text}
+    
+    async def stream_tokens(model: str, chat: bool, stats: Dict[str, int]):
+        state.streams_started += 1
+        async with slots():
+            load_duration = await ensure_loaded(model)
+            if state.latency:
+                await asyncio.sleep(state.latency)
+            for i in range(state.tokens):
+                if state.token_rate:
+                    await asyncio.sleep(state.token_seconds())
+                chunk = {"model": model, "created_at": datetime.utcnow().isoformat() + "Z", **text_field(chat, f"tok{i} "), "done": False}
+                yield json.dumps(chunk) + "\n"
+        state.streams_completed += 1
+        final = {
+            "model": model,
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            **text_field(chat, ""),
+            "done": True,
+            "total_duration": 1000 + load_duration + stats["prompt_eval_duration"],
+            "load_duration": load_duration,
+            "prompt_eval_count": stats["prompt_eval_count"],
+            "prompt_eval_duration": stats["prompt_eval_duration"],
+            **state.eval_stats()
+        }
+        yield json.dumps(final) + "\n"
+    
+    async def respond(body: Dict[str, Any], chat: bool, prompt: str):
+        model = body.get("model", "stub")
+        if body.get("keep_alive") == 0 and not prompt:
+            # Ollama's unload request
+            if state.unload_delay:
+                await asyncio.sleep(state.unload_delay)
+            state.loaded.pop(model, None)
+            return {"model": model, "created_at": datetime.utcnow().isoformat() + "Z", "response": "", "done": True}
+        stats = state.evaluate_prompt(model, prompt)
+        if body.get("stream"):
+            return StreamingResponse(stream_tokens(model, chat, stats), media_type="application/x-ndjson")
+        async with slots():
+            load_duration = await ensure_loaded(model)
+            if state.latency:
+                await asyncio.sleep(state.latency)
+            if state.token_rate:
+                await asyncio.sleep(state.tokens * state.token_seconds())
+        return {
+            "model": model,
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            **text_field(chat, "stub response"),
+            "done": True,
+            "load_duration": load_duration,
+            "prompt_eval_count": stats["prompt_eval_count"],
+            "prompt_eval_duration": stats["prompt_eval_duration"],
+            **state.eval_stats()
+        }
+    
+    @app.post("/api/generate")
+    async def generate(body: Dict[str, Any]):
+        return await respond(body, False, body.get("prompt", ""))
+    
+    @app.post("/api/chat")
+    async def chat(body: Dict[str, Any]):
+        return await respond(body, True, _chat_text(body.get("messages", [])))
+    
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": name, "model": name, "size": 0} for name in state.models]}
+    
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": model, "model": model, "size_vram": 0} for model in state.loaded]}
+    
+    return app
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class StubOllamaServer:
+    """
+    Run the stub Ollama app with uvicorn in a background thread
+    
+    Usage:
+        with StubOllamaServer(latency=0.01) as stub:
+            ollama_service.configure_backends([stub.api_url])
+    """
+    def __init__(
+        self,
+        latency: float = 0.0,
+        port: Optional[int] = None,
+        tokens: int = 20,
+        token_rate: float = 0.0,
+        prompt_token_cost: int = 1000,
+        load_delay: float = 0.0,
+        max_loaded: int = 0,
+        parallel: int = 0,
+        unload_delay: float = 0.0,
+        models: Optional[List[str]] = None
+    ):
+        self.state = StubOllamaState(
+            latency=latency,
+            tokens=tokens,
+            token_rate=token_rate,
+            prompt_token_cost=prompt_token_cost,
+            load_delay=load_delay,
+            max_loaded=max_loaded,
+            parallel=parallel,
+            unload_delay=unload_delay,
+            models=models
+        )
+        self.port = port or _free_port()
+        self.api_url = f"http://127.0.0.1:{self.port}/api"
+        config = uvicorn.Config(
+            create_app(self.state),
+            host="127.0.0.1",
+            port=self.port,
+            log_level="warning",
+            timeout_keep_alive=int(os.getenv("STUB_KEEPALIVE", "30"))
+        )
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+    
+    def __enter__(self) -> "StubOllamaServer":
+        self._thread.start()
+        deadline = time.time() + 10
+        while not self._server.started:
+            if time.time() > deadline:
+                raise RuntimeError("Stub Ollama server did not start")
+            time.sleep(0.01)
+        return self
+    
+    def __exit__(self, *exc) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+    
+    def wait(self) -> None:
+        """
+        Block until the server stops, such as on Ctrl-C
+        """
+        self._thread.join()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the stub Ollama server on its own, for manual runs against the middle tier")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the first token")
+    parser.add_argument("--tokens", type=int, default=20, help="Tokens per reply")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="Tokens per second; 0 for no delay")
+    parser.add_argument("--parallel", type=int, default=0, help="Generations run at once; 0 for no limit")
+    parser.add_argument("--load-delay", type=float, default=0.0, help="Seconds to load a model that is not resident")
+    parser.add_argument("--max-loaded", type=int, default=0, help="Models resident at once; 0 for no limit")
+    parser.add_argument("--models", default="stub-model", help="Comma-separated models listed by /api/tags")
+    args = parser.parse_args()
+    
+    with StubOllamaServer(
+        latency=args.latency,
+        port=args.port,
+        tokens=args.tokens,
+        token_rate=args.token_rate,
+        parallel=args.parallel,
+        load_delay=args.load_delay,
+        max_loaded=args.max_loaded,
+        models=[name.strip() for name in args.models.split(",") if name.strip()]
+    ) as stub:
+        print(f"Stub Ollama listening on {stub.api_url}", flush=True)
+        try:
+            stub.wait()
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()